@@ -0,0 +1,141 @@
+"""
+Benchmark append and load rates of the embedded repository backends.
+
+Commits events for a number of aggregate roots (one event per commit, the
+aggregate roots interleaved like in a real command stream) and then loads
+every aggregate root. The log backend is loaded before and after compacting
+its sealed segments.
+
+The Kafka backend is only benchmarked when `EVENT_STORE_KAFKA` is set to a
+broker address, the schema registry is read from `EVENT_STORE_SCHEMA_REGISTRY`
+(default http://localhost:8081). The events are committed to a new topic
+that is deleted afterwards. Its load path scans the partition of the
+aggregate root (see `KafkaAvroBackend.get_events`), so only a sample of the
+aggregate roots is loaded.
+
+Usage:
+    EVENT_STORE_KAFKA=localhost:9092 python benchmarks/event_store.py [num_events] [num_aggregates]
+"""
+
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+import structlog
+from confluent_kafka import avro
+from confluent_kafka.admin import AdminClient, NewTopic
+
+from eventsourcing_helpers.repository.backends.kafka import KafkaAvroBackend
+from eventsourcing_helpers.repository.backends.log import LogBackend
+from eventsourcing_helpers.repository.backends.sqlite import SQLiteBackend
+
+from confluent_kafka_helpers.schema_registry import AvroSchemaRegistry
+
+KAFKA_SERVERS = os.environ.get("EVENT_STORE_KAFKA")
+SCHEMA_REGISTRY_URL = os.environ.get("EVENT_STORE_SCHEMA_REGISTRY", "http://localhost:8081")
+KAFKA_PARTITIONS = 12
+KAFKA_LOAD_SAMPLE = 50
+
+EVENT_SCHEMA = {
+    "type": "record",
+    "name": "Event",
+    "fields": [
+        {"name": "class", "type": "string"},
+        {
+            "name": "data",
+            "type": {
+                "type": "record",
+                "name": "Incremented",
+                "fields": [
+                    {"name": "amount", "type": "long"},
+                    {"name": "reason", "type": "string"},
+                ],
+            },
+        },
+    ],
+}
+
+
+def create_event(amount):
+    return {"class": "Incremented", "data": {"amount": amount, "reason": "benchmark" * 4}}
+
+
+def measure_append(backend, num_events: int, ids: list, flush=None) -> float:
+    start = time.perf_counter()
+    for amount in range(num_events):
+        backend.commit(ids[amount % len(ids)], [create_event(amount)])
+    if flush is not None:
+        flush()
+    return num_events / (time.perf_counter() - start)
+
+
+def measure_load(backend, ids: list, num_ids: int = None) -> float:
+    ids = random.sample(ids, num_ids or len(ids))
+    start = time.perf_counter()
+    num_events = sum(1 for id in ids for _ in backend.get_events(id))
+    return num_events / (time.perf_counter() - start)
+
+
+def run(num_events: int, num_aggregates: int) -> None:
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    ids = [f"aggregate-{i}" for i in range(num_aggregates)]
+    print(f"events: {num_events}, aggregates: {num_aggregates}")
+
+    with tempfile.TemporaryDirectory() as path:
+        sqlite = SQLiteBackend({"path": f"{path}/events.db"})
+        log = LogBackend({"path": f"{path}/log", "segment_bytes": 4 * 1024 * 1024})
+
+        for name, backend in (("SQLiteBackend", sqlite), ("LogBackend", log)):
+            append = measure_append(backend, num_events, ids)
+            load = measure_load(backend, ids)
+            print(f"  {name:<24} append {append:10.1f} events/s  load {load:10.1f} events/s")
+
+        log.compact()
+        load = measure_load(log, ids)
+        print(f"  {'LogBackend (compacted)':<24} {'':25}  load {load:10.1f} events/s")
+        log.close()
+
+    if KAFKA_SERVERS:
+        run_kafka(num_events, ids)
+    else:
+        print("  KafkaAvroBackend skipped, set EVENT_STORE_KAFKA to a broker address")
+
+
+def run_kafka(num_events: int, ids: list) -> None:
+    topic = f"eventsourcing-benchmark-{uuid.uuid4()}"
+    admin = AdminClient({"bootstrap.servers": KAFKA_SERVERS})
+    for future in admin.create_topics([NewTopic(topic, KAFKA_PARTITIONS, 1)]).values():
+        future.result()
+    registry = AvroSchemaRegistry(SCHEMA_REGISTRY_URL)
+    registry.client.register(f"{topic}-key", avro.loads('"string"'))
+    registry.client.register(f"{topic}-value", avro.loads(json.dumps(EVENT_SCHEMA)))
+
+    try:
+        kafka = KafkaAvroBackend(
+            {
+                "bootstrap.servers": KAFKA_SERVERS,
+                "schema.registry.url": SCHEMA_REGISTRY_URL,
+                "producer": {"topics": [topic]},
+                "loader": {"topic": topic, "num_partitions": KAFKA_PARTITIONS, "consumer": {}},
+            }
+        )
+        append = measure_append(kafka, num_events, ids, flush=kafka.producer.flush)
+        load = measure_load(kafka, ids, min(KAFKA_LOAD_SAMPLE, len(ids)))
+        print(
+            f"  {'KafkaAvroBackend':<24} append {append:10.1f} events/s  load {load:10.1f} events/s"
+        )
+    finally:
+        for future in admin.delete_topics([topic]).values():
+            future.result()
+
+
+if __name__ == "__main__":
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+    )
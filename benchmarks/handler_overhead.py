@@ -0,0 +1,113 @@
+"""
+Benchmark the per-message overhead of `EventHandler.handle`.
+
+Compares the prebuilt middleware chain with wrapping the handler in a new
+`metrics.timed` decorator for every message, with metrics disabled and enabled.
+The enabled case uses an in-process statsd client that discards all metrics,
+so only the client side overhead is measured.
+
+Usage:
+    python benchmarks/handler_overhead.py [iterations]
+"""
+
+import logging
+import sys
+import time
+from timeit import timeit
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import structlog
+
+from eventsourcing_helpers import metrics
+from eventsourcing_helpers.event_handler import EventHandler
+from eventsourcing_helpers.tracing import get_datadog_service_name
+from eventsourcing_helpers.utils import get_callable_representation
+
+
+class DiscardingStatsd:
+    """
+    Statsd client with the same call shape as `datadog.statsd` that sends nothing.
+    """
+
+    def increment(self, metric, value=1, tags=None, sample_rate=None):
+        pass
+
+    def timing(self, metric, value, tags=None, sample_rate=None):
+        pass
+
+    def timed(self, metric=None, tags=None, sample_rate=None, use_ms=None):
+        return TimedDecorator(self, metric, tags)
+
+
+class TimedDecorator:
+    def __init__(self, statsd, metric, tags):
+        self.statsd, self.metric, self.tags = statsd, metric, tags
+
+    def __call__(self, f):
+        def wrapped(*args, **kwargs):
+            with self:
+                return f(*args, **kwargs)
+
+        return wrapped
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *args):
+        self.statsd.timing(self.metric, time.monotonic() - self.start, tags=self.tags)
+
+
+class FooEvent:
+    def __init__(self, id):
+        self.id = id
+
+
+def foo_event(event):
+    pass
+
+
+class FooEventHandler(EventHandler):
+    handlers = {FooEvent: foo_event}
+
+
+def legacy_handle(event):
+    """
+    Per-message wrapping as done before the middleware chain was prebuilt.
+    """
+    get_datadog_service_name()
+    handler_name = get_callable_representation(foo_event)
+    tags = [
+        "message_type:event",
+        f"message_class:{event.__class__.__name__}",
+        f"handler:{handler_name}",
+    ]
+    metrics.timed("eventsourcing_helpers.handler.handle", tags=tags)(foo_event)(event)
+
+
+def run(iterations: int) -> None:
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    event = FooEvent(id=1)
+    message = SimpleNamespace(value={"class": "FooEvent", "data": {"id": 1}})
+
+    for name, statsd in (("disabled", metrics.StatsdNullClient()), ("enabled", DiscardingStatsd())):
+        with patch.object(metrics, "statsd", statsd):
+            handler = FooEventHandler(message_deserializer=lambda message, **kwargs: event)
+            route = handler._routes["FooEvent"]
+
+            results = {
+                "legacy wrapping": timeit(lambda: legacy_handle(event), number=iterations),
+                "prebuilt chain": timeit(lambda: route.call(event), number=iterations),
+                "handle (incl. tracing)": timeit(
+                    lambda: handler.handle(message), number=iterations
+                ),
+            }
+
+        print(f"metrics {name}:")
+        for label, seconds in results.items():
+            print(f"  {label:<24} {seconds / iterations * 1e6:8.2f} us/message")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
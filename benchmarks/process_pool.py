@@ -0,0 +1,81 @@
+"""
+Benchmark throughput of CPU bound event handlers in a process pool.
+
+Handles batches of events with `EventHandler` (one core) and with
+`ProcessPoolEventHandler` using an increasing number of worker processes.
+
+Usage:
+    python benchmarks/process_pool.py [num_events] [work]
+"""
+
+import logging
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import structlog
+
+from eventsourcing_helpers.event_handler import EventHandler, ProcessPoolEventHandler
+from eventsourcing_helpers.message import MessageMeta
+
+WORK = int(sys.argv[2]) if len(sys.argv) > 2 else 200_000
+
+
+def calculate_price(event):
+    return sum(i * i for i in range(event.work)) % 997
+
+
+class PriceEventHandler(EventHandler):
+    handlers = {"PriceRequested": calculate_price}
+
+
+class PoolPriceEventHandler(ProcessPoolEventHandler):
+    handlers = {"PriceRequested": calculate_price}
+
+
+def create_messages(num_events):
+    # one key per message so the messages can be handled in parallel.
+    return [
+        SimpleNamespace(
+            value={"class": "PriceRequested", "data": {"work": WORK}},
+            _meta=MessageMeta(offset=offset, partition=0, topic="prices", key=str(offset)),
+        )
+        for offset in range(num_events)
+    ]
+
+
+def measure(handler, messages) -> float:
+    start = time.perf_counter()
+    handler.handle_batch(messages)
+    return len(messages) / (time.perf_counter() - start)
+
+
+def run(num_events: int) -> None:
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    messages = create_messages(num_events)
+    cpu_count = os.cpu_count() or 1
+
+    baseline = measure(PriceEventHandler(), messages)
+    print(f"cpus: {cpu_count}, events: {num_events}, work: {WORK}")
+    print(f"  EventHandler                {baseline:8.1f} events/s")
+
+    workers = 1
+    while True:
+        PoolPriceEventHandler.max_workers = workers
+        handler = PoolPriceEventHandler()  # warms up the pool
+        try:
+            throughput = measure(handler, messages)
+        finally:
+            handler.close()
+        print(
+            f"  ProcessPool ({workers:>2} workers)    {throughput:8.1f} events/s"
+            f"  ({throughput / baseline:.2f}x)"
+        )
+        if workers >= cpu_count:
+            break
+        workers = min(workers * 2, cpu_count)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,62 @@
+"""
+Benchmark the per-message tracing overhead of `EventHandler.handle`.
+
+Handles the same message with different trace sample ratios. Spans are
+recorded by the OpenTelemetry SDK (without exporting) if it is installed,
+otherwise by the no-op tracer of the OpenTelemetry API.
+
+Usage:
+    python benchmarks/tracing.py [iterations]
+"""
+
+import logging
+import sys
+from timeit import timeit
+from types import SimpleNamespace
+
+import structlog
+from opentelemetry import trace
+
+from eventsourcing_helpers.event_handler import EventHandler
+from eventsourcing_helpers.tracing import TraceSampler
+
+
+class FooEvent:
+    def __init__(self, id):
+        self.id = id
+
+
+def foo_event(event):
+    pass
+
+
+def configure_tracer() -> str:
+    try:
+        from opentelemetry.sdk.trace import TracerProvider
+    except ModuleNotFoundError:
+        return "opentelemetry api (no-op)"
+
+    trace.set_tracer_provider(TracerProvider())
+    return "opentelemetry sdk"
+
+
+def run(iterations: int) -> None:
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    print(f"tracer: {configure_tracer()}")
+
+    event = FooEvent(id=1)
+    message = SimpleNamespace(value={"class": "FooEvent", "data": {"id": 1}})
+
+    for ratio in (1.0, 0.1, 0.0):
+
+        class FooEventHandler(EventHandler):
+            handlers = {FooEvent: foo_event}
+            trace_sampler = TraceSampler(ratio=ratio)
+
+        handler = FooEventHandler(message_deserializer=lambda message, **kwargs: event)
+        seconds = timeit(lambda: handler.handle(message), number=iterations)
+        print(f"  ratio {ratio:<4} {seconds / iterations * 1e6:8.2f} us/message")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -1,27 +1,49 @@
-from typing import Any, Union
+from typing import Any, Dict, List, Tuple, Union
 
 import structlog
 
-from eventsourcing_helpers.handler import Handler
+from eventsourcing_helpers.handler import (
+    AsyncHandler,
+    BaseHandler,
+    BatchError,
+    Handler,
+    HandlerRoute,
+)
+from eventsourcing_helpers.idempotency import IdempotencyStore
 from eventsourcing_helpers.metrics import statsd
+from eventsourcing_helpers.middleware import Middleware, count_errors
 from eventsourcing_helpers.models import AggregateRoot
 from eventsourcing_helpers.repository import Repository
-from eventsourcing_helpers.tracing import attrs, get_datadog_service_name, tracer
-from eventsourcing_helpers.utils import get_callable_representation
+from eventsourcing_helpers.repository.cache import AggregateCache
+from eventsourcing_helpers.repository.prefetch import AggregatePrefetcher
+from eventsourcing_helpers.tracing import attrs, tracer
 
 from confluent_kafka_helpers.message import Message
 
 logger = structlog.get_logger(__name__)
 
 
-class CommandHandler(Handler):
+def get_message_position(message: Message) -> Union[Tuple[str, int, int], None]:
     """
-    Command handler.
+    Get the topic, partition and offset of a consumed message.
 
-    Handles a command by calling the correct function or method in a handler
-    class.
+    Returns None if the message has no known position, e.g. in tests.
+    """
+    meta = getattr(message, "_meta", None)
+    offset = getattr(meta, "offset", None)
+    topic, partition = getattr(meta, "topic", None), getattr(meta, "partition", None)
+    if not isinstance(offset, int) or topic is None or partition is None:
+        return None
+    return topic, partition, offset
+
+
+class BaseCommandHandler(BaseHandler):
+    """
+    Command routing shared by `CommandHandler` and `AsyncCommandHandler`.
     """
 
+    message_type = "command"
+
     def _can_handle_command(self, message: Message) -> bool:
         """
         Checks if the command is something we can handle.
@@ -33,12 +55,21 @@ class CommandHandler(Handler):
             bool: Flag to indicate if we can handle the command.
         """
         command_class = message.value["class"]
-        if command_class not in self.handlers:
+        if not self.can_handle_class(command_class):
             logger.debug("Unhandled command", command_class=command_class)
             return False
 
         return True
 
+
+class CommandHandler(BaseCommandHandler, Handler):
+    """
+    Command handler.
+
+    Handles a command by calling the correct function or method in a handler
+    class.
+    """
+
     def _handle_command(self, command: Any, handler_inst: Any = None) -> None:
         """
         Get and call the correct command handler.
@@ -52,13 +83,18 @@ class CommandHandler(Handler):
                 of the aggregate root.
         """
         command_class = command._class
-        handler = self.handlers[command_class]
+        call = self._routes[command_class].call
 
         logger.info("Calling command handler", command_class=command_class)
         if handler_inst:
-            handler(handler_inst, command)
+            call(handler_inst, command)
         else:
-            handler(command)
+            call(command)
+
+    def _process(self, message: Message, route: HandlerRoute) -> None:
+        self._handle_command(
+            self.message_deserializer(message, deserialize_class=route.deserialize_class)
+        )
 
     def handle(self, message: Message) -> None:
         """
@@ -72,12 +108,16 @@ class CommandHandler(Handler):
 
         command_class = message.value["class"]
         logger.info("Handling command", command_class=command_class)
-        handler = self.handlers[command_class]
-        handler_name = get_callable_representation(handler)
+        route = self._routes[command_class]
+        if not self.trace_sampler.sample(command_class):
+            self._handle_unsampled("eventsourcing_helpers.handle_command", route, message)
+            return
+
+        handler_name = route.handler_name
 
         # this is the first span from the applications perspective and will will act as the "service
         # entry" span
-        service_name = get_datadog_service_name()
+        service_name = self._service_name
         with tracer.start_span(
             name="eventsourcing_helpers.handle_command",
             service_name=service_name,
@@ -89,21 +129,75 @@ class CommandHandler(Handler):
                 service_name=service_name,
                 system=None,
             ):
-                command = self.message_deserializer(message)
+                command = self.message_deserializer(
+                    message, deserialize_class=route.deserialize_class
+                )
 
             span.set_attribute(
                 attrs.MESSAGING_OPERATION_TYPE,
                 attrs.MESSAGING_OPERATION_TYPE_VALUE_PROCESS,
             )
-            with statsd.timed(
-                "eventsourcing_helpers.handler.handle",
-                tags=[
-                    "message_type:command",
-                    f"message_class:{command_class}",
-                    f"handler:{handler_name}",
-                ],
+            self._handle_command(command)
+
+
+class AsyncCommandHandler(BaseCommandHandler, AsyncHandler):
+    """
+    Command handler for coroutine handler functions.
+    """
+
+    async def _handle_command(self, command: Any, handler_inst: Any = None) -> None:
+        command_class = command._class
+        call = self._routes[command_class].call
+
+        logger.info("Calling command handler", command_class=command_class)
+        if handler_inst:
+            await call(handler_inst, command)
+        else:
+            await call(command)
+
+    async def _process(self, message: Message, route: HandlerRoute) -> None:
+        await self._handle_command(
+            self.message_deserializer(message, deserialize_class=route.deserialize_class)
+        )
+
+    async def handle(self, message: Message) -> None:
+        """
+        Apply correct handler for the received command.
+
+        Args:
+            message: Consumed message from the bus.
+        """
+        if not self._can_handle_command(message):
+            return
+
+        command_class = message.value["class"]
+        logger.info("Handling command", command_class=command_class)
+        route = self._routes[command_class]
+        if not self.trace_sampler.sample(command_class):
+            await self._handle_unsampled("eventsourcing_helpers.handle_command", route, message)
+            return
+
+        service_name = self._service_name
+        with tracer.start_span(
+            name="eventsourcing_helpers.handle_command",
+            service_name=service_name,
+            resource_name=route.handler_name,
+            system=None,
+        ) as span:
+            with tracer.start_span(
+                name="eventsourcing_helpers.deserialize_message",
+                service_name=service_name,
+                system=None,
             ):
-                self._handle_command(command)
+                command = self.message_deserializer(
+                    message, deserialize_class=route.deserialize_class
+                )
+
+            span.set_attribute(
+                attrs.MESSAGING_OPERATION_TYPE,
+                attrs.MESSAGING_OPERATION_TYPE_VALUE_PROCESS,
+            )
+            await self._handle_command(command)
 
 
 class ESCommandHandler(CommandHandler):
@@ -115,10 +209,29 @@ class ESCommandHandler(CommandHandler):
 
     The resulting staged events are published to a message bus and persisted in
     an event store using a repository.
+
+    With `prefetch_config` the aggregate roots of the next commands in a batch
+    are loaded while the current one is handled.
+
+    Example:
+        >>> class OrderCommandHandler(ESCommandHandler):
+        ...     handlers = {"CreateOrder": Order.create_order}
+        ...     aggregate_root = Order
+        ...     repository_config = config
+        ...     prefetch_config = {"workers": 4, "lookahead": 8}
     """
 
     aggregate_root: Union[AggregateRoot, None] = None
     repository_config: Union[dict, None] = None
+    # keep recently committed aggregate roots in memory, see `AggregateCache`
+    # for the options. Example: {"max_entries": 10000}
+    aggregate_cache_config: Union[dict, None] = None
+    # skip duplicate commands before the aggregate root is loaded, see
+    # `IdempotencyStore` for the options. Example: {"key_header": "command_id"}
+    idempotency_config: Union[dict, None] = None
+    # load the aggregate roots of the next commands in a batch while the
+    # current one is handled, see `AggregatePrefetcher` for the options.
+    prefetch_config: Union[dict, None] = None
 
     def __init__(self, *args, repository: Any = Repository, **kwargs) -> None:
         super().__init__(*args, **kwargs)
@@ -126,6 +239,34 @@ class ESCommandHandler(CommandHandler):
         assert self.repository_config
 
         self.repository = repository(self.repository_config, self.aggregate_root, **kwargs)
+        self.aggregate_cache = None
+        if self.aggregate_cache_config is not None:
+            # write-behind snapshots are serialized after the commit, a
+            # cached aggregate root could be changed at the same time.
+            assert "write_behind" not in self.repository_config.get(
+                "snapshot", {}
+            ), "The aggregate cache can't be used with write-behind snapshots"
+            self.aggregate_cache = AggregateCache(**self.aggregate_cache_config)
+        self.idempotency_store = None
+        if self.idempotency_config is not None:
+            self.idempotency_store = IdempotencyStore(self.idempotency_config)
+        self.prefetcher = None
+        if self.prefetch_config is not None:
+            self.prefetcher = AggregatePrefetcher(self._load_aggregate_root, **self.prefetch_config)
+
+    def on_revoke(self, partitions: List[Tuple[str, int]]) -> None:
+        if self.aggregate_cache is not None:
+            self.aggregate_cache.revoke(partitions)
+        # the new owner of the partitions should load the latest snapshots
+        self.repository.snapshot.flush()
+
+    def _get_middleware(self) -> List[Middleware]:
+        # the handler call is timed together with loading and committing the
+        # aggregate root in `handle`.
+        return [
+            count_errors("eventsourcing_helpers.handler.handle.error"),
+            *self.middleware,
+        ]
 
     def _get_aggregate_root(self, id: str) -> AggregateRoot:
         """
@@ -139,6 +280,54 @@ class ESCommandHandler(CommandHandler):
         """
         return self.repository.load(id)
 
+    def _load_aggregate_root(self, id: str, message: Message) -> AggregateRoot:
+        """
+        Get latest state of the aggregate root, from the aggregate cache if
+        possible.
+
+        Args:
+            id: ID of the aggregate root.
+            message: The first message about to be applied on the aggregate.
+
+        Returns:
+            AggregateRoot: Aggregate root instance with the latest state.
+        """
+        position = get_message_position(message)
+        if self.aggregate_cache is not None and position is not None:
+            aggregate_root = self.aggregate_cache.pop(id, *position)
+            if aggregate_root is not None:
+                return aggregate_root
+
+        return self._get_aggregate_root(id)
+
+    def _cache_aggregate_root(self, aggregate_root: AggregateRoot, message: Message) -> None:
+        """
+        Put a committed aggregate root in the aggregate cache.
+
+        Args:
+            aggregate_root: Aggregate root without staged events.
+            message: The last message applied on the aggregate.
+        """
+        position = get_message_position(message)
+        if self.aggregate_cache is not None and position is not None:
+            self.aggregate_cache.put(aggregate_root, *position)
+
+    def _get_idempotency_key(self, message: Message, command: Any) -> Union[str, None]:
+        if self.idempotency_store is None:
+            return None
+        return self.idempotency_store.get_key(message, command)
+
+    def _is_duplicate(self, key: Union[str, None]) -> bool:
+        return key is not None and self.idempotency_store.seen(key)  # type: ignore
+
+    def _set_command_handled(self, key: Union[str, None]) -> None:
+        if key is not None:
+            self.idempotency_store.set_seen(key)  # type: ignore
+
+    def _invalidate_prefetch(self, id: str) -> None:
+        if self.prefetcher is not None:
+            self.prefetcher.invalidate(id)
+
     def _commit_staged_events(self, aggregate_root: AggregateRoot) -> None:
         """
         Commit staged events to the repository.
@@ -148,7 +337,7 @@ class ESCommandHandler(CommandHandler):
         """
         self.repository.commit(aggregate_root)
 
-    def handle(self, message: dict) -> None:
+    def handle(self, message: Message) -> None:
         """
         Apply correct handler for the received command.
 
@@ -161,24 +350,21 @@ class ESCommandHandler(CommandHandler):
         if not self._can_handle_command(message):
             return
 
-        command = self.message_deserializer(message)
+        route = self._routes[message.value["class"]]
+        command = self.message_deserializer(message, deserialize_class=route.deserialize_class)
         logger.info("Handling command", command_class=command._class)
+        key = self._get_idempotency_key(message, command)
+        if self._is_duplicate(key):
+            return
 
-        command_class = command._class
-        handler = self.handlers[command_class]
-        handler_name = get_callable_representation(handler)
-        with statsd.timed(
-            "eventsourcing_helpers.handler.handle",
-            tags=[
-                "message_type:command",
-                f"message_class:{command_class}",
-                f"handler:{handler_name}",
-            ],
-        ):
-            aggregate_root = self._get_aggregate_root(command.id)
+        with statsd.timed("eventsourcing_helpers.handler.handle", tags=route.tags):
+            aggregate_root = self._load_aggregate_root(command.id, message)
             try:
                 self._handle_command(command, handler_inst=aggregate_root)
             except Exception as e:
+                # don't let the events of a failed command leak into the next
+                # command, e.g. when the failed command is retried.
+                aggregate_root._clear_staged_events()
                 self.repository.snapshot.delete(aggregate_root)
                 statsd.increment(  # type: ignore
                     "eventsourcing_helpers.snapshot.cache.delete",
@@ -186,3 +372,143 @@ class ESCommandHandler(CommandHandler):
                 )
                 raise e
             self._commit_staged_events(aggregate_root)
+            self._invalidate_prefetch(command.id)
+            self._set_command_handled(key)
+            self._cache_aggregate_root(aggregate_root, message)
+
+    def _group_commands(self, messages: List[Message]) -> Dict[str, List[Tuple[Message, Any]]]:
+        """
+        Deserialize handled commands and group them by aggregate root id.
+
+        The order of the commands is preserved within each group. Duplicate
+        commands are dropped.
+        """
+        groups: Dict[str, List[Tuple[Message, Any]]] = {}
+        keys = set()
+        for message in messages:
+            if not self._can_handle_command(message):
+                continue
+            route = self._routes[message.value["class"]]
+            command = self.message_deserializer(message, deserialize_class=route.deserialize_class)
+            key = self._get_idempotency_key(message, command)
+            if key in keys or self._is_duplicate(key):
+                continue
+            if key is not None:
+                keys.add(key)
+            groups.setdefault(command.id, []).append((message, command))
+
+        return groups
+
+    def _handle_group(
+        self,
+        id: str,
+        commands: List[Tuple[Message, Any]],
+        aggregate_root: Union[AggregateRoot, None] = None,
+    ) -> None:
+        """
+        Apply all commands for one aggregate root and commit them together.
+
+        If any command fails nothing is committed and the commands are handled
+        one at a time instead, so the events of the commands before the
+        failing one are committed.
+
+        Args:
+            id: ID of the aggregate root.
+            commands: Messages and commands for the aggregate root.
+            aggregate_root (optional): Already loaded aggregate root.
+
+        Raises:
+            BatchError: With the failing command and the ones after it when
+                a command fails on its own.
+        """
+        if aggregate_root is None:
+            aggregate_root = self._load_aggregate_root(id, commands[0][0])
+        try:
+            for _, command in commands:
+                self._handle_command(command, handler_inst=aggregate_root)
+        except Exception:
+            logger.warning(
+                "Batch failed, falling back to handling one command at a time",
+                id=id,
+                num_commands=len(commands),
+                exc_info=True,
+            )
+            aggregate_root._clear_staged_events()
+            self.repository.snapshot.delete(aggregate_root)
+            statsd.increment(  # type: ignore
+                "eventsourcing_helpers.snapshot.cache.delete", tags=[f"id={id}"]
+            )
+            statsd.increment(  # type: ignore
+                "eventsourcing_helpers.handler.handle_batch.fallback",
+                tags=[f"message_type:{self.message_type}"],
+            )
+            for i, (message, _) in enumerate(commands):
+                try:
+                    self.handle(message)
+                except Exception as e:
+                    raise BatchError([message for message, _ in commands[i:]]) from e
+            return
+
+        self._commit_staged_events(aggregate_root)
+        self._invalidate_prefetch(id)
+        for message, command in commands:
+            self._set_command_handled(self._get_idempotency_key(message, command))
+        self._cache_aggregate_root(aggregate_root, commands[-1][0])
+
+    def handle_batch(self, messages: List[Message]) -> None:
+        """
+        Handle a batch of commands.
+
+        Commands are grouped by aggregate root id, each aggregate root is
+        loaded once, all of its commands are applied in order and the staged
+        events are committed once, which also means one snapshot per aggregate
+        root. With `prefetch_config` the next aggregate roots are loaded while
+        the current one is handled.
+
+        Args:
+            messages: Consumed messages from the bus, in consumed order.
+
+        Raises:
+            BatchError: If a command failed, with the messages that were not
+                handled. The consumer commits the offsets of the other ones, so
+                their events aren't committed again on redelivery.
+        """
+        groups = self._group_commands(messages)
+        logger.info("Handling command batch", num_commands=len(messages), num_ids=len(groups))
+
+        tags = [f"message_type:{self.message_type}"]
+        ids = list(groups)
+        with statsd.timed("eventsourcing_helpers.handler.handle_batch", tags=tags):
+            try:
+                for i in range(len(ids)):
+                    try:
+                        self._handle_next_group(ids, i, groups)
+                    except BatchError as e:
+                        unhandled = self._get_group_messages(groups, ids[i + 1 :])  # noqa: E203
+                        e.unhandled.extend(unhandled)
+                        raise
+                    except Exception as e:
+                        raise BatchError(self._get_group_messages(groups, ids[i:])) from e
+            finally:
+                if self.prefetcher is not None:
+                    self.prefetcher.clear()
+
+    def _handle_next_group(
+        self, ids: List[str], i: int, groups: Dict[str, List[Tuple[Message, Any]]]
+    ) -> None:
+        """
+        Handle the commands of the i:th aggregate root of a batch and start
+        prefetching the ones after it.
+        """
+        id, aggregate_root = ids[i], None
+        if self.prefetcher is not None:
+            for next_id in ids[i + 1 : i + 1 + self.prefetcher.lookahead]:  # noqa: E203
+                self.prefetcher.prefetch(next_id, groups[next_id][0][0])
+            aggregate_root = self.prefetcher.get(id, groups[id][0][0])
+        self._handle_group(id, groups[id], aggregate_root)
+
+    @staticmethod
+    def _get_group_messages(
+        groups: Dict[str, List[Tuple[Message, Any]]], ids: List[str]
+    ) -> List[Message]:
+        return [message for id in ids for message, _ in groups[id]]
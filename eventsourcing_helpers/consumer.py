@@ -1,4 +1,6 @@
-from eventsourcing_helpers.handler import Handler
+from typing import Union
+
+from eventsourcing_helpers.handler import AsyncHandler, Handler
 from eventsourcing_helpers.messagebus import MessageBus
 
 
@@ -7,9 +9,42 @@ class Consumer:
     Helper to consume and handle messages from the bus.
     """
 
-    def __init__(self, messagebus: MessageBus, handler: Handler) -> None:
+    def __init__(self, messagebus: MessageBus, handler: Union[Handler, AsyncHandler]) -> None:
         self._messagebus = messagebus
         self._handler = handler
 
     def consume(self) -> None:
-        self._messagebus.consume(handler=self._handler.handle)
+        self._messagebus.consume(
+            handler=self._handler.handle,
+            message_filter=self._handler.can_handle_class,
+            on_revoke=self._handler.on_revoke,
+        )
+
+    def consume_batch(self, **kwargs) -> None:
+        """
+        Consume and handle messages in batches, see `Handler.handle_batch`.
+
+        Args:
+            kwargs: Options passed on to the message bus, e.g. `batch_size`.
+        """
+        self._messagebus.consume_batch(
+            handler=self._handler.handle_batch,
+            message_filter=self._handler.can_handle_class,
+            on_revoke=self._handler.on_revoke,
+            **kwargs,
+        )
+
+    async def consume_async(self, **kwargs) -> None:
+        """
+        Consume and handle messages concurrently with an async handler, e.g.
+        `AsyncEventHandler`.
+
+        Args:
+            kwargs: Options passed on to the message bus, e.g. `max_in_flight`.
+        """
+        await self._messagebus.consume_async(
+            handler=self._handler.handle,
+            message_filter=self._handler.can_handle_class,
+            on_revoke=self._handler.on_revoke,
+            **kwargs,
+        )
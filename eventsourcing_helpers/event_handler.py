@@ -1,19 +1,53 @@
+import asyncio
+import contextvars
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from inspect import iscoroutinefunction
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, Hashable, List, Set, Tuple, Union
+
 import structlog
 
-from eventsourcing_helpers import metrics
-from eventsourcing_helpers.handler import Handler
-from eventsourcing_helpers.tracing import attrs, get_datadog_service_name, tracer
-from eventsourcing_helpers.utils import get_callable_representation
+from eventsourcing_helpers.handler import AsyncHandler, BaseHandler, Handler, HandlerRoute
+from eventsourcing_helpers.message import MessageMeta
+from eventsourcing_helpers.metrics import statsd
+from eventsourcing_helpers.serializers import from_message_to_dto
+from eventsourcing_helpers.tracing import attrs, tracer
 
 from confluent_kafka_helpers.message import Message
 
 logger = structlog.get_logger(__name__)
 
 
-class EventHandler(Handler):
+def batch_handler(handler: Callable) -> Callable:
     """
-    Application service that calls the correct domain handler for an event.
+    Mark an event handler as a batch handler.
+
+    A batch handler is called with a list of events of the same class instead
+    of one event at a time, e.g. to write a projection with one bulk insert.
+    Used with `Consumer.consume_batch` the batches are bounded by the batch
+    size and timeout, and offsets are committed when the handler returns.
+
+    Example:
+        >>> @batch_handler
+        ... def order_created(events):
+        ...     db.orders.insert_many([e.to_dict() for e in events])
     """
+    handler.__batch_handler__ = True  # type: ignore
+    return handler
+
+
+def is_batch_handler(handler: Any) -> bool:
+    return getattr(handler, "__batch_handler__", False) is True
+
+
+class BaseEventHandler(BaseHandler):
+    """
+    Event routing shared by `EventHandler` and `AsyncEventHandler`.
+    """
+
+    message_type = "event"
+    timed_metric = "eventsourcing_helpers.handler.handle.time"
 
     def _find_handler(self, event_class: str) -> tuple:
         """
@@ -27,17 +61,20 @@ class EventHandler(Handler):
         Returns:
             Found handler function and optional message deserializer class.
         """
-        if event_class in self.handlers:
-            return self.handlers[event_class], None
+        route = self._routes.get(event_class)
+        if route is None:
+            return None, None
 
-        for key in self.handlers.keys():
-            try:
-                if key.__name__ == event_class:
-                    return self.handlers[key], key
-            except AttributeError:
-                pass
+        return route.handler, route.deserialize_class
 
-        return None, None
+    def _create_route(
+        self, message_class: str, handler: Callable, deserialize_class: Union[type, None]
+    ) -> HandlerRoute:
+        route = super()._create_route(message_class, handler, deserialize_class)
+        return route._replace(batch=is_batch_handler(handler))
+
+    def _call(self, route: HandlerRoute, event: Any) -> Any:
+        return route.call([event]) if route.batch else route.call(event)
 
     def _can_handle_command(self, message: Message) -> bool:
         """
@@ -50,14 +87,31 @@ class EventHandler(Handler):
             bool: Flag to indicate if we can handle the event.
         """
         event_class = message.value["class"]
-        handler, _ = self._find_handler(event_class)
-
-        if handler is None:
+        if not self.can_handle_class(event_class):
             logger.debug("Unhandled event", event_class=event_class)
             return False
 
         return True
 
+
+class EventHandler(BaseEventHandler, Handler):
+    """
+    Application service that calls the correct domain handler for an event.
+    """
+
+    # only handle the last event per message key and event class in
+    # `handle_batch`, e.g. for projections that only care about the latest
+    # state. Events without a key are always handled.
+    coalesce_events: bool = False
+    # optional function reducing all events per message key and event class
+    # in a batch into one event, called with the events in consumed order.
+    coalesce_reducer: Union[Callable, None] = None
+
+    def _process(self, message: Message, route: HandlerRoute) -> None:
+        self._call(
+            route, self.message_deserializer(message, deserialize_class=route.deserialize_class)
+        )
+
     def handle(self, message: Message) -> None:
         """
         Apply correct handler for received event.
@@ -71,12 +125,16 @@ class EventHandler(Handler):
         event_class = message.value["class"]
         logger.info("Handling event", event_class=event_class)
 
-        handler, deserialize_class = self._find_handler(event_class)
-        handler_name = get_callable_representation(handler)
+        route = self._routes[event_class]
+        if not self.trace_sampler.sample(event_class):
+            self._handle_unsampled("eventsourcing_helpers.handle_event", route, message)
+            return
+
+        handler_name = route.handler_name
 
         # this is the first span from the applications perspective and will will act as the "service
         # entry" span
-        service_name = get_datadog_service_name()
+        service_name = self._service_name
         with tracer.start_span(
             name="eventsourcing_helpers.handle_event",
             service_name=service_name,
@@ -88,18 +146,508 @@ class EventHandler(Handler):
                 service_name=service_name,
                 system=None,
             ):
-                event = self.message_deserializer(message, deserialize_class=deserialize_class)
+                event = self.message_deserializer(
+                    message, deserialize_class=route.deserialize_class
+                )
 
             span.set_attribute(
                 attrs.MESSAGING_OPERATION_TYPE,
                 attrs.MESSAGING_OPERATION_TYPE_VALUE_PROCESS,
             )
-            handler_wrapper = metrics.timed(
-                "eventsourcing_helpers.handler.handle",
-                tags=[
-                    "message_type:event",
-                    f"message_class:{event_class}",
-                    f"handler:{handler_name}",
-                ],
-            )(handler)
-            handler_wrapper(event)
+            self._call(route, event)
+
+    def _coalesce(self, messages: List[Message]) -> List[List[Message]]:
+        """
+        Group handled messages by message key and event class.
+
+        The groups are ordered by their last message, so the last events are
+        handled in the order they were consumed.
+        """
+        groups: Dict[Hashable, List[Message]] = {}
+        for i, message in enumerate(messages):
+            if not self._can_handle_command(message):
+                continue
+            key: Tuple = (message._meta.key, message.value["class"])
+            if message._meta.key is None:
+                key = (i,)
+            group = groups.pop(key, [])
+            group.append(message)
+            groups[key] = group
+
+        return list(groups.values())
+
+    def _handle_reduced(self, messages: List[Message]) -> None:
+        """
+        Reduce the events of one key and event class and handle the result.
+        """
+        route = self._routes[messages[-1].value["class"]]
+        # looked up on the class so a plain function isn't bound as a method.
+        reducer = type(self).coalesce_reducer
+        assert reducer is not None
+        with tracer.start_span(
+            name="eventsourcing_helpers.handle_event",
+            service_name=self._service_name,
+            resource_name=route.handler_name,
+            system=None,
+        ) as span:
+            events = [
+                self.message_deserializer(m, deserialize_class=route.deserialize_class)
+                for m in messages
+            ]
+            span.set_attribute(
+                attrs.MESSAGING_OPERATION_TYPE,
+                attrs.MESSAGING_OPERATION_TYPE_VALUE_PROCESS,
+            )
+            self._call(route, reducer(events))
+
+    def _handle_event_batch(self, route: HandlerRoute, messages: List[Message]) -> None:
+        """
+        Call a batch handler with the events of one class.
+        """
+        with tracer.start_span(
+            name="eventsourcing_helpers.handle_event_batch",
+            service_name=self._service_name,
+            resource_name=route.handler_name,
+            system=None,
+        ) as span:
+            events = [
+                self.message_deserializer(m, deserialize_class=route.deserialize_class)
+                for m in messages
+            ]
+            span.set_attribute(
+                attrs.MESSAGING_OPERATION_TYPE,
+                attrs.MESSAGING_OPERATION_TYPE_VALUE_PROCESS,
+            )
+            span.set_attribute("messaging.batch.message_count", len(events))
+            route.call(events)
+
+    def handle_batch(self, messages: List[Message]) -> None:
+        """
+        Handle a batch of events.
+
+        With `coalesce_events` only the last event (or the events reduced by
+        `coalesce_reducer`) per message key and event class is handled, which
+        saves a lot of downstream writes when catching up.
+
+        Events for batch handlers (see `batch_handler`) are collected per
+        event class and passed to the handler in one call. The collected
+        events are handled before any later event with the same message key
+        for another handler, so the events of a key are handled in consumed
+        order. Events without a key are collected until the end of the batch.
+
+        Args:
+            messages: Consumed messages from the bus, in consumed order.
+        """
+        if self.coalesce_events:
+            groups = self._coalesce(messages)
+            num_handled = sum(len(g) for g in groups)
+            statsd.increment(  # type: ignore
+                "eventsourcing_helpers.handler.coalesced",
+                value=num_handled - len(groups),
+                tags=[f"message_type:{self.message_type}"],
+            )
+            logger.info("Handling coalesced events", num_events=num_handled, num_keys=len(groups))
+        else:
+            groups = [[m] for m in messages if self._can_handle_command(m)]
+
+        batches: Dict[str, List[Message]] = {}
+        # event classes with pending batch events per message key.
+        pending: Dict[Hashable, Set[str]] = {}
+        for group in groups:
+            message = group[-1]
+            route = self._routes[message.value["class"]]
+            reduce = len(group) > 1 and self.coalesce_reducer is not None
+            batch_class = route.message_class if route.batch and not reduce else None
+
+            # handle the pending batches first if they hold earlier events for
+            # the same key, so the events of a key are handled in order.
+            key = message._meta.key
+            if key is not None and pending.get(key, set()) - {batch_class}:
+                self._handle_event_batches(batches)
+                batches, pending = {}, {}
+
+            if reduce:
+                self._handle_reduced(group)
+            elif batch_class is not None:
+                batches.setdefault(batch_class, []).append(message)
+                if key is not None:
+                    pending.setdefault(key, set()).add(batch_class)
+            else:
+                self.handle(message)
+
+        self._handle_event_batches(batches)
+
+    def _handle_event_batches(self, batches: Dict[str, List[Message]]) -> None:
+        for message_class, batch in batches.items():
+            self._handle_event_batch(self._routes[message_class], batch)
+
+
+class AsyncEventHandler(BaseEventHandler, AsyncHandler):
+    """
+    Event handler for coroutine handler functions.
+
+    Example:
+        >>> async def order_created(event):
+        ...     await notify_customer(event.customer_id)
+        >>> class OrderEventHandler(AsyncEventHandler):
+        ...     handlers = {"OrderCreated": order_created}
+    """
+
+    async def _process(self, message: Message, route: HandlerRoute) -> None:
+        await self._call(
+            route, self.message_deserializer(message, deserialize_class=route.deserialize_class)
+        )
+
+    async def handle(self, message: Message) -> None:
+        """
+        Apply correct handler for received event.
+
+        Args:
+            message: Consumed message from the bus.
+        """
+        if not self._can_handle_command(message):
+            return
+
+        event_class = message.value["class"]
+        logger.info("Handling event", event_class=event_class)
+
+        route = self._routes[event_class]
+        if not self.trace_sampler.sample(event_class):
+            await self._handle_unsampled("eventsourcing_helpers.handle_event", route, message)
+            return
+
+        service_name = self._service_name
+        with tracer.start_span(
+            name="eventsourcing_helpers.handle_event",
+            service_name=service_name,
+            resource_name=route.handler_name,
+            system=None,
+        ) as span:
+            with tracer.start_span(
+                name="eventsourcing_helpers.deserialize_message",
+                service_name=service_name,
+                system=None,
+            ):
+                event = self.message_deserializer(
+                    message, deserialize_class=route.deserialize_class
+                )
+
+            span.set_attribute(
+                attrs.MESSAGING_OPERATION_TYPE,
+                attrs.MESSAGING_OPERATION_TYPE_VALUE_PROCESS,
+            )
+            await self._call(route, event)
+
+
+class HandlerErrors(Exception):
+    """
+    Raised when one or more of the handlers for an event failed, after all
+    of them have been called.
+
+    Args:
+        errors: Failed handler names and their errors.
+    """
+
+    def __init__(self, errors: List[Tuple[str, Exception]]) -> None:
+        self.errors = errors
+        names = ", ".join(name for name, _ in errors)
+        super().__init__(f"{len(errors)} event handler(s) failed: {names}")
+
+
+class FanOutHandler(BaseEventHandler):
+    """
+    Base class for event handlers with several independent handlers per
+    event class.
+
+    A list of handlers can be given for an event class. The event is
+    deserialized once and passed to all of them concurrently. Each handler
+    goes through the middleware chain on its own. If any of them fail a
+    `HandlerErrors` is raised once all of them are done.
+
+    Batch handlers can't be part of a fan-out, the routes are built when the
+    handler is created so this fails early.
+    """
+
+    # max number of threads for the synchronous handlers.
+    max_workers: Union[int, None] = None
+
+    def __init__(self, *args, **kwargs) -> None:
+        self._executor = ThreadPoolExecutor(
+            self.max_workers, thread_name_prefix="eventsourcing-fan-out"
+        )
+        super().__init__(*args, **kwargs)
+
+    def _create_route(
+        self, message_class: str, handler: Any, deserialize_class: Union[type, None]
+    ) -> HandlerRoute:
+        if not isinstance(handler, (list, tuple)):
+            return super()._create_route(message_class, handler, deserialize_class)
+
+        routes = []
+        for h in handler:
+            route = super()._create_route(message_class, h, deserialize_class)
+            assert not route.batch, f"Batch handler {route.handler_name} can't be fanned out"
+            self._check_fan_out_route(route)
+            routes.append(route)
+
+        handler_name = ",".join(r.handler_name for r in routes)
+        tags = [
+            f"message_type:{self.message_type}",
+            f"message_class:{message_class}",
+            f"handler:{handler_name}",
+        ]
+        call = self._create_fan_out(routes)
+        return HandlerRoute(message_class, call, deserialize_class, handler_name, tags, call)
+
+    def _check_fan_out_route(self, route: HandlerRoute) -> None:
+        pass
+
+    def _create_fan_out(self, routes: List[HandlerRoute]) -> Callable:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """
+        Shut down the thread pool.
+        """
+        self._executor.shutdown()
+
+
+class FanOutEventHandler(FanOutHandler, EventHandler):
+    """
+    Event handler with several handlers per event class, see `FanOutHandler`.
+
+    The handlers run on a thread pool, coroutine handlers are not supported.
+
+    Example:
+        >>> class OrderEventHandler(FanOutEventHandler):
+        ...     handlers = {"OrderCreated": [update_projection, notify_customer, index_order]}
+    """
+
+    def _check_fan_out_route(self, route: HandlerRoute) -> None:
+        assert not iscoroutinefunction(
+            route.handler
+        ), f"Coroutine handler {route.handler_name} needs an AsyncFanOutEventHandler"
+
+    def _create_fan_out(self, routes: List[HandlerRoute]) -> Callable:
+        return partial(self._fan_out, routes)
+
+    def _fan_out(self, routes: List[HandlerRoute], event: Any) -> None:
+        # run the other handlers on the pool with the current context, so
+        # their spans end up in the same trace.
+        futures = [
+            (r.handler_name, self._executor.submit(contextvars.copy_context().run, r.call, event))
+            for r in routes[1:]
+        ]
+        errors = []
+        try:
+            routes[0].call(event)
+        except Exception as e:
+            errors.append((routes[0].handler_name, e))
+        for handler_name, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append((handler_name, e))
+
+        if errors:
+            raise HandlerErrors(errors) from errors[0][1]
+
+
+class AsyncFanOutEventHandler(FanOutHandler, AsyncEventHandler):
+    """
+    Event handler with several handlers per event class, see
+    `FanOutHandler`.
+
+    Coroutine handlers run on the event loop, synchronous handlers run on
+    the thread pool so they don't block it.
+    """
+
+    def _create_fan_out(self, routes: List[HandlerRoute]) -> Callable:
+        return partial(self._fan_out, routes)
+
+    async def _fan_out(self, routes: List[HandlerRoute], event: Any) -> None:
+        loop = asyncio.get_running_loop()
+        calls = [
+            (
+                r.call(event)
+                if iscoroutinefunction(r.call)
+                else loop.run_in_executor(
+                    self._executor, contextvars.copy_context().run, r.call, event
+                )
+            )
+            for r in routes
+        ]
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        errors = [
+            (r.handler_name, result)
+            for r, result in zip(routes, results)
+            if isinstance(result, Exception)
+        ]
+        if errors:
+            raise HandlerErrors(errors) from errors[0][1]
+
+
+class WorkerMessage:
+    """
+    Compact picklable message sent to the process pool workers.
+    """
+
+    __slots__ = ("value", "_meta")
+
+    def __init__(self, value: dict, meta: MessageMeta) -> None:
+        self.value = value
+        self._meta = meta
+
+    def __reduce__(self):
+        return WorkerMessage, (self.value, self._meta)
+
+
+# the event handler instance in a process pool worker.
+_worker_handler: Union["ProcessPoolEventHandler", None] = None
+
+
+def _init_worker(handler_cls: type, message_deserializer: Callable) -> None:
+    global _worker_handler
+    _worker_handler = handler_cls(message_deserializer=message_deserializer, start_pool=False)
+
+
+def _ping() -> None:
+    pass
+
+
+def _handle_in_worker(messages: List[WorkerMessage]) -> None:
+    assert _worker_handler is not None
+    # the messages of a key are handled in order, the first failure stops the
+    # rest of them.
+    for message in messages:
+        route = _worker_handler._routes[message.value["class"]]
+        event = _worker_handler.message_deserializer(
+            message, deserialize_class=route.deserialize_class
+        )
+        # the result is discarded rather than sent back, so it doesn't have
+        # to be picklable.
+        route.call(event)
+
+
+class ProcessPoolEventHandler(EventHandler):
+    """
+    Event handler running CPU bound handler functions in a process pool.
+
+    Each worker process creates its own instance of the handler class, so the
+    handler class, the handler functions and the message deserializer must
+    be importable (defined at module level). Only the message value and a
+    compact `MessageMeta` are sent to the workers, deserialization and the
+    middleware chain run in the worker. Handler return values are discarded,
+    as for the other event handlers.
+
+    Use with `Consumer.consume_batch`: `handle_batch` handles the batch in
+    parallel and returns when all messages are handled, so the offsets
+    committed after the batch are correct. The messages of a key are handled
+    in consumed order by the same task. Batch handlers (see `batch_handler`)
+    are not supported.
+
+    The pool is started and warmed up (all worker processes spawned and
+    initialized) when the handler is created. New processes are spawned
+    rather than forked since forking a process with running Kafka client
+    threads is not safe.
+
+    Example:
+        >>> def render_report(event):
+        ...     ...
+        >>> class ReportEventHandler(ProcessPoolEventHandler):
+        ...     handlers = {"ReportRequested": render_report}
+        ...     max_workers = 4
+    """
+
+    max_workers: Union[int, None] = None
+    mp_context: str = "spawn"
+    chunksize: int = 1
+
+    def __init__(
+        self, message_deserializer: Callable = from_message_to_dto, start_pool: bool = True
+    ) -> None:
+        super().__init__(message_deserializer)
+        self._pool: Union[ProcessPoolExecutor, None] = None
+        if start_pool:
+            self._start_pool()
+
+    def _create_route(
+        self, message_class: str, handler: Callable, deserialize_class: Union[type, None]
+    ) -> HandlerRoute:
+        route = super()._create_route(message_class, handler, deserialize_class)
+        assert not route.batch, f"Batch handler {route.handler_name} can't run in a process pool"
+        return route
+
+    def _start_pool(self) -> None:
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=get_context(self.mp_context),
+            initializer=_init_worker,
+            initargs=(type(self), self.message_deserializer),
+        )
+        # spawn and initialize all workers up front instead of on the first
+        # batch.
+        workers = self._pool._max_workers  # type: ignore[attr-defined]
+        for future in [self._pool.submit(_ping) for _ in range(workers)]:
+            future.result()
+        logger.info("Process pool started", workers=workers)
+
+    def close(self) -> None:
+        """
+        Shut down the process pool.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _to_worker_message(self, message: Message) -> WorkerMessage:
+        return WorkerMessage(message.value, MessageMeta.from_message(message))
+
+    def handle(self, message: Message) -> None:
+        """
+        Handle one event in the process pool and wait for it to be handled.
+
+        Args:
+            message: Consumed message from the bus.
+        """
+        self.handle_batch([message])
+
+    def handle_batch(self, messages: List[Message]) -> None:
+        """
+        Handle a batch of events in parallel in the process pool.
+
+        Args:
+            messages: Consumed messages from the bus, in consumed order.
+        """
+        assert self._pool is not None, "Process pool is not started"
+        # one task per key keeps the messages of a key in order, messages
+        # without a key are handled independently.
+        tasks: List[List[WorkerMessage]] = []
+        tasks_by_key: Dict[Hashable, List[WorkerMessage]] = {}
+        for message in messages:
+            if not self._can_handle_command(message):
+                continue
+            key = message._meta.key
+            if key is None:
+                tasks.append([self._to_worker_message(message)])
+            elif key in tasks_by_key:
+                tasks_by_key[key].append(self._to_worker_message(message))
+            else:
+                tasks_by_key[key] = [self._to_worker_message(message)]
+                tasks.append(tasks_by_key[key])
+        if not tasks:
+            return
+
+        with tracer.start_span(
+            name="eventsourcing_helpers.handle_event_batch",
+            service_name=self._service_name,
+            system=None,
+        ) as span:
+            span.set_attribute(
+                attrs.MESSAGING_OPERATION_TYPE,
+                attrs.MESSAGING_OPERATION_TYPE_VALUE_PROCESS,
+            )
+            span.set_attribute("messaging.batch.message_count", sum(len(t) for t in tasks))
+            # consume the results to wait for all messages and raise errors.
+            for _ in self._pool.map(_handle_in_worker, tasks, chunksize=self.chunksize):
+                pass
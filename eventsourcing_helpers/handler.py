@@ -1,14 +1,235 @@
-from typing import Callable
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple, Union
 
+from eventsourcing_helpers.message.schema import message_classes
+from eventsourcing_helpers.middleware import Middleware, compose, count_errors, timed
 from eventsourcing_helpers.serializers import from_message_to_dto
+from eventsourcing_helpers.tracing import TraceSampler, attrs, get_datadog_service_name, tracer
+from eventsourcing_helpers.utils import get_callable_representation
 
 
-class Handler:
+class HandlerRoute(NamedTuple):
+    """
+    Everything needed to handle a message class, computed once when the
+    handler is initialized.
+    """
+
+    message_class: str
+    handler: Callable
+    deserialize_class: Union[type, None]
+    handler_name: str
+    tags: List[str]
+    # the handler wrapped in the middleware chain.
+    call: Callable
+    # the handler is called with a list of messages, see `batch_handler`.
+    batch: bool = False
+
+
+class BatchError(Exception):
+    """
+    Raised by a batch handler when a message of the batch failed, chained
+    to the original error.
+
+    The messages handled before the failure are done, so the consumer can
+    commit their offsets before the error is propagated.
+
+    Args:
+        unhandled: Messages of the batch that were not handled, in
+            consumed order.
+    """
+
+    def __init__(self, unhandled: list) -> None:
+        self.unhandled = unhandled
+        super().__init__(f"{len(unhandled)} message(s) of the batch were not handled")
+
+
+class BaseHandler:
+    """
+    Routing, middleware and tracing shared by the synchronous and the async
+    handlers, see `Handler` and `AsyncHandler`.
+    """
+
     handlers: dict = {}
+    # user provided middleware, see `eventsourcing_helpers.middleware`.
+    middleware: list = []
+    message_type: str = "message"
+    timed_metric: str = "eventsourcing_helpers.handler.handle"
+    trace_sampler: TraceSampler = TraceSampler()
 
     def __init__(self, message_deserializer: Callable = from_message_to_dto) -> None:
         assert self.handlers
         self.message_deserializer = message_deserializer
+        self._service_name = get_datadog_service_name()
+        self._routes = self._build_routes()
+
+    def _get_middleware(self) -> List[Middleware]:
+        """
+        Get the middleware chain every handler call goes through.
+        """
+        return [
+            timed(self.timed_metric),
+            count_errors("eventsourcing_helpers.handler.handle.error"),
+            *self.middleware,
+        ]
+
+    def _create_route(
+        self, message_class: str, handler: Callable, deserialize_class: Union[type, None]
+    ) -> HandlerRoute:
+        handler_name = get_callable_representation(handler)
+        tags = [
+            f"message_type:{self.message_type}",
+            f"message_class:{message_class}",
+            f"handler:{handler_name}",
+        ]
+        route = HandlerRoute(message_class, handler, deserialize_class, handler_name, tags, handler)
+        return route._replace(call=compose(handler, route, self._get_middleware()))
+
+    def _build_routes(self) -> Dict[str, HandlerRoute]:
+        """
+        Build a routing table from message class name to handler.
+
+        The handler keys can be either a string or a class. A string key takes
+        precedence over a class key with the same name.
+
+        Returns:
+            dict: Routes keyed by message class name.
+        """
+        class_keys = [k for k in self.handlers if not isinstance(k, str) and hasattr(k, "__name__")]
+        str_keys = [k for k in self.handlers if isinstance(k, str)]
+
+        routes = {}
+        for key in class_keys:
+            routes[key.__name__] = self._create_route(key.__name__, self.handlers[key], key)
+        for key in str_keys:
+            deserialize_class = message_classes.get(key)
+            routes[key] = self._create_route(key, self.handlers[key], deserialize_class)
+
+        return routes
+
+    def can_handle_class(self, message_class: str) -> bool:
+        """
+        Checks if messages of the given class are handled.
+
+        Used by the message bus to skip unhandled messages before they are
+        decoded.
+
+        Args:
+            message_class: Class name of the message.
+
+        Returns:
+            bool: Flag to indicate if we can handle the message class.
+        """
+        return message_class in self._routes
+
+    def _record_span(
+        self,
+        span_name: str,
+        route: HandlerRoute,
+        start_time: int,
+        error: Union[Exception, None] = None,
+    ) -> None:
+        """
+        Record a span after the fact for an unsampled message.
+
+        If an error is given it is re-raised within the span so it gets
+        recorded on it.
+        """
+        with tracer.start_span(
+            name=span_name,
+            service_name=self._service_name,
+            resource_name=route.handler_name,
+            system=None,
+            start_time=start_time,
+        ) as span:
+            span.set_attribute(
+                attrs.MESSAGING_OPERATION_TYPE,
+                attrs.MESSAGING_OPERATION_TYPE_VALUE_PROCESS,
+            )
+            if error is not None:
+                raise error
+
+    def on_revoke(self, partitions: List[Tuple[str, int]]) -> None:
+        """
+        Called when partitions are revoked from the consumer, before another
+        consumer starts handling their messages.
+
+        Args:
+            partitions: Revoked (topic, partition) pairs.
+        """
+        pass
+
+
+class Handler(BaseHandler):
+    def _process(self, message: Any, route: HandlerRoute) -> None:
+        """
+        Deserialize and handle a message without tracing.
+        """
+        raise NotImplementedError("You need to implement _process method in your subclass")
+
+    def _handle_unsampled(self, span_name: str, route: HandlerRoute, message: Any) -> None:
+        """
+        Handle a message that was not sampled for tracing.
+
+        No spans are created unless handling fails or is slow, see
+        `TraceSampler`.
+        """
+        sampler = self.trace_sampler
+        start_time = time.time_ns()
+        try:
+            self._process(message, route)
+        except Exception as e:
+            if sampler.always_sample_errors:
+                self._record_span(span_name, route, start_time, error=e)
+            raise
+
+        if sampler.is_slow(time.time_ns() - start_time):
+            self._record_span(span_name, route, start_time)
 
     def handle(self, message: dict) -> None:
         raise NotImplementedError("You need to implement handle method in your subclass")
+
+    def handle_batch(self, messages: List[Any]) -> None:
+        """
+        Handle a batch of consumed messages.
+
+        Handles the messages one at a time by default, override to handle
+        them more efficiently together.
+
+        Args:
+            messages: Consumed messages from the bus, in consumed order.
+        """
+        for message in messages:
+            self.handle(message)
+
+
+class AsyncHandler(BaseHandler):
+    """
+    Base class for handlers with coroutine handler functions.
+
+    The handler functions are awaited and `handle` is a coroutine, the
+    middleware chain, metrics and tracing work the same as for the
+    synchronous handlers.
+    """
+
+    async def _process(self, message: Any, route: HandlerRoute) -> None:
+        raise NotImplementedError("You need to implement _process method in your subclass")
+
+    async def _handle_unsampled(self, span_name: str, route: HandlerRoute, message: Any) -> None:
+        sampler = self.trace_sampler
+        start_time = time.time_ns()
+        try:
+            await self._process(message, route)
+        except Exception as e:
+            if sampler.always_sample_errors:
+                self._record_span(span_name, route, start_time, error=e)
+            raise
+
+        if sampler.is_slow(time.time_ns() - start_time):
+            self._record_span(span_name, route, start_time)
+
+    async def handle(self, message: Any) -> None:
+        raise NotImplementedError("You need to implement handle method in your subclass")
+
+    async def handle_batch(self, messages: List[Any]) -> None:
+        for message in messages:
+            await self.handle(message)
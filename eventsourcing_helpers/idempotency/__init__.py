@@ -0,0 +1,93 @@
+"""
+Upstream retries may deliver the same command more than once. The
+idempotency store remembers the keys of handled commands so duplicates can be
+skipped before the aggregate root is loaded.
+
+The key is read from a message header (default `idempotency_key`) or from an
+attribute on the command, and namespaced with the command class. Commands
+without a key are always handled.
+
+Certain backend implementations are available:
+ * memory (default) - stores keys in a bounded LRU in front of a Bloom
+   filter, thus works only for the current process and not restart-safe;
+ * redis - stores keys with a TTL in a Redis instance;
+ * null - bypasses all the checks (for using in tests, debugging, etc.)
+"""
+
+from typing import Any, Callable, Union
+
+import structlog
+
+from eventsourcing_helpers.idempotency.backends import IdempotencyBackend
+from eventsourcing_helpers.metrics import base_metric, statsd
+from eventsourcing_helpers.utils import import_backend
+
+from confluent_kafka_helpers.message import Message
+
+BACKENDS_PATH = "eventsourcing_helpers.idempotency.backends"
+BACKENDS = {
+    "null": f"{BACKENDS_PATH}.null.NullIdempotencyBackend",
+    "memory": f"{BACKENDS_PATH}.memory.InMemoryIdempotencyBackend",
+    "redis": f"{BACKENDS_PATH}.redis.RedisIdempotencyBackend",
+}
+
+logger = structlog.get_logger(__name__)
+
+
+class IdempotencyStore:
+    """
+    Idempotency store facade.
+
+    Loads and configures the real storage backend on initialization.
+    """
+
+    DEFAULT_BACKEND = "memory"
+    DEFAULT_KEY_HEADER = "idempotency_key"
+
+    def __init__(self, config: dict, importer: Callable = import_backend) -> None:
+        backend_path = config.get("backend", BACKENDS[self.DEFAULT_BACKEND])
+        backend_config = config.get("backend_config", {})
+        self.key_header = config.get("key_header", self.DEFAULT_KEY_HEADER)
+        self.key_attribute = config.get("key_attribute")
+
+        logger.debug("Using idempotency backend", backend=backend_path, config=backend_config)
+        backend_class = importer(backend_path)
+        self.backend: IdempotencyBackend = backend_class(config=backend_config)
+
+    def get_key(self, message: Message, command: Any) -> Union[str, None]:
+        """
+        Get the idempotency key of a command.
+
+        Args:
+            message: Consumed message.
+            command: Deserialized command.
+
+        Returns:
+            str: Key namespaced with the command class or None if the command
+                has no key.
+        """
+        key = None
+        if self.key_attribute is not None:
+            key = getattr(command, self.key_attribute, None)
+        if key is None and self.key_header is not None:
+            headers = getattr(getattr(message, "_meta", None), "headers", None)
+            if isinstance(headers, dict):
+                key = headers.get(self.key_header)
+        if key is None:
+            return None
+        return f"{command._class}:{key}"
+
+    def seen(self, key: str) -> bool:
+        """Checks if a command with the `key` has been handled before"""
+        seen = self.backend.seen(key)
+        if seen:
+            logger.warning("Duplicate command", key=key)
+            statsd.increment(  # type: ignore
+                f"{base_metric}.idempotency.duplicate.count",
+                tags=[f"command_class:{key.split(':', 1)[0]}"],
+            )
+        return seen
+
+    def set_seen(self, key: str) -> None:
+        """Marks a command with the `key` as handled"""
+        self.backend.set_seen(key)
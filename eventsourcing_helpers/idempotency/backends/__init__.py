@@ -0,0 +1,15 @@
+class IdempotencyBackend:
+    """
+    Abstract base class for the idempotency backends
+    """
+
+    def __init__(self, config: dict) -> None:
+        self.config = config
+
+    def seen(self, key: str) -> bool:
+        """Checks if the `key` has been seen before"""
+        raise NotImplementedError
+
+    def set_seen(self, key: str) -> None:
+        """Marks the `key` as seen"""
+        raise NotImplementedError
@@ -0,0 +1,84 @@
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from typing import Iterable
+
+from eventsourcing_helpers.idempotency.backends import IdempotencyBackend
+
+
+class BloomFilter:
+    """
+    Probabilistic set that answers "definitely not added" or "maybe added".
+
+    Args:
+        capacity: Expected number of keys.
+        error_rate: False positive rate at `capacity` keys.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001) -> None:
+        assert capacity > 0, "capacity must be positive"
+        assert 0 < error_rate < 1, "error_rate must be between 0 and 1"
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str) -> Iterable[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+
+class InMemoryIdempotencyBackend(IdempotencyBackend):
+    """
+    In-memory idempotency backend.
+
+    Stores the last `max_entries` keys in a LRU. A Bloom filter in front of
+    the LRU answers most lookups of new keys without touching the LRU, it is
+    rebuilt from the LRU when it has seen twice as many keys as it was sized
+    for to keep the false positive rate down.
+    """
+
+    DEFAULT_CONFIG = {"max_entries": 100_000, "error_rate": 0.001}
+
+    def __init__(self, config: dict) -> None:
+        super().__init__(config=config)
+        config = {**self.DEFAULT_CONFIG, **(config or {})}
+        self.max_entries = config["max_entries"]
+        self.error_rate = config["error_rate"]
+        self._keys: OrderedDict = OrderedDict()
+        self._bloom = BloomFilter(self.max_entries, self.error_rate)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def seen(self, key: str) -> bool:
+        with self._lock:
+            if key not in self._bloom or key not in self._keys:
+                return False
+            self._keys.move_to_end(key)
+            return True
+
+    def set_seen(self, key: str) -> None:
+        with self._lock:
+            self._keys[key] = None
+            self._keys.move_to_end(key)
+            if len(self._keys) > self.max_entries:
+                self._keys.popitem(last=False)
+
+            if self._bloom.count >= 2 * self.max_entries:
+                self._bloom = BloomFilter(self.max_entries, self.error_rate)
+                for k in self._keys:
+                    self._bloom.add(k)
+            else:
+                self._bloom.add(key)
@@ -0,0 +1,13 @@
+from eventsourcing_helpers.idempotency.backends import IdempotencyBackend
+
+
+class NullIdempotencyBackend(IdempotencyBackend):
+    """
+    Null (bypass) backend. Does nothing and treats all keys as never seen.
+    """
+
+    def seen(self, key: str) -> bool:
+        return False
+
+    def set_seen(self, key: str) -> None:
+        pass
@@ -0,0 +1,54 @@
+from redis import StrictRedis
+from redis.sentinel import Sentinel
+
+from eventsourcing_helpers.idempotency.backends import IdempotencyBackend
+
+__all__ = ["RedisIdempotencyBackend"]
+
+
+class RedisIdempotencyBackend(IdempotencyBackend):
+    """
+    Redis idempotency backend.
+
+    Stores the keys in a Redis database, each key expires after `ttl` seconds.
+    """
+
+    DEFAULT_CONFIG = {
+        "socket_connect_timeout": 1.0,
+        "socket_timeout": 1.0,
+        "retry_on_timeout": True,
+        "decode_responses": True,
+    }
+    DEFAULT_TTL = 24 * 60 * 60
+    DEFAULT_PREFIX = "idempotency:"
+
+    def __init__(self, config: dict) -> None:
+        super().__init__(config=config)
+        self._redis = None
+        self._redis_sentinel = None
+        config = {**self.DEFAULT_CONFIG, **config}
+        self.ttl = config.pop("ttl", self.DEFAULT_TTL)
+        self.prefix = config.pop("prefix", self.DEFAULT_PREFIX)
+
+        if "url" in config:
+            assert "sentinels" not in config
+            self._redis = StrictRedis.from_url(**config)
+        else:
+            assert "sentinels" in config
+            assert "service_name" in config
+
+            sentinels = [tuple(h.split(":")) for h in config.pop("sentinels").split(",")]
+            self._redis_sentinel_service_name = config.pop("service_name")
+            self._redis_sentinel = Sentinel(sentinels=sentinels, **config)
+
+    @property
+    def redis(self) -> StrictRedis:
+        if self._redis:
+            return self._redis
+        return self._redis_sentinel.master_for(self._redis_sentinel_service_name)  # type: ignore
+
+    def seen(self, key: str) -> bool:
+        return bool(self.redis.exists(f"{self.prefix}{key}"))
+
+    def set_seen(self, key: str) -> None:
+        self.redis.set(f"{self.prefix}{key}", 1, ex=self.ttl)
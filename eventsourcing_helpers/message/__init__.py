@@ -1,3 +1,12 @@
 from .message import Command, Event, Message, NewMessage, OldMessage, message_factory
+from .meta import MessageMeta
 
-__all__ = ["Event", "Command", "Message", "NewMessage", "OldMessage", "message_factory"]
+__all__ = [
+    "Event",
+    "Command",
+    "Message",
+    "MessageMeta",
+    "NewMessage",
+    "OldMessage",
+    "message_factory",
+]
@@ -0,0 +1,95 @@
+from typing import Any, Union
+
+from confluent_kafka_helpers.message import decode_kafka_headers, kafka_timestamp_to_datetime
+
+
+class MessageMeta:
+    """
+    Compact message metadata attached to DTOs as `Meta`.
+
+    Only holds the fields we actually use instead of keeping the full Kafka
+    message metadata alive for every deserialized message. Raw Kafka headers
+    (a list of key and value pairs) are decoded to a dict.
+    """
+
+    __slots__ = ("offset", "partition", "topic", "timestamp", "headers", "key")
+
+    def __init__(
+        self,
+        offset: Union[int, None] = None,
+        partition: Union[int, None] = None,
+        topic: Union[str, None] = None,
+        timestamp: Union[int, None] = None,
+        headers: Union[dict, list, None] = None,
+        key: Any = None,
+    ) -> None:
+        self.offset = offset
+        self.partition = partition
+        self.topic = topic
+        self.timestamp = timestamp
+        self.headers: dict = headers if isinstance(headers, dict) else decode_kafka_headers(headers)
+        self.key = key
+
+    @classmethod
+    def from_message(cls, message: Any) -> "MessageMeta":
+        """
+        Create metadata from a consumed message.
+
+        Args:
+            message: Message with a `_meta` attribute.
+
+        Returns:
+            MessageMeta: Message metadata.
+        """
+        meta = message._meta
+        if isinstance(meta, cls):
+            return meta
+
+        return cls(
+            offset=meta.offset,
+            partition=meta.partition,
+            topic=meta.topic,
+            timestamp=meta.timestamp,
+            headers=meta.headers,
+            key=meta.key,
+        )
+
+    @property
+    def datetime(self):
+        return kafka_timestamp_to_datetime(self.timestamp)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, MessageMeta):
+            return False
+        return (
+            self.offset,
+            self.partition,
+            self.topic,
+            self.timestamp,
+            self.headers,
+            self.key,
+        ) == (
+            other.offset,
+            other.partition,
+            other.topic,
+            other.timestamp,
+            other.headers,
+            other.key,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"MessageMeta("
+            f"offset={self.offset}, "
+            f"partition={self.partition}, "
+            f"topic={self.topic}, "
+            f"timestamp={self.timestamp}, "
+            f"headers={self.headers}, "
+            f"key={self.key}"
+            f")"
+        )
+
+
+# shared metadata for messages where the metadata was not requested, e.g. when
+# replaying events to rebuild an aggregate root.
+EMPTY_META = MessageMeta()
@@ -0,0 +1,305 @@
+"""
+Message classes generated from Avro schemas.
+
+Instead of learning the shape of a message from the first consumed payload we
+can build the DTO classes up front from the Avro schemas, either from a local
+directory with `.avsc` files or from a schema registry.
+
+Generated classes are slotted, have typed fields and defaults for optional
+fields and are registered in `message_classes`, which is consulted by
+`from_message_to_dto` when no explicit `deserialize_class` is given.
+
+Example:
+    >>> from eventsourcing_helpers.message.schema import message_classes
+    >>> message_classes.register_from_directory("schemas/")
+    >>> message_classes["OrderCreated"](id="1", state="open")
+    OrderCreated(id='1', state='open')
+"""
+
+import copy
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+# Avro primitive types mapped to the python type they are decoded to.
+AVRO_TYPES: Dict[str, Any] = {
+    "null": type(None),
+    "boolean": bool,
+    "int": int,
+    "long": int,
+    "float": float,
+    "double": float,
+    "bytes": bytes,
+    "string": str,
+    "record": dict,
+    "map": dict,
+    "array": list,
+    "enum": str,
+    "fixed": bytes,
+}
+
+_MISSING = object()
+
+
+class SchemaMessage:
+    """
+    Base class for messages generated from an Avro schema.
+
+    Fields are stored in slots, missing optional fields get their schema
+    default and unknown fields (removed from the schema) are ignored.
+
+    Messages loaded from the repository (`is_new=False`) behave like
+    `OldMessage`: missing required fields, e.g. fields added to the schema
+    after the event was stored, are set to None and unknown attributes are
+    None instead of raising an `AttributeError`.
+    """
+
+    __slots__ = ("Meta", "_is_new")
+
+    Meta: Any
+    _is_new: bool
+    _class: str = "SchemaMessage"
+    _fields: tuple = ()
+    _defaults: dict = {}
+
+    def __init__(self, Meta: Any = None, _is_new: bool = True, **data) -> None:
+        for name in self._fields:
+            value = data.get(name, _MISSING)
+            if value is _MISSING:
+                value = self._defaults.get(name, _MISSING)
+                if value is _MISSING:
+                    if _is_new:
+                        raise TypeError(f"{self._class}() missing required field: '{name}'")
+                    value = None
+                if isinstance(value, (dict, list)):
+                    value = copy.deepcopy(value)
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, "Meta", Meta)
+        object.__setattr__(self, "_is_new", _is_new)
+
+    @classmethod
+    def from_record(cls, record: dict, meta: Any = None, is_new: bool = True) -> "SchemaMessage":
+        """
+        Construct a message directly from a decoded Avro record.
+
+        Args:
+            record: Decoded record (the `data` part of the message).
+            meta (optional): Message metadata.
+            is_new (optional): Flag to indicate if the message is new or
+                loaded from the repository.
+
+        Returns:
+            SchemaMessage: Message instance.
+        """
+        return cls(Meta=meta, _is_new=is_new, **record)
+
+    def __getattr__(self, name: str) -> Any:
+        # only called when the attribute doesn't exist.
+        if name.startswith("_") or object.__getattribute__(self, "_is_new"):
+            raise AttributeError(f"'{self._class}' object has no attribute '{name}'")
+        return None
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self._fields}
+
+    def __eq__(self, other) -> bool:
+        if type(self) is not type(other):
+            return False
+        return self.to_dict() == other.to_dict() and self.Meta == other.Meta
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self._fields)
+        return f"{self._class}({fields})"
+
+    def __setattr__(self, *args) -> None:
+        raise AttributeError("Messages are read only")
+
+    def __delattr__(self, *args) -> None:
+        raise AttributeError("Messages are read only")
+
+
+def get_python_type(avro_type: Any) -> Any:
+    """
+    Get the python type an Avro type is decoded to.
+
+    Args:
+        avro_type: Avro type definition (name, union list or complex type).
+
+    Returns:
+        type: Python type, unions are returned as `typing.Union`.
+    """
+    if isinstance(avro_type, list):
+        types = tuple(get_python_type(t) for t in avro_type)
+        return Union[types] if len(types) > 1 else types[0]  # type: ignore
+    if isinstance(avro_type, dict):
+        return get_python_type(avro_type["type"])
+    # named types defined elsewhere in the schema are records, enums or
+    # fixed types - we can't know which without resolving them.
+    return AVRO_TYPES.get(avro_type, Any)
+
+
+def is_optional(avro_type: Any) -> bool:
+    return isinstance(avro_type, list) and "null" in avro_type
+
+
+def create_message_class(schema: dict) -> type:
+    """
+    Create a slotted message class from an Avro record schema.
+
+    Args:
+        schema: Avro record schema.
+
+    Returns:
+        type: Message class.
+    """
+    assert schema.get("type") == "record", "Only record schemas can be used as messages"
+    name = schema["name"].rsplit(".", 1)[-1]
+    fields = tuple(field["name"] for field in schema["fields"])
+
+    defaults, annotations = {}, {}
+    for field in schema["fields"]:
+        annotations[field["name"]] = get_python_type(field["type"])
+        if "default" in field:
+            defaults[field["name"]] = field["default"]
+        elif is_optional(field["type"]):
+            defaults[field["name"]] = None
+
+    namespace = {
+        "__slots__": fields,
+        "__annotations__": annotations,
+        "__doc__": schema.get("doc"),
+        "_class": name,
+        "_fields": fields,
+        "_defaults": defaults,
+    }
+    return type(name, (SchemaMessage,), namespace)
+
+
+def get_message_schemas(schema: Any) -> List[dict]:
+    """
+    Find all message record schemas in an Avro schema.
+
+    A schema can either be a message record itself, a union of message records
+    or an envelope record with a `class` and a `data` field where `data` holds
+    the message record(s).
+
+    Args:
+        schema: Avro schema.
+
+    Returns:
+        list: Message record schemas.
+    """
+    if isinstance(schema, list):
+        return [s for t in schema for s in get_message_schemas(t)]
+    if not isinstance(schema, dict) or schema.get("type") != "record":
+        return []
+
+    fields = {field["name"]: field for field in schema["fields"]}
+    if fields.keys() == {"class", "data"}:
+        return get_message_schemas(fields["data"]["type"])
+
+    return [schema]
+
+
+def _parse_schema(schema: Any) -> Any:
+    if hasattr(schema, "to_json"):
+        return schema.to_json()
+    if isinstance(schema, (str, bytes)):
+        return json.loads(schema)
+    return schema
+
+
+def load_schemas_from_directory(path: Union[str, Path], pattern: str = "*.avsc") -> List[Any]:
+    """
+    Load all Avro schemas from a local directory.
+
+    Args:
+        path: Directory with schema files.
+        pattern (optional): Glob pattern used to find the schema files.
+
+    Returns:
+        list: Parsed schemas.
+    """
+    return [_parse_schema(p.read_text()) for p in sorted(Path(path).rglob(pattern))]
+
+
+def load_schemas_from_registry(registry: Any, subjects: Iterable[str]) -> List[Any]:
+    """
+    Load the latest Avro schemas for the given subjects.
+
+    Args:
+        registry: Schema registry client (or a stand-in) implementing
+            `get_latest_schema(subject)`.
+        subjects: Subject names, usually `<topic>-value`.
+
+    Returns:
+        list: Parsed schemas.
+    """
+    return [_parse_schema(registry.get_latest_schema(subject)) for subject in subjects]
+
+
+class MessageClassRegistry:
+    """
+    Registry of generated message classes keyed by class name.
+    """
+
+    def __init__(self) -> None:
+        self._classes: Dict[str, type] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._classes
+
+    def __getitem__(self, name: str) -> type:
+        return self._classes[name]
+
+    def __len__(self) -> int:
+        return len(self._classes)
+
+    def get(self, name: str, default: Optional[type] = None) -> Optional[type]:
+        return self._classes.get(name, default)
+
+    def register(self, message_cls: type) -> type:
+        """
+        Register a message class under its class name.
+
+        Can also be used as a class decorator for hand written classes.
+        """
+        self._classes[message_cls.__name__] = message_cls
+        return message_cls
+
+    def register_schemas(self, schemas: Iterable[Any]) -> Dict[str, type]:
+        """
+        Generate and register message classes for all given schemas.
+
+        Args:
+            schemas: Avro schemas.
+
+        Returns:
+            dict: Generated message classes keyed by class name.
+        """
+        classes = {}
+        for schema in schemas:
+            for message_schema in get_message_schemas(_parse_schema(schema)):
+                message_cls = self.register(create_message_class(message_schema))
+                classes[message_cls.__name__] = message_cls
+
+        logger.info("Registered message classes", classes=list(classes))
+        return classes
+
+    def register_from_directory(self, path: Union[str, Path], **kwargs) -> Dict[str, type]:
+        return self.register_schemas(load_schemas_from_directory(path, **kwargs))
+
+    def register_from_registry(self, registry: Any, subjects: Iterable[str]) -> Dict[str, type]:
+        return self.register_schemas(load_schemas_from_registry(registry, subjects))
+
+    def clear(self) -> None:
+        self._classes.clear()
+
+
+message_classes = MessageClassRegistry()
@@ -1,3 +1,4 @@
+from inspect import Parameter, signature
 from typing import Callable
 
 import structlog
@@ -10,9 +11,39 @@ BACKENDS = {
     "mock_compat": "eventsourcing_helpers.messagebus.backends.mock.backend_compat.MockBackend",
 }
 
+# consume options that are only passed on to backends accepting them, so
+# custom backends implementing e.g. `consume(handler)` keep working.
+OPTIONAL_CONSUME_OPTIONS = ("message_filter", "on_revoke")
+
 logger = structlog.get_logger(__name__)
 
 
+def get_consume_options(method: Callable, options: dict) -> dict:
+    """
+    Drop unset optional consume options and the ones the backend method
+    doesn't accept.
+
+    Args:
+        method: Backend consume method.
+        options: Options passed on to the backend.
+
+    Returns:
+        dict: Options to pass on to the backend.
+    """
+    parameters = signature(method).parameters
+    accepts_kwargs = any(p.kind is Parameter.VAR_KEYWORD for p in parameters.values())
+    supported = {
+        name
+        for name in OPTIONAL_CONSUME_OPTIONS
+        if options.get(name) is not None and (accepts_kwargs or name in parameters)
+    }
+    return {
+        name: value
+        for name, value in options.items()
+        if name in supported or name not in OPTIONAL_CONSUME_OPTIONS
+    }
+
+
 class MessageBus:
     """
     Interface to communicate with a message bus backend.
@@ -53,8 +84,37 @@ class MessageBus:
         """
         return self.backend.get_consumer()
 
-    def consume(self, handler: Callable):
+    def consume(self, handler: Callable, **kwargs):
         """
         Consume and handle messages indefinitely.
+
+        Args:
+            handler: Message handler.
+            kwargs: Extra options passed on to the backend, e.g. a
+                `message_filter` used to skip unhandled messages.
+        """
+        self.backend.consume(handler, **get_consume_options(self.backend.consume, kwargs))
+
+    def consume_batch(self, handler: Callable, **kwargs):
+        """
+        Consume and handle messages in batches indefinitely.
+
+        Args:
+            handler: Batch handler, called with a list of messages.
+            kwargs: Extra options passed on to the backend, e.g.
+                `batch_size` and `batch_timeout`.
+        """
+        consume_batch = self.backend.consume_batch
+        consume_batch(handler, **get_consume_options(consume_batch, kwargs))
+
+    async def consume_async(self, handler: Callable, **kwargs):
+        """
+        Consume and handle messages concurrently with an async handler.
+
+        Args:
+            handler: Async message handler.
+            kwargs: Extra options passed on to the backend, e.g.
+                `max_in_flight`.
         """
-        self.backend.consume(handler)
+        consume_async = self.backend.consume_async
+        await consume_async(handler, **get_consume_options(consume_async, kwargs))
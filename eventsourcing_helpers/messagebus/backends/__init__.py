@@ -1,3 +1,6 @@
+from typing import Callable
+
+
 class MessageBusBackend:
     """
     Message bus interface.
@@ -8,3 +11,27 @@ class MessageBusBackend:
 
     def get_consumer(self):
         raise NotImplementedError()
+
+    def consume(
+        self,
+        handler: Callable,
+        message_filter: Callable = None,
+        on_revoke: Callable = None,
+    ) -> None:
+        raise NotImplementedError()
+
+    def consume_batch(
+        self,
+        handler: Callable,
+        message_filter: Callable = None,
+        on_revoke: Callable = None,
+    ) -> None:
+        raise NotImplementedError()
+
+    async def consume_async(
+        self,
+        handler: Callable,
+        message_filter: Callable = None,
+        on_revoke: Callable = None,
+    ) -> None:
+        raise NotImplementedError()
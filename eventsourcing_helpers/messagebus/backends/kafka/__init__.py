@@ -1,11 +1,13 @@
+import asyncio
 import time
 from functools import partial
-from typing import Callable
+from typing import Callable, Dict, List, Tuple, Union
 
 import structlog
-from confluent_kafka import KafkaError, KafkaException
+from confluent_kafka import KafkaError, KafkaException, TopicPartition
 
 from eventsourcing_helpers import metrics
+from eventsourcing_helpers.handler import BatchError
 from eventsourcing_helpers.messagebus.backends import MessageBusBackend
 from eventsourcing_helpers.messagebus.backends.kafka.config import (
     get_consumer_config,
@@ -13,7 +15,14 @@ from eventsourcing_helpers.messagebus.backends.kafka.config import (
     get_producer_config,
 )
 from eventsourcing_helpers.messagebus.backends.kafka.offset_watchdog import OffsetWatchdog
-from eventsourcing_helpers.serializers import to_message_from_dto
+from eventsourcing_helpers.messagebus.backends.kafka.parallel import (
+    AsyncDispatcher,
+    ParallelDispatcher,
+    get_commit_offsets,
+)
+from eventsourcing_helpers.messagebus.backends.kafka.retry import RetryScheduler
+from eventsourcing_helpers.messagebus.backends.kafka.routing import get_routed_message
+from eventsourcing_helpers.serializers import add_message_class_header, to_message_from_dto
 
 from confluent_kafka_helpers.consumer import AvroConsumer
 from confluent_kafka_helpers.message import Message
@@ -34,8 +43,16 @@ class KafkaAvroBackend(MessageBusBackend):
         get_offset_watchdog_config: Callable = get_offset_watchdog_config,
     ) -> None:
         self.consumer = None
+        self.batch_consumer = None
+        self.async_consumer = None
         self.producer = None
         self.offset_watchdog = None
+        self.skip_unhandled = False
+        self.batch_size = 100
+        self.batch_timeout = 1.0
+        self.parallel = None
+        self.max_in_flight = 100
+        self.retry = None
 
         producer_config = get_producer_config(config)
         consumer_config = get_consumer_config(config)
@@ -45,7 +62,28 @@ class KafkaAvroBackend(MessageBusBackend):
             self.flush = producer_config.pop("flush", False)
             self.producer = producer(producer_config, value_serializer=value_serializer)
         if consumer_config:
+            self.skip_unhandled = consumer_config.pop("skip_unhandled", False)
+            self.batch_size = consumer_config.pop("batch_size", self.batch_size)
+            self.batch_timeout = consumer_config.pop("batch_timeout", self.batch_timeout)
+            # handle messages on a key affine worker pool, see `ParallelDispatcher`
+            # for the options. Example: {"workers": 8, "max_in_flight": 1000}
+            self.parallel = consumer_config.pop("parallel", None)
+            # max number of messages handled concurrently by `consume_async`
+            self.max_in_flight = consumer_config.pop("max_in_flight", self.max_in_flight)
+            # retry failed messages without blocking other keys, see
+            # `_consume_with_retries`.
+            self.retry = consumer_config.pop("retry", None)
             self.consumer = partial(consumer, config=consumer_config)
+            # the batch consumer yields None when there are no messages so a
+            # partial batch can be handled when the batch timeout expires and
+            # offsets can be committed while waiting for messages.
+            self.batch_consumer = partial(
+                consumer, config={**consumer_config, "non_blocking": True}
+            )
+            # the async consumer polls without blocking the event loop.
+            self.async_consumer = partial(
+                consumer, config={**consumer_config, "non_blocking": True, "poll_timeout": 0}
+            )
         if offset_wd_config:
             self.offset_watchdog = OffsetWatchdog(offset_wd_config)
 
@@ -61,31 +99,87 @@ class KafkaAvroBackend(MessageBusBackend):
             except Exception:
                 logger.exception("Failed to set offset, but will continue")
 
-    @metrics.call_counter("eventsourcing_helpers.messagebus.kafka.handle.count")
-    @metrics.timed("eventsourcing_helpers.messagebus.kafka.handle.time")
-    def _handle(self, handler: Callable, message: Message, consumer: AvroConsumer) -> None:
-        start_time = time.time()
-        if self._shall_handle(message):
-            handler(message)
-            self._set_handled(message)
+    def _commit(
+        self, consumer: AvroConsumer, offsets: list = None, asynchronous: bool = False
+    ) -> None:
         if consumer.is_auto_commit is False:
+            kwargs = {} if offsets is None else {"offsets": offsets}
             try:
-                consumer.commit(asynchronous=False)
+                consumer.commit(asynchronous=asynchronous, **kwargs)
             except KafkaException as e:
                 error_code = e.args[0].code()
                 if error_code == KafkaError._NO_OFFSET:  # type: ignore[attr-defined]
                     logger.warning("Offset already committed")
                 else:
                     raise
+
+    @metrics.call_counter("eventsourcing_helpers.messagebus.kafka.handle.count")
+    @metrics.timed("eventsourcing_helpers.messagebus.kafka.handle.time")
+    def _handle(self, handler: Callable, message: Message, consumer: AvroConsumer) -> None:
+        start_time = time.time()
+        if self._shall_handle(message):
+            handler(message)
+            self._set_handled(message)
+        self._commit(consumer)
         end_time = time.time() - start_time
         logger.debug(f"Message processed in {end_time:.5f}s")
 
-    def produce(self, value: dict, key: str = None, topic: str = None, **kwargs) -> None:
+    @metrics.call_counter("eventsourcing_helpers.messagebus.kafka.handle_batch.count")
+    @metrics.timed("eventsourcing_helpers.messagebus.kafka.handle_batch.time")
+    def _handle_batch(
+        self, handler: Callable, messages: List[Message], consumer: AvroConsumer
+    ) -> None:
+        start_time = time.time()
+        handled = [message for message in messages if self._shall_handle(message)]
+        if handled:
+            try:
+                handler(handled)
+            except BatchError as e:
+                # the messages handled before the failure are done, committing
+                # them keeps their events from being produced again.
+                self._commit_batch_progress(messages, e.unhandled, consumer)
+                raise
+            for message in handled:
+                self._set_handled(message)
+        self._commit(consumer)
+        end_time = time.time() - start_time
+        logger.debug(f"Batch of {len(messages)} messages processed in {end_time:.5f}s")
+
+    def _commit_batch_progress(
+        self, messages: List[Message], unhandled: List[Message], consumer: AvroConsumer
+    ) -> None:
+        """
+        Commit the offsets of a failed batch up to the first unhandled
+        message in each partition.
+        """
+        unhandled_ids = {id(message) for message in unhandled}
+        last_handled: Dict[Tuple[str, int], Message] = {}
+        failed_partitions = set()
+        for message in messages:
+            partition = (message._meta.topic, message._meta.partition)
+            if partition in failed_partitions:
+                continue
+            if id(message) in unhandled_ids:
+                failed_partitions.add(partition)
+                continue
+            self._set_handled(message)
+            last_handled[partition] = message
+
+        if last_handled:
+            self._commit(consumer, offsets=get_commit_offsets(list(last_handled.values())))
+
+    def produce(
+        self, value: dict, key: str = None, topic: str = None, headers: dict = None, **kwargs
+    ) -> None:
         assert self.producer is not None, "Producer is not configured"
 
+        # the class header lets consumers skip unhandled messages without
+        # decoding the value.
+        headers = add_message_class_header(value, headers)
+
         while True:
             try:
-                self.producer.produce(key=key, value=value, topic=topic, **kwargs)
+                self.producer.produce(key=key, value=value, topic=topic, headers=headers, **kwargs)
                 break
             except BufferError:
                 self.producer.poll(timeout=0.5)
@@ -100,9 +194,356 @@ class KafkaAvroBackend(MessageBusBackend):
         assert self.consumer is not None, "Consumer is not configured"
         return self.consumer
 
-    def consume(self, handler: Callable) -> None:
+    def _get_consumer(self, Consumer: Callable, message_filter: Callable = None) -> Callable:
+        if self.skip_unhandled and message_filter is not None:
+            Consumer = partial(
+                Consumer, get_message=partial(get_routed_message, message_filter=message_filter)
+            )
+        return Consumer
+
+    def _subscribe(self, consumer: AvroConsumer, on_revoke: Callable = None) -> None:
+        """
+        Subscribe again to get notified about revoked partitions.
+
+        Args:
+            consumer: Consumer that has not been polled yet.
+            on_revoke: Callable receiving a list of revoked (topic, partition)
+                pairs.
+        """
+        if on_revoke is None:
+            return
+
+        def revoke(_consumer, partitions):
+            on_revoke([(p.topic, p.partition) for p in partitions])
+
+        consumer.subscribe(consumer.topics, on_revoke=revoke)
+
+    def consume(
+        self, handler: Callable, message_filter: Callable = None, on_revoke: Callable = None
+    ) -> None:
+        """
+        Consume and handle messages indefinitely.
+
+        Args:
+            handler: Message handler.
+            message_filter (optional): Callable returning True if a message
+                class is handled. Only used when `skip_unhandled` is enabled.
+            on_revoke (optional): Callable receiving a list of revoked
+                (topic, partition) pairs on rebalance.
+        """
         assert callable(handler), "You must pass a message handler"
-        Consumer = self.get_consumer()
+        assert not (self.parallel and self.retry), "Parallel mode does not support retries"
+        if self.parallel:
+            return self._consume_parallel(handler, message_filter, on_revoke)
+        if self.retry:
+            return self._consume_with_retries(handler, message_filter, on_revoke)
+
+        Consumer = self._get_consumer(self.get_consumer(), message_filter)
+
         with Consumer() as consumer:
+            self._subscribe(consumer, on_revoke)
             for message in consumer:
                 self._handle(handler, message, consumer)
+
+    def _commit_handled(
+        self,
+        dispatcher: Union[ParallelDispatcher, AsyncDispatcher, RetryScheduler],
+        consumer: AvroConsumer,
+        asynchronous: bool = False,
+    ) -> None:
+        """
+        Commit the offsets of all messages handled in order by the dispatcher.
+        """
+        messages = dispatcher.pop_committable()
+        if not messages:
+            return
+
+        for message in messages:
+            self._set_handled(message)
+        self._commit(consumer, offsets=get_commit_offsets(messages), asynchronous=asynchronous)
+
+    def _consume_parallel(
+        self, handler: Callable, message_filter: Callable = None, on_revoke: Callable = None
+    ) -> None:
+        """
+        Consume messages and handle them in parallel, see `ParallelDispatcher`.
+
+        Messages with the same key are handled in consumed order. Offsets are
+        only committed up to the first message in each partition that has not
+        been handled yet.
+
+        Partitions with messages for a full lane are paused until the lane
+        has room again, see `Lane` for the lane options. Messages failing
+        `max_attempts` times in a lane are produced to the lane's
+        `dead_letter_topic`.
+
+        Example:
+            >>> config = {
+            ...     "consumer": {
+            ...         "parallel": {
+            ...             "workers": 8,
+            ...             "lanes": {
+            ...                 "payments": {
+            ...                     "classes": ["PaymentRequested"],
+            ...                     "timeout": 10.0,
+            ...                     "max_attempts": 5,
+            ...                     "dead_letter_topic": "payments.dlq",
+            ...                 },
+            ...             },
+            ...         },
+            ...     }
+            ... }
+        """
+        assert self.batch_consumer is not None, "Consumer is not configured"
+        assert self.parallel is not None, "Parallel mode is not configured"
+        parallel = dict(self.parallel)
+        lanes = {}
+        for name, lane in (parallel.pop("lanes", None) or {}).items():
+            lane = dict(lane)
+            lanes[name] = {**lane, "dead_letter": self._get_dead_letter(lane)}
+        Consumer = self._get_consumer(self.batch_consumer, message_filter)
+        dispatcher = ParallelDispatcher(handler, lanes=lanes, **parallel)
+
+        with Consumer() as consumer:
+            assert consumer.is_auto_commit is False, "Parallel mode requires manual commits"
+
+            def revoke(partitions):
+                # let the workers finish so the new owner of the partitions
+                # starts where we stopped.
+                dispatcher.join()
+                self._commit_handled(dispatcher, consumer)
+                dispatcher.revoke(partitions)
+                if on_revoke is not None:
+                    on_revoke(partitions)
+
+            self._subscribe(consumer, revoke)
+            try:
+                for message in consumer:
+                    dispatcher.raise_for_error()
+                    if message is not None:
+                        if self._shall_handle(message):
+                            dispatcher.submit(message)
+                        else:
+                            dispatcher.skip(message)
+                    self._pause_full_lanes(dispatcher, consumer)
+                    self._commit_handled(dispatcher, consumer)
+            finally:
+                dispatcher.join()
+                dispatcher.shutdown()
+                self._commit_handled(dispatcher, consumer)
+
+        dispatcher.raise_for_error()
+
+    def _pause_full_lanes(self, dispatcher: ParallelDispatcher, consumer: AvroConsumer) -> None:
+        """
+        Pause the partitions with messages held back for a full lane and
+        resume them when there is room again.
+        """
+        pause, resume = dispatcher.update_paused()
+        if pause:
+            logger.info("Pausing partitions for full lanes", partitions=pause)
+            consumer.pause([TopicPartition(topic, partition) for topic, partition in pause])
+        if resume:
+            logger.info("Resuming partitions", partitions=resume)
+            consumer.resume([TopicPartition(topic, partition) for topic, partition in resume])
+
+    def _get_dead_letter(self, config: dict) -> Union[Callable, None]:
+        """
+        Pop the `dead_letter_topic` option and get a callable producing
+        messages to it.
+        """
+        dead_letter_topic = config.pop("dead_letter_topic", None)
+        if dead_letter_topic is None:
+            return None
+
+        assert self.producer is not None, "Dead letter topic requires a producer"
+        return partial(self._dead_letter, dead_letter_topic)
+
+    def _dead_letter(self, topic: str, message: Message, error: Exception, attempts: int) -> None:
+        """
+        Produce a message that failed too many times to a dead letter topic.
+
+        The original position and the error are added as headers.
+        """
+        meta = message._meta
+        headers = {
+            **(meta.headers or {}),
+            "dead_letter_error": repr(error),
+            "dead_letter_attempts": str(attempts),
+            "dead_letter_topic": meta.topic,
+            "dead_letter_partition": str(meta.partition),
+            "dead_letter_offset": str(meta.offset),
+        }
+        self.produce(value=message.value, key=meta.key, topic=topic, headers=headers)
+
+    def _consume_with_retries(
+        self, handler: Callable, message_filter: Callable = None, on_revoke: Callable = None
+    ) -> None:
+        """
+        Consume messages and retry failed messages, see `RetryScheduler`.
+
+        Messages with the same key as a parked message wait for it, all other
+        messages keep flowing. Offsets are only committed up to the first
+        message in each partition that has not been handled yet.
+
+        Enabled with the `retry` consumer option, see `RetryScheduler` for the
+        options. Messages failing `max_attempts` times are produced to
+        `dead_letter_topic` if it is set.
+
+        Example:
+            >>> config = {
+            ...     "consumer": {
+            ...         "retry": {"max_attempts": 5, "dead_letter_topic": "orders.dlq"},
+            ...     }
+            ... }
+        """
+        assert self.batch_consumer is not None, "Consumer is not configured"
+        assert self.retry is not None, "Retries are not configured"
+        retry = dict(self.retry)
+        dead_letter = self._get_dead_letter(retry)
+        Consumer = self._get_consumer(self.batch_consumer, message_filter)
+        scheduler = RetryScheduler(handler, dead_letter=dead_letter, **retry)
+
+        with Consumer() as consumer:
+            assert consumer.is_auto_commit is False, "Retries require manual commits"
+
+            def revoke(partitions):
+                self._commit_handled(scheduler, consumer)
+                scheduler.revoke(partitions)
+                if on_revoke is not None:
+                    on_revoke(partitions)
+
+            self._subscribe(consumer, revoke)
+            try:
+                for message in consumer:
+                    if message is not None:
+                        if self._shall_handle(message):
+                            scheduler.submit(message)
+                        else:
+                            scheduler.skip(message)
+                    scheduler.process_due()
+                    scheduler.wait_for_capacity()
+                    self._commit_handled(scheduler, consumer)
+            finally:
+                self._commit_handled(scheduler, consumer)
+
+    def consume_batch(
+        self,
+        handler: Callable,
+        message_filter: Callable = None,
+        on_revoke: Callable = None,
+        batch_size: int = None,
+        batch_timeout: float = None,
+    ) -> None:
+        """
+        Consume and handle messages in batches indefinitely.
+
+        A batch is handled when it is full or when `batch_timeout` seconds
+        have passed since its first message was consumed. Offsets are
+        committed after the whole batch has been handled, or up to the first
+        unhandled message in each partition if the handler raises a
+        `BatchError`. A partial batch is handled and committed when partitions
+        are revoked, so the new owner of the partitions starts where we stopped.
+
+        Args:
+            handler: Batch handler, called with a list of messages.
+            message_filter (optional): Callable returning True if a message
+                class is handled. Only used when `skip_unhandled` is enabled.
+            on_revoke (optional): Callable receiving a list of revoked
+                (topic, partition) pairs on rebalance.
+            batch_size (optional): Max number of messages in a batch.
+            batch_timeout (optional): Max seconds to wait for a full batch.
+        """
+        assert callable(handler), "You must pass a message handler"
+        assert self.batch_consumer is not None, "Consumer is not configured"
+        batch_size = batch_size or self.batch_size
+        batch_timeout = self.batch_timeout if batch_timeout is None else batch_timeout
+        Consumer = self._get_consumer(self.batch_consumer, message_filter)
+
+        with Consumer() as consumer:
+            batch: List[Message] = []
+
+            def handle_pending() -> None:
+                if batch:
+                    self._handle_batch(handler, list(batch), consumer)
+                    batch.clear()
+
+            def revoke(partitions):
+                # handle the pending batch while we still own its partitions,
+                # otherwise the new owner would handle the same messages.
+                handle_pending()
+                if on_revoke is not None:
+                    on_revoke(partitions)
+
+            self._subscribe(consumer, revoke)
+            deadline = 0.0
+            for message in consumer:
+                if message is not None:
+                    if not batch:
+                        deadline = time.monotonic() + batch_timeout
+                    batch.append(message)
+                if batch and (len(batch) >= batch_size or time.monotonic() >= deadline):
+                    handle_pending()
+            handle_pending()
+
+    async def consume_async(
+        self,
+        handler: Callable,
+        message_filter: Callable = None,
+        on_revoke: Callable = None,
+        max_in_flight: int = None,
+        idle_sleep: float = 0.01,
+    ) -> None:
+        """
+        Consume messages and handle them concurrently with an async handler.
+
+        Messages with the same key are handled in consumed order, see
+        `AsyncDispatcher`. Offsets are only committed up to the first message
+        in each partition that has not been handled yet.
+
+        The consumer is polled without blocking the event loop. Messages still
+        being handled when their partition is revoked are not committed and
+        will be consumed again by the new owner of the partition.
+
+        Args:
+            handler: Async message handler.
+            message_filter (optional): Callable returning True if a message
+                class is handled. Only used when `skip_unhandled` is enabled.
+            on_revoke (optional): Callable receiving a list of revoked
+                (topic, partition) pairs on rebalance.
+            max_in_flight (optional): Max number of messages handled
+                concurrently.
+            idle_sleep (optional): Seconds to yield to the event loop when
+                there are no messages.
+        """
+        assert callable(handler), "You must pass a message handler"
+        assert self.async_consumer is not None, "Consumer is not configured"
+        Consumer = self._get_consumer(self.async_consumer, message_filter)
+        dispatcher = AsyncDispatcher(handler, max_in_flight or self.max_in_flight)
+
+        with Consumer() as consumer:
+            assert consumer.is_auto_commit is False, "Async mode requires manual commits"
+
+            def revoke(partitions):
+                self._commit_handled(dispatcher, consumer)
+                dispatcher.revoke(partitions)
+                if on_revoke is not None:
+                    on_revoke(partitions)
+
+            self._subscribe(consumer, revoke)
+            try:
+                for message in consumer:
+                    dispatcher.raise_for_error()
+                    if message is None:
+                        await asyncio.sleep(idle_sleep)
+                    elif self._shall_handle(message):
+                        await dispatcher.submit(message)
+                        await asyncio.sleep(0)
+                    else:
+                        dispatcher.skip(message)
+                    self._commit_handled(dispatcher, consumer, asynchronous=True)
+            finally:
+                await dispatcher.join()
+                self._commit_handled(dispatcher, consumer)
+
+        dispatcher.raise_for_error()
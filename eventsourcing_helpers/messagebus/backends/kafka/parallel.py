@@ -0,0 +1,627 @@
+"""
+Key affine parallel message handling.
+
+Messages are dispatched to a pool of worker threads by hashing the message
+key, so all messages with the same key (e.g. the same aggregate root id) are
+handled by the same worker in the order they were consumed, while messages
+with different keys are handled in parallel.
+
+Since messages complete out of order, the `OffsetTracker` keeps track of
+every in-flight message per partition and only lets us commit up to the
+highest offset where all messages before it have been handled.
+
+Threads are used rather than processes since handlers hold connections to
+the repository, snapshot storage and message bus that can't be shared with
+another process. For async handlers `AsyncDispatcher` does the same with
+tasks on the event loop.
+
+Slow message classes can be isolated in lanes (bulkheads) with their own
+workers, queue depth and timeout, so they can't starve the other message
+classes, see `Lane`. A message is handled where its key is already in
+flight, so the messages of a key stay in order across lanes.
+"""
+
+import asyncio
+import queue
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Deque, Dict, Iterable, List, Set, Tuple, Union
+
+import structlog
+from confluent_kafka import TopicPartition
+
+from eventsourcing_helpers.metrics import statsd
+from eventsourcing_helpers.serializers import get_message_class
+
+from confluent_kafka_helpers.message import Message
+
+logger = structlog.get_logger(__name__)
+
+Partition = Tuple[str, int]
+Key = Union[str, bytes, int, None]
+
+
+def get_key(message: Message) -> Key:
+    """
+    Get the key a message is ordered by, messages without a key are ordered
+    by partition.
+    """
+    key = message._meta.key
+    return message._meta.partition if key is None else key
+
+
+class TrackedMessage:
+    __slots__ = ("message", "done")
+
+    def __init__(self, message: Message, done: bool = False) -> None:
+        self.message = message
+        self.done = done
+
+
+class OffsetTracker:
+    """
+    Tracks in-flight messages per partition in consumed order.
+    """
+
+    def __init__(self) -> None:
+        self._partitions: Dict[Partition, Deque[TrackedMessage]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(1 for p in self._partitions.values() for m in p if not m.done)
+
+    def add(self, message: Message, done: bool = False) -> TrackedMessage:
+        """
+        Start tracking a consumed message.
+
+        Args:
+            message: Consumed message.
+            done: Flag to indicate if the message is already handled, e.g.
+                skipped messages.
+        """
+        tracked = TrackedMessage(message, done)
+        key = (message._meta.topic, message._meta.partition)
+        with self._lock:
+            self._partitions.setdefault(key, deque()).append(tracked)
+        return tracked
+
+    def pop_committable(self) -> List[Message]:
+        """
+        Stop tracking all handled messages that are not preceded by an
+        unhandled message in the same partition.
+
+        Returns:
+            list: The last handled message for each partition that advanced.
+        """
+        committable = []
+        with self._lock:
+            for tracked_messages in self._partitions.values():
+                last = None
+                while tracked_messages and tracked_messages[0].done:
+                    last = tracked_messages.popleft()
+                if last is not None:
+                    committable.append(last.message)
+        return committable
+
+    def revoke(self, partitions: Iterable[Partition]) -> None:
+        """
+        Stop tracking all messages in the given partitions.
+        """
+        with self._lock:
+            for partition in partitions:
+                self._partitions.pop(partition, None)
+
+
+class KeyAffinePool:
+    """
+    Worker threads with one queue each. Messages with the same key always end
+    up in the same queue.
+
+    Args:
+        handle: Callable handling one message in a worker.
+        workers: Number of worker threads.
+    """
+
+    def __init__(self, handle: Callable, workers: int, name: str = "eventsourcing-worker") -> None:
+        assert workers > 0, "You need at least one worker"
+        self.handle = handle
+        self.queues: List[queue.Queue] = [queue.Queue() for _ in range(workers)]
+        self.threads = [
+            threading.Thread(target=self._work, args=(q,), name=f"{name}-{i}", daemon=True)
+            for i, q in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self, q: queue.Queue) -> None:
+        while True:
+            item = q.get()
+            try:
+                if item is None:
+                    return
+                self.handle(item)
+            finally:
+                q.task_done()
+
+    def get_worker(self, key: Union[str, bytes, int, None]) -> int:
+        if not isinstance(key, bytes):
+            key = str(key).encode("utf-8")
+        return zlib.crc32(key) % len(self.queues)
+
+    def submit(self, key: Union[str, bytes, int, None], item: TrackedMessage) -> None:
+        self.queues[self.get_worker(key)].put(item)
+
+    def join(self) -> None:
+        """
+        Wait until all submitted messages have been handled.
+        """
+        for q in self.queues:
+            q.join()
+
+    def shutdown(self) -> None:
+        for q in self.queues:
+            q.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class Lane:
+    """
+    Bulkhead for the messages of some message classes.
+
+    A lane has its own key affine workers and at most `queue_depth` messages
+    in flight, the dispatcher holds back further messages while the lane is
+    full. Messages with the same key are handled in consumed order within the
+    lane, so message classes that must be ordered relative to each other
+    belong in the same lane.
+
+    When a handler raises the message is retried with exponential backoff by
+    the same worker, the other workers of the lane and all other lanes keep
+    going. After `max_attempts` the message is passed to `dead_letter`,
+    without `max_attempts` it is retried until it succeeds.
+
+    A handler running longer than `timeout` is reported as timed out. It
+    can't be interrupted, so the worker waits for it to finish before the
+    message is retried or the next message is handled, a message is never
+    handled twice at the same time.
+
+    Args:
+        name: Name of the lane, used in metrics and thread names.
+        handle: Message handler.
+        on_error: Callable receiving errors the lane can't recover from, i.e.
+            a failing `dead_letter`.
+        on_done (optional): Callable receiving each submitted message when
+            the lane is done with it, handled or not.
+        workers: Number of worker threads.
+        queue_depth: Max number of messages in flight in the lane.
+        timeout (optional): Seconds after which a running handler is
+            reported as timed out.
+        max_attempts (optional): Max number of times a message is handled.
+            Requires `dead_letter`.
+        backoff: Seconds to wait before the first retry.
+        multiplier: Backoff multiplier for each following retry.
+        max_backoff: Max seconds to wait between two retries.
+        dead_letter (optional): Callable receiving the message, the error and
+            the number of attempts when a message has failed `max_attempts`
+            times.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handle: Callable,
+        on_error: Callable,
+        workers: int = 1,
+        queue_depth: int = 100,
+        timeout: Union[float, None] = None,
+        max_attempts: Union[int, None] = None,
+        backoff: float = 1.0,
+        multiplier: float = 2.0,
+        max_backoff: float = 60.0,
+        dead_letter: Union[Callable, None] = None,
+        on_done: Union[Callable, None] = None,
+    ) -> None:
+        assert (
+            max_attempts is None or dead_letter is not None
+        ), f"max_attempts in lane {name} requires a dead letter topic"
+        self.name = name
+        self.handle = handle
+        self.on_error = on_error
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.dead_letter = dead_letter
+        self.on_done = on_done
+        self.in_flight = 0
+        self.tags = [f"lane:{name}"]
+        self._lock = threading.Lock()
+        self._giving_up = threading.Event()
+        self._executor = None
+        if timeout is not None:
+            self._executor = ThreadPoolExecutor(
+                workers, thread_name_prefix=f"eventsourcing-lane-{name}-handler"
+            )
+        self._pool = KeyAffinePool(self._work, workers, name=f"eventsourcing-lane-{name}")
+
+    @property
+    def is_full(self) -> bool:
+        return self.in_flight >= self.queue_depth
+
+    def get_delay(self, attempts: int) -> float:
+        return min(self.backoff * self.multiplier ** (attempts - 1), self.max_backoff)
+
+    def _update_in_flight(self, delta: int) -> None:
+        with self._lock:
+            self.in_flight += delta
+            in_flight = self.in_flight
+        statsd.gauge(  # type: ignore
+            "eventsourcing_helpers.messagebus.kafka.lane.queue_depth", in_flight, tags=self.tags
+        )
+        statsd.gauge(  # type: ignore
+            "eventsourcing_helpers.messagebus.kafka.lane.saturation",
+            in_flight / self.queue_depth,
+            tags=self.tags,
+        )
+
+    def _call(self, message: Message) -> None:
+        if self._executor is None:
+            self.handle(message)
+            return
+
+        future = self._executor.submit(self.handle, message)
+        if not wait([future], timeout=self.timeout).done:
+            logger.error("Handler timed out", lane=self.name, timeout=self.timeout)
+            statsd.increment(  # type: ignore
+                "eventsourcing_helpers.messagebus.kafka.lane.timeout", tags=self.tags
+            )
+        # the key stays busy until the handler has finished, even after a
+        # timeout, so the messages of a key never overlap.
+        future.result()
+
+    def _work(self, tracked: TrackedMessage) -> None:
+        attempts = 0
+        try:
+            while True:
+                try:
+                    self._call(tracked.message)
+                except Exception as e:
+                    attempts += 1
+                    if self._retry(tracked, e, attempts):
+                        continue
+                else:
+                    tracked.done = True
+                return
+        except Exception as e:
+            logger.exception("Failed to handle message in lane", lane=self.name)
+            self.on_error(e)
+        finally:
+            self._update_in_flight(-1)
+            if self.on_done is not None:
+                self.on_done(tracked)
+
+    def _retry(self, tracked: TrackedMessage, error: Exception, attempts: int) -> bool:
+        """
+        Wait for the next attempt, or dead letter the message when it has
+        failed too many times.
+
+        Returns:
+            bool: Flag to indicate if the message shall be handled again.
+        """
+        if self.max_attempts is not None and attempts >= self.max_attempts:
+            assert self.dead_letter is not None
+            logger.error(
+                "Failed to handle message in lane, giving up",
+                lane=self.name,
+                attempts=attempts,
+                error=repr(error),
+            )
+            self.dead_letter(tracked.message, error, attempts)
+            statsd.increment(  # type: ignore
+                "eventsourcing_helpers.messagebus.kafka.lane.dead_letter", tags=self.tags
+            )
+            tracked.done = True
+            return False
+
+        delay = self.get_delay(attempts)
+        logger.warning(
+            "Failed to handle message in lane, retrying later",
+            lane=self.name,
+            attempts=attempts,
+            delay=delay,
+            error=repr(error),
+        )
+        statsd.increment(  # type: ignore
+            "eventsourcing_helpers.messagebus.kafka.lane.retry", tags=self.tags
+        )
+        return not self._giving_up.wait(delay)
+
+    def submit(self, key: Key, item: TrackedMessage) -> None:
+        self._update_in_flight(1)
+        self._pool.submit(key, item)
+
+    def join(self) -> None:
+        """
+        Wait until all submitted messages have been handled. Messages waiting
+        for a retry are given up and stay unhandled, so they are consumed
+        again.
+        """
+        self._giving_up.set()
+        try:
+            self._pool.join()
+        finally:
+            self._giving_up.clear()
+
+    def shutdown(self) -> None:
+        self._giving_up.set()
+        self._pool.shutdown()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+class ParallelDispatcher:
+    """
+    Handles messages in parallel on a key affine worker pool.
+
+    At most `max_in_flight` messages are dispatched but not yet handled,
+    `submit` blocks when the limit is reached.
+
+    If a handler raises, no further messages are handled and the error is
+    re-raised in the consuming thread by `raise_for_error`. Errors in lanes
+    are retried in the lane instead, see `Lane`.
+
+    Messages for a full lane are held back in consumed order per partition,
+    `update_paused` returns the partitions to pause until there is room in
+    the lane again, so the consuming thread never waits for a slow lane.
+
+    A message whose key is still in flight in a lane, or in the worker pool,
+    is handled there as well instead of by its own message class' lane, so
+    the messages of a key are always handled in consumed order.
+
+    Args:
+        handler: Message handler.
+        workers: Number of worker threads.
+        max_in_flight: Max number of dispatched but not yet handled messages,
+            not counting the messages in lanes.
+        lanes (optional): Lanes keyed by name, each with the message
+            `classes` it handles and the `Lane` options. Example:
+            {"payments": {"classes": ["PaymentRequested"], "workers": 2,
+            "queue_depth": 50, "timeout": 10.0}}
+    """
+
+    def __init__(
+        self,
+        handler: Callable,
+        workers: int = 8,
+        max_in_flight: int = 1000,
+        lanes: Union[Dict[str, dict], None] = None,
+    ) -> None:
+        self.handler = handler
+        self.tracker = OffsetTracker()
+        self.error: Union[Exception, None] = None
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._pool = KeyAffinePool(self._handle, workers)
+        self._lanes: Dict[str, Lane] = {}
+        self._held_back: Dict[Partition, Deque[Tuple[Lane, Key, TrackedMessage]]] = {}
+        self._paused: Set[Partition] = set()
+        # where the in-flight messages of each key are handled (None for the
+        # worker pool) and how many there are.
+        self._keys: Dict[Key, Tuple[Union[Lane, None], int]] = {}
+        self._keys_lock = threading.Lock()
+        for name, config in (lanes or {}).items():
+            config = dict(config)
+            classes = config.pop("classes")
+            lane = Lane(name, handler, self._set_error, on_done=self._release_key, **config)
+            self._lanes.update((message_class, lane) for message_class in classes)
+
+    def _set_error(self, error: Exception) -> None:
+        if self.error is None:
+            self.error = error
+
+    def _run(self, tracked: TrackedMessage) -> None:
+        try:
+            if self.error is None:
+                self.handler(tracked.message)
+                tracked.done = True
+        except Exception as e:
+            logger.exception("Failed to handle message in worker")
+            self.error = e
+
+    def _handle(self, tracked: TrackedMessage) -> None:
+        try:
+            self._run(tracked)
+        finally:
+            self._release_key(tracked)
+            self._in_flight.release()
+
+    def _acquire_key(self, key: Key, lane: Union[Lane, None]) -> Union[Lane, None]:
+        """
+        Count a message as in flight for its key.
+
+        Returns:
+            Lane: The lane handling the in-flight messages of the key, None
+                for the worker pool.
+        """
+        with self._keys_lock:
+            lane, count = self._keys.get(key, (lane, 0))
+            self._keys[key] = (lane, count + 1)
+        return lane
+
+    def _release_key(self, tracked: TrackedMessage) -> None:
+        key = get_key(tracked.message)
+        with self._keys_lock:
+            lane, count = self._keys[key]
+            if count > 1:
+                self._keys[key] = (lane, count - 1)
+            else:
+                del self._keys[key]
+
+    def _get_lane(self, message: Message) -> Union[Lane, None]:
+        if not self._lanes:
+            return None
+        message_class = get_message_class(message.value)
+        return None if message_class is None else self._lanes.get(message_class)
+
+    @property
+    def lanes(self) -> List[Lane]:
+        return list({id(lane): lane for lane in self._lanes.values()}.values())
+
+    def raise_for_error(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, message: Message) -> None:
+        """
+        Dispatch a message to the worker handling its key.
+
+        Messages without a key are dispatched by partition.
+        """
+        key = get_key(message)
+        lane = self._acquire_key(key, self._get_lane(message))
+        if lane is not None:
+            tracked = self.tracker.add(message)
+            partition = (message._meta.topic, message._meta.partition)
+            if partition in self._held_back or lane.is_full:
+                self._held_back.setdefault(partition, deque()).append((lane, key, tracked))
+            else:
+                lane.submit(key, tracked)
+            return
+
+        self._in_flight.acquire()
+        tracked = self.tracker.add(message)
+        self._pool.submit(key, tracked)
+
+    def update_paused(self) -> Tuple[List[Partition], List[Partition]]:
+        """
+        Dispatch held back messages to their lanes while there is room.
+
+        Returns:
+            tuple: Partitions to pause and partitions to resume.
+        """
+        for partition, held_back in list(self._held_back.items()):
+            while held_back and not held_back[0][0].is_full:
+                lane, key, tracked = held_back.popleft()
+                lane.submit(key, tracked)
+            if not held_back:
+                del self._held_back[partition]
+
+        pause = [p for p in self._held_back if p not in self._paused]
+        resume = [p for p in self._paused if p not in self._held_back]
+        self._paused = set(self._held_back)
+        return pause, resume
+
+    def skip(self, message: Message) -> None:
+        """
+        Track a message that is not handled, so its offset can be committed.
+        """
+        self.tracker.add(message, done=True)
+
+    def join(self) -> None:
+        """
+        Wait until all dispatched messages have been handled. Held back
+        messages and messages waiting for a retry in a lane stay unhandled.
+        """
+        self._pool.join()
+        for lane in self.lanes:
+            lane.join()
+
+    def shutdown(self) -> None:
+        self._pool.shutdown()
+        for lane in self.lanes:
+            lane.shutdown()
+
+    def pop_committable(self) -> List[Message]:
+        return self.tracker.pop_committable()
+
+    def revoke(self, partitions: Iterable[Partition]) -> None:
+        partitions = set(partitions)
+        for partition in partitions:
+            for _, _, tracked in self._held_back.pop(partition, ()):
+                self._release_key(tracked)
+        self._paused -= partitions
+        self.tracker.revoke(partitions)
+
+
+class AsyncDispatcher:
+    """
+    Handles messages concurrently as tasks on the running event loop.
+
+    Each message waits for the previous message with the same key before it
+    is handled, so per key ordering is preserved. At most `max_in_flight`
+    messages are dispatched but not yet handled, `submit` waits when the
+    limit is reached.
+
+    Args:
+        handler: Async message handler.
+        max_in_flight: Max number of dispatched but not yet handled messages.
+    """
+
+    def __init__(self, handler: Callable, max_in_flight: int = 100) -> None:
+        self.handler = handler
+        self.tracker = OffsetTracker()
+        self.error: Union[Exception, None] = None
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._tails: Dict[Union[str, bytes, int, None], asyncio.Task] = {}
+
+    async def _handle(self, tracked: TrackedMessage, previous: Union[asyncio.Task, None]) -> None:
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            if self.error is None:
+                await self.handler(tracked.message)
+                tracked.done = True
+        except Exception as e:
+            logger.exception("Failed to handle message in task")
+            self.error = e
+        finally:
+            self._in_flight.release()
+
+    def _release_tail(self, key: Union[str, bytes, int, None], task: asyncio.Task) -> None:
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    def raise_for_error(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    async def submit(self, message: Message) -> None:
+        """
+        Dispatch a message, messages without a key are ordered by partition.
+        """
+        await self._in_flight.acquire()
+        tracked = self.tracker.add(message)
+        key = message._meta.key
+        if key is None:
+            key = message._meta.partition
+
+        task = asyncio.create_task(self._handle(tracked, self._tails.get(key)))
+        self._tails[key] = task
+        task.add_done_callback(lambda task: self._release_tail(key, task))
+
+    def skip(self, message: Message) -> None:
+        self.tracker.add(message, done=True)
+
+    async def join(self) -> None:
+        """
+        Wait until all dispatched messages have been handled.
+        """
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+    def pop_committable(self) -> List[Message]:
+        return self.tracker.pop_committable()
+
+    def revoke(self, partitions: Iterable[Partition]) -> None:
+        self.tracker.revoke(partitions)
+
+
+def get_commit_offsets(messages: List[Message]) -> List[TopicPartition]:
+    """
+    Get the offsets to commit for the last handled message in each partition.
+    """
+    return [TopicPartition(m._meta.topic, m._meta.partition, m._meta.offset + 1) for m in messages]
@@ -0,0 +1,217 @@
+"""
+Non-blocking retries of failed messages.
+
+When a handler raises, the message is parked in a local delay queue and
+retried with exponential backoff. Only messages with the same key as a
+parked message wait behind it, messages with other keys keep flowing. After
+`max_attempts` the message is handed to a dead letter callable (e.g.
+produced to a dead letter topic) so the key can continue.
+
+Offsets are tracked with an `OffsetTracker`, so the committed position
+never passes a parked message. If the consumer is stopped while messages
+are parked they are consumed again when it restarts.
+"""
+
+import heapq
+import itertools
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Tuple, Union
+
+import structlog
+
+from eventsourcing_helpers.messagebus.backends.kafka.parallel import (
+    OffsetTracker,
+    Partition,
+    TrackedMessage,
+)
+from eventsourcing_helpers.metrics import statsd
+from eventsourcing_helpers.serializers import get_message_class
+
+from confluent_kafka_helpers.message import Message
+
+logger = structlog.get_logger(__name__)
+
+Key = Union[str, bytes, int, None]
+
+
+class ParkedKey:
+    __slots__ = ("messages", "attempts")
+
+    def __init__(self, messages: Deque[TrackedMessage], attempts: int) -> None:
+        self.messages = messages
+        self.attempts = attempts
+
+
+def get_message_tags(message: Message) -> List[str]:
+    return [f"message_class:{get_message_class(message.value)}"]
+
+
+class RetryScheduler:
+    """
+    Handles messages and schedules retries of failed messages per key.
+
+    Args:
+        handler: Message handler.
+        dead_letter (optional): Callable receiving the message, the error and
+            the number of attempts when a message has failed `max_attempts`
+            times. If not set the error is raised instead.
+        max_attempts: Max number of times a message is handled.
+        backoff: Seconds to wait before the first retry.
+        multiplier: Backoff multiplier for each following retry.
+        max_backoff: Max seconds to wait between two retries.
+        max_parked: Max number of parked messages, `wait_for_capacity`
+            blocks until retries bring the number below it.
+        clock: Monotonic clock in seconds.
+    """
+
+    def __init__(
+        self,
+        handler: Callable,
+        dead_letter: Union[Callable, None] = None,
+        max_attempts: int = 5,
+        backoff: float = 1.0,
+        multiplier: float = 2.0,
+        max_backoff: float = 60.0,
+        max_parked: int = 1000,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        assert max_attempts > 0, "max_attempts must be positive"
+        self.handler = handler
+        self.dead_letter = dead_letter
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.max_parked = max_parked
+        self.clock = clock
+        self.tracker = OffsetTracker()
+        self._parked: Dict[Key, ParkedKey] = {}
+        self._due: List[Tuple[float, int, Key]] = []
+        self._sequence = itertools.count()
+
+    @property
+    def num_parked(self) -> int:
+        return sum(len(p.messages) for p in self._parked.values())
+
+    def get_delay(self, attempts: int) -> float:
+        return min(self.backoff * self.multiplier ** (attempts - 1), self.max_backoff)
+
+    def _get_key(self, message: Message) -> Key:
+        key = message._meta.key
+        return message._meta.partition if key is None else key
+
+    def submit(self, message: Message) -> None:
+        """
+        Handle a message, or park it if a previous message with the same key
+        is waiting to be retried.
+        """
+        tracked = self.tracker.add(message)
+        key = self._get_key(message)
+        parked = self._parked.get(key)
+        if parked is not None:
+            parked.messages.append(tracked)
+            return
+
+        self._run(key, deque([tracked]), attempts=0)
+
+    def skip(self, message: Message) -> None:
+        self.tracker.add(message, done=True)
+
+    def _run(self, key: Key, messages: Deque[TrackedMessage], attempts: int) -> None:
+        """
+        Handle the messages of a key in order until one of them fails.
+        """
+        while messages:
+            tracked = messages[0]
+            try:
+                self.handler(tracked.message)
+            except Exception as e:
+                attempts += 1
+                if attempts < self.max_attempts:
+                    self._park(key, messages, attempts, e)
+                    return
+                self._dead_letter(tracked, e, attempts)
+
+            tracked.done = True
+            messages.popleft()
+            attempts = 0
+
+        self._parked.pop(key, None)
+
+    def _park(
+        self, key: Key, messages: Deque[TrackedMessage], attempts: int, error: Exception
+    ) -> None:
+        delay = self.get_delay(attempts)
+        logger.warning(
+            "Failed to handle message, retrying later",
+            key=key,
+            attempts=attempts,
+            delay=delay,
+            error=repr(error),
+        )
+        statsd.increment(  # type: ignore
+            "eventsourcing_helpers.messagebus.kafka.retry.count",
+            tags=get_message_tags(messages[0].message),
+        )
+        self._parked[key] = ParkedKey(messages, attempts)
+        heapq.heappush(self._due, (self.clock() + delay, next(self._sequence), key))
+        self._report_parked()
+
+    def _report_parked(self) -> None:
+        statsd.gauge(  # type: ignore
+            "eventsourcing_helpers.messagebus.kafka.retry.parked", self.num_parked
+        )
+
+    def _dead_letter(self, tracked: TrackedMessage, error: Exception, attempts: int) -> None:
+        if self.dead_letter is None:
+            raise error
+
+        logger.error(
+            "Failed to handle message, giving up",
+            attempts=attempts,
+            error=repr(error),
+        )
+        self.dead_letter(tracked.message, error, attempts)
+        statsd.increment(  # type: ignore
+            "eventsourcing_helpers.messagebus.kafka.retry.dead_letter",
+            tags=get_message_tags(tracked.message),
+        )
+
+    def process_due(self) -> None:
+        """
+        Retry all parked keys whose backoff has passed.
+        """
+        now = self.clock()
+        if not self._due or self._due[0][0] > now:
+            return
+
+        while self._due and self._due[0][0] <= now:
+            _, _, key = heapq.heappop(self._due)
+            parked = self._parked.get(key)
+            if parked is not None:
+                self._run(key, parked.messages, parked.attempts)
+        self._report_parked()
+
+    def wait_for_capacity(self, sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        Block while too many messages are parked, retrying them when due.
+        """
+        while self._due and self.num_parked >= self.max_parked:
+            sleep(max(self._due[0][0] - self.clock(), 0))
+            self.process_due()
+
+    def pop_committable(self) -> List[Message]:
+        return self.tracker.pop_committable()
+
+    def revoke(self, partitions: Iterable[Partition]) -> None:
+        """
+        Forget all parked messages in the revoked partitions, the new owner
+        of the partitions will consume them again.
+        """
+        partitions = set(partitions)
+        for key, parked in list(self._parked.items()):
+            meta = parked.messages[0].message._meta
+            if (meta.topic, meta.partition) in partitions:
+                del self._parked[key]
+        self.tracker.revoke(partitions)
@@ -0,0 +1,125 @@
+"""
+Header based message routing.
+
+Every message produced through the Kafka backends carries its class name in
+the `MESSAGE_CLASS_HEADER` header. When a consumer is configured with
+`skip_unhandled` the class header is inspected *before* the message value is
+Avro decoded, so messages that no handler is interested in are skipped without
+paying for the decoding, deserialization and handler call.
+
+Messages without the header (e.g. produced by older versions) are always
+decoded and passed on to the handler.
+"""
+
+from typing import Any, Callable, Union
+
+import structlog
+from confluent_kafka import Message as KafkaMessage
+from confluent_kafka.avro import AvroConsumer
+
+from eventsourcing_helpers.metrics import base_metric, statsd
+from eventsourcing_helpers.serializers import MESSAGE_CLASS_HEADER
+
+from confluent_kafka_helpers.exceptions import EndOfPartition, KafkaTransportError
+from confluent_kafka_helpers.utils import retry_exception
+
+logger = structlog.get_logger(__name__)
+
+
+def get_header_message_class(message: KafkaMessage) -> Union[str, None]:
+    """
+    Get the message class from the headers of a raw (not yet decoded) message.
+    """
+    headers = message.headers()
+    if not headers:
+        return None
+
+    items = headers.items() if isinstance(headers, dict) else headers
+    for key, value in items:
+        if key == MESSAGE_CLASS_HEADER:
+            return value.decode("utf-8") if isinstance(value, bytes) else value
+    return None
+
+
+def poll_raw(consumer: AvroConsumer, timeout: float) -> Union[KafkaMessage, None]:
+    """
+    Poll a message without Avro decoding it.
+
+    `AvroConsumer.poll` decodes every message, so the poll of the plain
+    consumer it extends is used instead.
+    """
+    return super(AvroConsumer, consumer).poll(timeout)
+
+
+def get_message_serializer(consumer: AvroConsumer) -> Any:
+    """
+    Get the Avro message serializer of a consumer.
+
+    `AvroConsumer` doesn't expose its serializer, this is the only place
+    depending on it.
+    """
+    return consumer._serializer
+
+
+def decode_message(consumer: AvroConsumer, message: KafkaMessage) -> KafkaMessage:
+    """
+    Avro decode the key and value of a raw message in place.
+
+    This is the decoding `confluent_kafka.avro.AvroConsumer.poll` would have
+    done for us.
+    """
+    serializer = get_message_serializer(consumer)
+    if message.value() is not None:
+        message.set_value(serializer.decode_message(message.value(), is_key=False))
+    if message.key() is not None:
+        message.set_key(serializer.decode_message(message.key(), is_key=True))
+    return message
+
+
+@retry_exception(exceptions=[KafkaTransportError])
+def get_routed_message(
+    consumer: AvroConsumer,
+    error_handler: Callable,
+    message_filter: Callable,
+    timeout: float = 0.1,
+    stop_on_eof: bool = False,
+) -> Union[KafkaMessage, None]:
+    """
+    Poll a message and only decode it if the `message_filter` accepts its class.
+
+    Drop-in replacement for `confluent_kafka_helpers.consumer.get_message`.
+
+    Args:
+        consumer: Confluent Avro consumer.
+        error_handler: Callable raising on Kafka errors.
+        message_filter: Callable returning True if a message class is handled.
+        timeout: Poll timeout in seconds.
+        stop_on_eof: Flag to indicate if we should stop on end of partition.
+
+    Returns:
+        Message: Decoded message or None if there were no message or if the
+            message was skipped.
+    """
+    message = poll_raw(consumer, timeout)
+    if message is None:
+        return None
+
+    if message.error():
+        try:
+            error_handler(message.error())
+        except EndOfPartition:
+            if stop_on_eof:
+                raise
+            else:
+                return None
+
+    message_class = get_header_message_class(message)
+    if message_class is not None and not message_filter(message_class):
+        logger.debug("Skipping unhandled message", message_class=message_class)
+        statsd.increment(  # type: ignore
+            f"{base_metric}.messagebus.kafka.handle.skipped",
+            tags=[f"message_class:{message_class}"],
+        )
+        return None
+
+    return decode_message(consumer, message)
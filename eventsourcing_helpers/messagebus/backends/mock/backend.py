@@ -1,3 +1,4 @@
+import asyncio
 import time
 import warnings
 from collections import deque
@@ -8,6 +9,7 @@ import structlog
 
 from eventsourcing_helpers.message import Message as MessageToKafka
 from eventsourcing_helpers.message.pydantic import PydanticMixin
+from eventsourcing_helpers.message.schema import SchemaMessage
 from eventsourcing_helpers.messagebus.backends import MessageBusBackend
 from eventsourcing_helpers.messagebus.backends.mock.utils import create_message
 from eventsourcing_helpers.serializers import to_message_from_dto
@@ -127,11 +129,17 @@ class MockBackend(MessageBusBackend):
         value_serializer: Callable = to_message_from_dto,
         **kwargs,
     ) -> None:
-        if isinstance(value, (MessageToKafka, PydanticMixin)):
+        if isinstance(value, (MessageToKafka, PydanticMixin, SchemaMessage)):
             value = value_serializer(value)
         self.producer.add_message(dict(value=value, key=key, **kwargs))
 
-    def consume(self, handler: Callable) -> None:
+    def consume(
+        self,
+        handler: Callable,
+        message_filter: Callable = None,
+        on_revoke: Callable = None,
+        **kwargs,
+    ) -> None:
         stop_on_eof = self.config["consumer"].get("stop_on_eof", True)
         messages = self.consumer.get_messages()
         while True:
@@ -141,3 +149,38 @@ class MockBackend(MessageBusBackend):
                 break
             else:
                 time.sleep(0.1)
+
+    def consume_batch(
+        self,
+        handler: Callable,
+        message_filter: Callable = None,
+        on_revoke: Callable = None,
+        batch_size: int = 100,
+        **kwargs,
+    ) -> None:
+        stop_on_eof = self.config["consumer"].get("stop_on_eof", True)
+        messages = self.consumer.get_messages()
+        while True:
+            if messages:
+                handler([messages.popleft() for _ in range(min(batch_size, len(messages)))])
+            elif stop_on_eof:
+                break
+            else:
+                time.sleep(0.1)
+
+    async def consume_async(
+        self,
+        handler: Callable,
+        message_filter: Callable = None,
+        on_revoke: Callable = None,
+        **kwargs,
+    ) -> None:
+        stop_on_eof = self.config["consumer"].get("stop_on_eof", True)
+        messages = self.consumer.get_messages()
+        while True:
+            if messages:
+                await handler(messages.popleft())
+            elif stop_on_eof:
+                break
+            else:
+                await asyncio.sleep(0.1)
@@ -85,7 +85,36 @@ class MockBackend(MessageBusBackend):
     def produce(self, value: dict, key: str = None, **kwargs) -> None:
         self.producer.add_message(dict(value=value, key=key, **kwargs))
 
-    def consume(self, handler: Callable) -> None:
+    def consume(
+        self,
+        handler: Callable,
+        message_filter: Callable = None,
+        on_revoke: Callable = None,
+        **kwargs,
+    ) -> None:
         messages = self.consumer.get_messages()
         while messages:
             handler(messages.popleft())
+
+    def consume_batch(
+        self,
+        handler: Callable,
+        message_filter: Callable = None,
+        on_revoke: Callable = None,
+        batch_size: int = 100,
+        **kwargs,
+    ) -> None:
+        messages = self.consumer.get_messages()
+        while messages:
+            handler([messages.popleft() for _ in range(min(batch_size, len(messages)))])
+
+    async def consume_async(
+        self,
+        handler: Callable,
+        message_filter: Callable = None,
+        on_revoke: Callable = None,
+        **kwargs,
+    ) -> None:
+        messages = self.consumer.get_messages()
+        while messages:
+            await handler(messages.popleft())
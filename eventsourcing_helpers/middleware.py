@@ -0,0 +1,117 @@
+"""
+Handler middleware.
+
+A middleware is a callable with the signature `middleware(call_next, route)`
+that returns a new callable wrapping `call_next`. The chain is composed once
+per route when the handler is initialized, so nothing is wrapped or allocated
+per message.
+
+Middleware used with async handlers must return a coroutine function when
+`call_next` is a coroutine function.
+
+Example:
+    >>> def log_calls(call_next, route):
+    ...     def call(*args):
+    ...         logger.info("Calling handler", handler=route.handler_name)
+    ...         return call_next(*args)
+    ...     return call
+    >>> class MyEventHandler(EventHandler):
+    ...     handlers = {"OrderCreated": order_created}
+    ...     middleware = [log_calls]
+"""
+
+from inspect import iscoroutinefunction
+from typing import TYPE_CHECKING, Any, Callable, List
+
+from eventsourcing_helpers import metrics
+
+if TYPE_CHECKING:  # pragma: no cover
+    from eventsourcing_helpers.handler import HandlerRoute
+
+Middleware = Callable[[Callable, "HandlerRoute"], Callable]
+
+
+def metrics_enabled() -> bool:
+    return not isinstance(metrics.statsd, metrics.StatsdNullClient)
+
+
+def timed(metric: str) -> Middleware:
+    """
+    Middleware timing the handler call.
+
+    Args:
+        metric: Name of the timing metric.
+    """
+
+    def middleware(call_next: Callable, route: "HandlerRoute") -> Callable:
+        if not metrics_enabled():
+            return call_next
+        if not iscoroutinefunction(call_next):
+            return metrics.statsd.timed(metric, tags=route.tags)(call_next)
+
+        statsd, tags = metrics.statsd, route.tags
+
+        async def call(*args: Any) -> Any:
+            with statsd.timed(metric, tags=tags):
+                return await call_next(*args)
+
+        return call
+
+    return middleware
+
+
+def count_errors(metric: str) -> Middleware:
+    """
+    Middleware counting handler errors.
+
+    Args:
+        metric: Name of the counter metric.
+    """
+
+    def middleware(call_next: Callable, route: "HandlerRoute") -> Callable:
+        if not metrics_enabled():
+            return call_next
+
+        statsd, tags = metrics.statsd, route.tags
+
+        if iscoroutinefunction(call_next):
+
+            async def async_call(*args: Any) -> Any:
+                try:
+                    return await call_next(*args)
+                except Exception:
+                    statsd.increment(metric, tags=tags)  # type: ignore
+                    raise
+
+            return async_call
+
+        def call(*args: Any) -> Any:
+            try:
+                return call_next(*args)
+            except Exception:
+                statsd.increment(metric, tags=tags)  # type: ignore
+                raise
+
+        return call
+
+    return middleware
+
+
+def compose(handler: Callable, route: "HandlerRoute", middleware: List[Middleware]) -> Callable:
+    """
+    Compose the middleware chain for a handler.
+
+    The first middleware in the list is the outermost one.
+
+    Args:
+        handler: Handler to be called last in the chain.
+        route: Route the chain is composed for.
+        middleware: List of middleware.
+
+    Returns:
+        Callable: The composed chain.
+    """
+    call = handler
+    for m in reversed(middleware):
+        call = m(call, route)
+    return call
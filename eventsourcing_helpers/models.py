@@ -1,8 +1,9 @@
 import json
 import re
+import threading
 import uuid
 from itertools import chain
-from typing import Any, Callable, Iterator, List, Union
+from typing import Any, Callable, Iterable, Iterator, List, Union
 
 import jsonpickle
 import structlog
@@ -17,15 +18,41 @@ class MissingEntityApplyMethod(Exception):
     pass
 
 
+class StagedEvents(threading.local):
+    """
+    Staged events that later will be committed to the repository.
+
+    The list is shared between all entities handled in the same thread, so
+    commands can be handled in parallel by multiple threads.
+    """
+
+    def __init__(self) -> None:
+        self.events: List[Any] = []
+
+    def __get__(self, instance: Any, owner: Any = None) -> List[Any]:
+        return self.events
+
+
+staged_events = StagedEvents()
+
+
 class Entity:
     """
     A rich domain model that exposes attributes and behaviour
     with an identity and a life cycle.
     """
 
-    # a shared list between all entities with staged events
-    # that later will be committed to the repository.
-    _events: List[Any] = []
+    # a shared list between all entities (in the current thread) with staged
+    # events that later will be committed to the repository.
+    _events = staged_events
+
+    # offset of the last event committed to (or loaded from) the repository,
+    # lets a snapshot be completed with the events committed after it.
+    _offset: Union[int, None] = None
+
+    # stats used by the snapshot policies, see
+    # `eventsourcing_helpers.repository.snapshot.policies`.
+    _snapshot_stats: Union[dict, None] = None
 
     def __init__(self) -> None:
         self.id: Union[str, None] = None
@@ -177,14 +204,16 @@ class Entity:
         Clear staged events from ALL Entity instances.
         """
         logger.info("Clearing staged events")
-        Entity._events = []
+        staged_events.events = []
 
-    def _apply_events(self, events: List[Any], ignore_missing_apply_methods: bool = False) -> None:
+    def _apply_events(
+        self, events: Iterable[Any], ignore_missing_apply_methods: bool = False
+    ) -> None:
         """
         Apply multiple events.
 
         Args:
-            events: A list of events.
+            events: A list or an iterator of events.
         """
         logger.info("Apply events from repository")
         for event in events:
@@ -1,4 +1,6 @@
-from typing import Callable
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, Union
 
 import structlog
 from confluent_kafka import KafkaException
@@ -6,16 +8,29 @@ from confluent_kafka import KafkaException
 from eventsourcing_helpers.metrics import statsd
 from eventsourcing_helpers.models import AggregateRoot
 from eventsourcing_helpers.repository.snapshot import Snapshot
+from eventsourcing_helpers.repository.snapshot.policies import (
+    get_snapshot_policy,
+    get_snapshot_stats,
+    reset_snapshot_stats,
+)
 from eventsourcing_helpers.serializers import from_message_to_dto
 from eventsourcing_helpers.utils import import_backend
 
 BACKENDS = {
     "kafka_avro": "eventsourcing_helpers.repository.backends.kafka.KafkaAvroBackend",
+    "sqlite": "eventsourcing_helpers.repository.backends.sqlite.SQLiteBackend",
+    "log": "eventsourcing_helpers.repository.backends.log.LogBackend",
+    "memory": "eventsourcing_helpers.repository.backends.memory.InMemoryBackend",
 }
 
 logger = structlog.get_logger(__name__)
 
 
+def get_event_offset(event: Any) -> Union[int, None]:
+    offset = getattr(getattr(event, "_meta", None), "offset", None)
+    return offset if isinstance(offset, int) else None
+
+
 class Repository:
     """
     Interface to communicate with a repository backend.
@@ -27,7 +42,12 @@ class Repository:
     to an aggregate root from/to some kind of storage.
 
     It also handles snapshots by saving/loading the latest state of an
-    aggregate root.
+    aggregate root. A snapshot records the offset of the last event it
+    includes, the events committed after it are replayed on load, so a
+    missing or failed snapshot save only makes loading slower.
+
+    How often snapshots are saved is decided by the snapshot policy of the
+    aggregate root class, see `eventsourcing_helpers.repository.snapshot.policies`.
     """
 
     DEFAULT_BACKEND = "kafka_avro"
@@ -57,9 +77,14 @@ class Repository:
         self.aggregate_root_cls = aggregate_root_cls
         self.message_deserializer = message_deserializer
         self.snapshot = snapshot(config, **kwargs)
+        self.aggregate_class = getattr(aggregate_root_cls, "__name__", None)
+        self.snapshot_policy = get_snapshot_policy(config, self.aggregate_class)
         self.backend = backend_class(backend_config, **kwargs)
 
         self.ignore_missing_apply_methods = ignore_missing_apply_methods
+        # message metadata is rarely used when applying events, dropping it
+        # saves allocations and memory during long replays.
+        self.replay_meta = config.get("replay_meta", True)
 
     def commit(self, aggregate_root: AggregateRoot, **kwargs) -> None:
         """
@@ -74,18 +99,85 @@ class Repository:
         if events:
             assert id, "The id must be set on the aggregate root"
             logger.info("Committing staged events to repository")
-            self.snapshot.save(aggregate_root)
+            # a snapshot without an offset (e.g. saved by an older version or
+            # by a backend without offsets) isn't completed on load, so it
+            # must be replaced whenever events are committed.
+            should_snapshot = self._evaluate_snapshot_policy(aggregate_root, events)
+            if aggregate_root._offset is None:
+                should_snapshot = True
+            # the offsets are only needed by a persisted snapshot, don't wait
+            # for them otherwise.
+            wait_for_offsets = self.snapshot.enabled and should_snapshot
             try:
-                self.backend.commit(id=id, events=events, **kwargs)
+                offsets = self.backend.commit(
+                    id=id, events=events, wait_for_offsets=wait_for_offsets, **kwargs
+                )
             except KafkaException as e:
-                logger.info("Kafka commit failed, rolling back snapshot!")
+                logger.info("Kafka commit failed, deleting snapshot!")
                 statsd.increment(  # type: ignore
                     "eventsourcing_helpers.snapshot.cache.delete", tags=[f"id={id}"]
                 )
                 self.snapshot.delete(aggregate_root)
                 raise e
 
+            statsd.increment(  # type: ignore
+                "eventsourcing_helpers.repository.events.committed",
+                value=len(events),
+                tags=self._get_tags(),
+            )
+            if offsets:
+                aggregate_root._offset = max(offsets, default=None)
+            elif should_snapshot:
+                # without offsets the snapshot can't be completed on load, so
+                # it must not claim to include any events.
+                aggregate_root._offset = None
             aggregate_root._clear_staged_events()
+            if should_snapshot:
+                self._save_snapshot(aggregate_root)
+            else:
+                statsd.increment(  # type: ignore
+                    "eventsourcing_helpers.snapshot.skipped", tags=self._get_tags()
+                )
+
+    def _get_tags(self) -> list:
+        return [f"aggregate:{self.aggregate_class}"] if self.aggregate_class else []
+
+    def _evaluate_snapshot_policy(self, aggregate_root: AggregateRoot, events: list) -> bool:
+        """
+        Update the snapshot stats with the events to commit and check if a
+        snapshot should be saved.
+        """
+        stats = get_snapshot_stats(aggregate_root)
+        stats["events"] += len(events)
+        self.snapshot_policy.on_commit(aggregate_root, events)
+        should_snapshot = self.snapshot_policy.should_snapshot(aggregate_root)
+        stats["committed_at"] = time.time()
+        return should_snapshot
+
+    def _save_snapshot(self, aggregate_root: AggregateRoot) -> None:
+        """
+        Save a snapshot of a committed aggregate root.
+
+        The events are already committed, so a failure is only logged. The
+        stored snapshot is deleted instead, since it might not have an offset
+        to complete it with the committed events on load.
+        """
+        stats = reset_snapshot_stats(aggregate_root)
+        try:
+            self.snapshot.save(aggregate_root)
+        except Exception:
+            # the events since the last saved snapshot still count
+            aggregate_root._snapshot_stats = stats
+            logger.warning("Failed to save snapshot", id=aggregate_root.id, exc_info=True)
+            statsd.increment("eventsourcing_helpers.snapshot.save.error")  # type: ignore
+            try:
+                self.snapshot.delete(aggregate_root)
+            except Exception:
+                logger.error("Failed to delete snapshot", id=aggregate_root.id, exc_info=True)
+        else:
+            statsd.increment(  # type: ignore
+                "eventsourcing_helpers.snapshot.save", tags=self._get_tags()
+            )
 
     def load(self, id: str, max_offset: int = None) -> AggregateRoot:
         """
@@ -109,19 +201,111 @@ class Repository:
         else:
             statsd.increment("eventsourcing_helpers.snapshot.cache.hits")  # type: ignore
             logger.debug("Aggregate was loaded from snapshot storage")
+            if aggregate_root._offset is not None:
+                self._replay_tail(aggregate_root, max_offset)
 
         return aggregate_root
 
+    def load_many(self, ids: Iterable[str], max_workers: int = 8) -> Dict[str, AggregateRoot]:
+        """
+        Load multiple aggregate roots.
+
+        The snapshots are loaded with a single call to the snapshot storage,
+        then the missing aggregate roots and the events committed after the
+        snapshots are replayed from the event storage concurrently.
+
+        Backends that can only replay one aggregate root at a time (like
+        Kafka) serialize the replays, the snapshot storage round trips are
+        still saved.
+
+        Args:
+            ids: IDs of the aggregate roots.
+            max_workers: Max number of concurrent replays.
+
+        Returns:
+            dict: Aggregate roots with the latest state by id.
+        """
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return {}
+
+        aggregate_roots = self.snapshot.load_many(ids, self.aggregate_root_cls())
+        misses = [id for id in ids if id not in aggregate_roots]
+        tails = [a for a in aggregate_roots.values() if a._offset is not None]
+        statsd.increment(  # type: ignore
+            "eventsourcing_helpers.snapshot.cache.hits", value=len(aggregate_roots)
+        )
+        statsd.increment(  # type: ignore
+            "eventsourcing_helpers.snapshot.cache.misses", value=len(misses)
+        )
+        logger.debug(
+            "Loading aggregate roots",
+            num_snapshots=len(aggregate_roots),
+            num_tails=len(tails),
+            num_replays=len(misses),
+        )
+
+        if misses or tails:
+            workers = min(max_workers, len(misses) + len(tails))
+            with ThreadPoolExecutor(workers, thread_name_prefix="eventsourcing-load") as executor:
+                replays = {id: executor.submit(self._load_from_event_storage, id) for id in misses}
+                tail_replays = [executor.submit(self._replay_tail, a) for a in tails]
+                for tail_replay in tail_replays:
+                    tail_replay.result()
+                for id, replay in replays.items():
+                    aggregate_roots[id] = replay.result()
+
+        return {id: aggregate_roots[id] for id in ids}
+
     def _load_from_snapshot_storage(self, id: str) -> AggregateRoot:
         aggregate_root = self.snapshot.load(id, self.aggregate_root_cls())
 
         return aggregate_root
 
-    def _load_from_event_storage(self, id: str, max_offset: int) -> AggregateRoot:
+    def _deserialize_events(
+        self, aggregate_root: AggregateRoot, events: Iterable[Any]
+    ) -> Iterator[Any]:
+        """
+        Deserialize events to apply and keep track of the last offset and the
+        number of events replayed since the snapshot.
+        """
+        stats = get_snapshot_stats(aggregate_root)
+        for event in events:
+            stats["events"] += 1
+            offset = get_event_offset(event)
+            if offset is not None:
+                aggregate_root._offset = offset
+            yield self.message_deserializer(event, is_new=False, include_meta=self.replay_meta)
+
+    def _load_from_event_storage(
+        self, id: str, max_offset: Union[int, None] = None
+    ) -> AggregateRoot:
         aggregate_root = self.aggregate_root_cls()
         events = self.backend.get_events(id, max_offset=max_offset)
-        events = (self.message_deserializer(event, is_new=False) for event in events)
+        self._replay(aggregate_root, events)
+        return aggregate_root
+
+    def _replay(self, aggregate_root: AggregateRoot, events: Iterable[Any]) -> None:
+        """
+        Apply events and record how long it took in the snapshot stats.
+        """
+        start = time.perf_counter()
         aggregate_root._apply_events(
-            events, ignore_missing_apply_methods=self.ignore_missing_apply_methods
+            self._deserialize_events(aggregate_root, events),
+            ignore_missing_apply_methods=self.ignore_missing_apply_methods,
         )
-        return aggregate_root
+        get_snapshot_stats(aggregate_root)["replay_seconds"] = time.perf_counter() - start
+
+    def _replay_tail(self, aggregate_root: AggregateRoot, max_offset: int = None) -> None:
+        """
+        Apply the events committed after a snapshot was saved.
+        """
+        snapshot_offset = aggregate_root._offset
+        assert snapshot_offset is not None, "The snapshot has no offset to replay from"
+        events = self.backend.get_events(
+            aggregate_root.id, max_offset=max_offset, min_offset=snapshot_offset + 1
+        )
+        self._replay(aggregate_root, events)
+        if aggregate_root._offset != snapshot_offset:
+            logger.debug("Replayed events after snapshot", offset=aggregate_root._offset)
+            statsd.increment("eventsourcing_helpers.snapshot.tail.replayed")  # type: ignore
@@ -1,4 +1,25 @@
-from typing import Any
+from typing import Any, List, Union
+
+from eventsourcing_helpers.message.meta import MessageMeta
+
+
+class StoredEvent:
+    """
+    Event loaded from a repository backend that doesn't produce Kafka
+    messages.
+
+    Has the same `value` and `_meta` attributes as a consumed Kafka message,
+    so it can be deserialized with `from_message_to_dto`.
+    """
+
+    __slots__ = ("value", "_meta")
+
+    def __init__(self, value: dict, meta: MessageMeta) -> None:
+        self.value = value
+        self._meta = meta
+
+    def __repr__(self) -> str:
+        return f"StoredEvent(value={self.value}, offset={self._meta.offset})"
 
 
 class RepositoryBackend:
@@ -6,7 +27,11 @@ class RepositoryBackend:
     Repository interface.
     """
 
-    def commit(self, id: str, events: list, **kwargs) -> None:
+    def commit(self, id: str, events: list, **kwargs) -> Union[List[int], None]:
+        """
+        Commit events, returns the offsets of the committed events if the
+        backend knows them.
+        """
         raise NotImplementedError()
 
     def load(self, id: str, **kwargs) -> Any:
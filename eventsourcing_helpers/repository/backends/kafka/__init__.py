@@ -1,11 +1,15 @@
-from typing import Callable, Iterator
+import threading
+import time
+from typing import Callable, List, Union
+
+from confluent_kafka import KafkaError, KafkaException, TopicPartition
 
 from eventsourcing_helpers.repository.backends import RepositoryBackend
 from eventsourcing_helpers.repository.backends.kafka.config import (
     get_loader_config,
     get_producer_config,
 )
-from eventsourcing_helpers.serializers import to_message_from_dto
+from eventsourcing_helpers.serializers import add_message_class_header, to_message_from_dto
 
 from confluent_kafka_helpers.loader import AvroMessageLoader, MessageGenerator
 from confluent_kafka_helpers.message import Message
@@ -13,6 +17,13 @@ from confluent_kafka_helpers.producer import AvroProducer
 
 
 class KafkaAvroBackend(RepositoryBackend):
+    """
+    Repository backend storing the events in Kafka.
+
+    The `delivery_timeout` config is the number of seconds to wait for the
+    delivery reports when the offsets are requested (default 30).
+    """
+
     def __init__(
         self,
         config: dict,
@@ -30,19 +41,69 @@ class KafkaAvroBackend(RepositoryBackend):
             self.producer = producer(producer_config, value_serializer=value_serializer)
         if loader_config:
             self.loader = loader(loader_config)
+        # the loader consumer can only load one aggregate root at a time
+        self._load_lock = threading.Lock()
+        self.delivery_timeout = config.get("delivery_timeout", 30.0)
 
-    def commit(self, id: str, events: list, **kwargs) -> None:
+    def commit(
+        self, id: str, events: list, wait_for_offsets: bool = False, **kwargs
+    ) -> Union[List[int], None]:
         """
         Commit staged events.
 
+        The events are delivered in the background. With `wait_for_offsets`
+        we wait for the delivery reports of the events to get their offsets,
+        e.g. before a snapshot including them is saved.
+
         Args:
             id: ID of the aggregate root to be used as key in the message.
             events: List of staged events to be committed.
+            wait_for_offsets: Wait until the events are delivered.
+
+        Raises:
+            KafkaException: If any event could not be delivered or the
+                delivery reports timed out, only when waiting for the offsets.
+
+        Returns:
+            list: Offsets of the committed events, None if not waited for.
         """
         assert self.producer is not None, "Producer is not configured"
 
+        offsets: List[int] = []
+        errors: list = []
+
+        def on_delivery(error, message):
+            if error is not None:
+                errors.append(error)
+            else:
+                offsets.append(message.offset())
+
+        headers = kwargs.pop("headers", None)
+        if wait_for_offsets:
+            kwargs["on_delivery"] = on_delivery
         for event in events:
-            self.producer.produce(key=id, value=event, **kwargs)
+            # the class header lets consumers skip unhandled events without
+            # decoding the value.
+            event_headers = add_message_class_header(event, headers)
+            event_kwargs = kwargs if event_headers is None else {**kwargs, "headers": event_headers}
+            self.producer.produce(key=id, value=event, **event_kwargs)
+
+        if not wait_for_offsets:
+            return None
+
+        # only wait for our own events instead of flushing everything queued
+        # in the producer.
+        deadline = time.monotonic() + self.delivery_timeout
+        while len(offsets) + len(errors) < len(events):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise KafkaException(
+                    KafkaError(KafkaError._TIMED_OUT, "Timed out waiting for delivery reports")
+                )
+            self.producer.poll(min(remaining, 1.0))
+        if errors:
+            raise KafkaException(errors[0])
+        return offsets
 
     def load(self, id: str, **kwargs) -> MessageGenerator:
         """
@@ -57,19 +118,50 @@ class KafkaAvroBackend(RepositoryBackend):
         assert self.loader is not None, "Loader is not configured"
         return self.loader.load(id, **kwargs)
 
-    def get_events(self, id: str, max_offset: int = None) -> Iterator[Message]:  # type: ignore
+    def _load_from(self, id: str, offset: int) -> MessageGenerator:
         """
-        Get all aggregate events from the repository one at a time.
+        Returns a repository message loader starting at the given offset.
+
+        Args:
+            id: ID of the aggregate root.
+            offset: Offset of the first event to load.
+
+        Returns:
+            MessageGenerator: Repository message loader.
+        """
+        loader = self.load(id)
+        # the loader assigns the partition of the aggregate root from the
+        # beginning, assign it again at the offset.
+        consumer = loader.consumer
+        consumer.assign(
+            [TopicPartition(p.topic, p.partition, offset) for p in consumer.assignment()]
+        )
+        return loader
+
+    def get_events(  # type: ignore
+        self, id: str, max_offset: int = None, min_offset: int = None
+    ) -> List[Message]:
+        """
+        Get all aggregate events from the repository.
+
+        The events are read into a list, so the loader is released before
+        they are applied. The loader keeps all loaded messages anyway to find
+        duplicates.
 
         Args:
             id: ID of the aggregate root.
             max_offset: Stop loading events at this offset.
+            min_offset: Start loading events at this offset.
 
-        Yields:
-            Message: The next available event.
+        Returns:
+            list: The events in committed order.
         """
-        with self.load(id) as events:  # type:ignore
-            for event in events:
-                if max_offset is not None and event._meta.offset > max_offset:
-                    break
-                yield event
+        events = []
+        with self._load_lock:
+            loader = self._load_from(id, min_offset) if min_offset else self.load(id)
+            with loader as messages:  # type:ignore
+                for message in messages:
+                    if max_offset is not None and message._meta.offset > max_offset:
+                        break
+                    events.append(message)
+        return events
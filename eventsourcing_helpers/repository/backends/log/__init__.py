@@ -0,0 +1,541 @@
+"""
+Append-only log repository backend.
+
+The events are appended to segment files in a directory. Every segment has
+an index file next to it with the offset, the position and the aggregate id
+of each record, so opening the store only reads the index files and loading
+an aggregate root only reads its own records.
+
+Segment record layout (little endian):
+    payload length (4) | crc32 (4) | offset (8) | key length (2) | key | payload
+
+The crc32 covers everything after it. Index entry layout:
+    offset (8) | position (4) | key length (2) | key
+
+Records are read through `mmap` and only decoded when the event iterator
+advances to them.
+
+A segment is sealed when it has grown past `segment_bytes` and a new one is
+started. Sealed segments are never appended to again, compaction rewrites
+them with the records of each aggregate root next to each other (and merges
+small segments), which keeps the number of files down and turns loading an
+aggregate root into a sequential read. The offsets of the events don't change.
+
+If the process crashes in the middle of a commit, the segments are recovered
+on open: index entries pointing to missing or corrupt records are dropped,
+records that are missing from the index are added back and a torn record at
+the end of a segment is truncated. An interrupted compaction is either
+discarded or finished, depending on whether the compacted files were
+completely written.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from bisect import bisect_left
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+
+import jsonpickle
+import structlog
+
+from eventsourcing_helpers.message.meta import MessageMeta
+from eventsourcing_helpers.metrics import base_metric, statsd
+from eventsourcing_helpers.repository.backends import RepositoryBackend, StoredEvent
+from eventsourcing_helpers.serializers import add_message_class_header, to_message_from_dto
+
+logger = structlog.get_logger(__name__)
+
+DEFAULT_CONFIG = {
+    "segment_bytes": 64 * 1024 * 1024,
+    "compaction_bytes": 256 * 1024 * 1024,
+    "fsync": False,
+    "compaction_interval": None,
+}
+
+RECORD_HEADER = struct.Struct("<IIQH")
+INDEX_ENTRY = struct.Struct("<QIH")
+# the crc covers the offset, the key length, the key and the payload
+CRC_START = 8
+
+# offset, key, position
+IndexEntry = Tuple[int, str, int]
+
+
+class CorruptRecord(Exception):
+    pass
+
+
+def encode_record(offset: int, key: bytes, payload: bytes) -> bytes:
+    body = struct.pack("<QH", offset, len(key)) + key + payload
+    return struct.pack("<II", len(payload), zlib.crc32(body)) + body
+
+
+def encode_index_entry(offset: int, key: bytes, position: int) -> bytes:
+    return INDEX_ENTRY.pack(offset, position, len(key)) + key
+
+
+class Segment:
+    """
+    A segment log file and its index file.
+    """
+
+    def __init__(self, directory: str, base_offset: int) -> None:
+        self.base_offset = base_offset
+        name = os.path.join(directory, f"{base_offset:020d}")
+        self.log_path, self.index_path = f"{name}.log", f"{name}.index"
+        self.size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        self._map: Union[mmap.mmap, None] = None
+        self._map_lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"Segment(base_offset={self.base_offset}, size={self.size})"
+
+    def get_map(self, end: int) -> mmap.mmap:
+        """
+        Get a read-only map of the log file covering at least `end` bytes.
+        """
+        map = self._map
+        if map is None or len(map) < end:
+            with self._map_lock:
+                map = self._map
+                if map is None or len(map) < end:
+                    # readers may still hold views of the old map, it's
+                    # closed when they are gone.
+                    with open(self.log_path, "rb") as f:
+                        map = self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return map
+
+    def read(self, position: int) -> Tuple[int, str, memoryview, int]:
+        """
+        Read the record at a position without copying the payload.
+
+        Returns:
+            tuple: Offset, key, payload and end position of the record.
+        """
+        map = self.get_map(position + RECORD_HEADER.size)
+        length, crc, offset, key_length = RECORD_HEADER.unpack_from(map, position)
+        start = position + RECORD_HEADER.size
+        end = start + key_length + length
+        if end > len(map):
+            map = self.get_map(end)
+        view = memoryview(map)
+        key = str(view[start : start + key_length], "utf-8")  # noqa: E203
+        return offset, key, view[start + key_length : end], end  # noqa: E203
+
+    def read_checked(self, position: int) -> Tuple[int, str, int]:
+        """
+        Read and verify the record at a position.
+
+        Raises:
+            CorruptRecord: If the record is torn or corrupt.
+
+        Returns:
+            tuple: Offset, key and end position of the record.
+        """
+        if position + RECORD_HEADER.size > self.size:
+            raise CorruptRecord(position)
+        map = self.get_map(self.size)
+        length, crc, offset, key_length = RECORD_HEADER.unpack_from(map, position)
+        end = position + RECORD_HEADER.size + key_length + length
+        if end > self.size or zlib.crc32(map[position + CRC_START : end]) != crc:  # noqa: E203
+            raise CorruptRecord(position)
+        start = position + RECORD_HEADER.size
+        key = map[start : start + key_length]  # noqa: E203
+        return offset, key.decode(), end
+
+    def read_index(self) -> List[IndexEntry]:
+        entries: List[IndexEntry] = []
+        if not os.path.exists(self.index_path):
+            return entries
+
+        with open(self.index_path, "rb") as f:
+            data = f.read()
+        position = 0
+        while position + INDEX_ENTRY.size <= len(data):
+            offset, record_position, key_length = INDEX_ENTRY.unpack_from(data, position)
+            position += INDEX_ENTRY.size
+            if position + key_length > len(data):
+                break
+            key = data[position : position + key_length].decode()  # noqa: E203
+            position += key_length
+            entries.append((offset, key, record_position))
+        return entries
+
+    def write_index(self, entries: List[IndexEntry]) -> None:
+        with open(self.index_path, "wb") as f:
+            f.write(b"".join(encode_index_entry(o, k.encode(), p) for o, k, p in entries))
+
+    def recover(self) -> List[IndexEntry]:
+        """
+        Bring the log and index files in line after a crash.
+
+        Returns:
+            list: Index entries of all valid records.
+        """
+        entries = sorted(self.read_index(), key=lambda entry: entry[2])
+        num_indexed = len(entries)
+        end = 0
+        while entries:
+            offset, key, position = entries[-1]
+            try:
+                record_offset, record_key, end = self.read_checked(position)
+            except (CorruptRecord, struct.error):
+                record_offset, record_key = None, None
+            if (record_offset, record_key) == (offset, key):
+                break
+            entries.pop()
+            end = 0
+
+        recovered = False
+        while end < self.size:
+            try:
+                offset, key, record_end = self.read_checked(end)
+            except (CorruptRecord, struct.error):
+                break
+            entries.append((offset, key, end))
+            end = record_end
+            recovered = True
+
+        if end < self.size:
+            logger.warning("Truncating torn segment", segment=self.log_path, size=end)
+            self.close()
+            with open(self.log_path, "r+b") as f:
+                f.truncate(end)
+            self.size = end
+            recovered = True
+        if recovered or len(entries) != num_indexed:
+            logger.warning("Recovered segment index", segment=self.log_path)
+            self.write_index(entries)
+        return entries
+
+    def close(self) -> None:
+        self._map = None
+
+    def remove(self) -> None:
+        for path in (self.log_path, self.index_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class LogBackend(RepositoryBackend):
+    """
+    Repository backend appending the events to segmented log files.
+
+    Meant for high throughput single host deployments, the directory must
+    only be used by one process at a time.
+
+    Config:
+        path: Directory of the log.
+        segment_bytes: Size after which a new segment is started.
+        compaction_bytes: Max size of a segment merged by compaction.
+        fsync: Call fsync after every commit, otherwise the events are only
+            handed to the OS and the last commits can be lost on a power
+            failure.
+        compaction_interval (optional): Seconds between background
+            compactions of the sealed segments.
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        value_serializer: Callable = to_message_from_dto,
+        encoder: Callable = jsonpickle.encode,
+        decoder: Callable = jsonpickle.decode,
+    ) -> None:
+        assert "path" in config, "You must specify path!"
+        config = {**DEFAULT_CONFIG, **config}
+        self.path = config["path"]
+        self.segment_bytes = config["segment_bytes"]
+        self.compaction_bytes = config["compaction_bytes"]
+        # positions in the index are 32 bits
+        assert max(self.segment_bytes, self.compaction_bytes) < 2**31, "Segments are too large"
+        self.fsync = config["fsync"]
+        self.value_serializer = value_serializer
+        self.encoder = encoder
+        self.decoder = decoder
+
+        self._lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._segments: List[Segment] = []
+        # offsets and (segment, position) of the records per aggregate root,
+        # ordered by offset.
+        self._offsets: Dict[str, List[int]] = {}
+        self._positions: Dict[str, List[Tuple[Segment, int]]] = {}
+        self._next_offset = 0
+        self._open()
+
+        self._closed = threading.Event()
+        self._compactor = None
+        if config["compaction_interval"] is not None:
+            self._compactor = threading.Thread(
+                target=self._compact_periodically,
+                args=(config["compaction_interval"],),
+                name="eventsourcing-log-compactor",
+                daemon=True,
+            )
+            self._compactor.start()
+
+    def _open(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        for name in os.listdir(self.path):
+            if name.endswith(".compaction"):
+                logger.warning("Finishing interrupted compaction", marker=name)
+                self._finish_compaction(os.path.join(self.path, name))
+        names = os.listdir(self.path)
+        for name in names:
+            # an unfinished compaction without marker is discarded
+            if name.endswith(".compacting"):
+                os.remove(os.path.join(self.path, name))
+        base_offsets = sorted(int(name[:-4]) for name in names if name.endswith(".log"))
+
+        entries = []
+        for base_offset in base_offsets:
+            segment = Segment(self.path, base_offset)
+            self._segments.append(segment)
+            for offset, key, position in segment.recover():
+                entries.append((offset, key, segment, position))
+                self._next_offset = max(self._next_offset, offset + 1)
+
+        for offset, key, segment, position in sorted(entries, key=lambda entry: entry[0]):
+            self._offsets.setdefault(key, []).append(offset)
+            self._positions.setdefault(key, []).append((segment, position))
+
+        if not self._segments:
+            self._segments.append(Segment(self.path, 0))
+        self._open_active()
+        logger.info(
+            "Opened event log",
+            path=self.path,
+            num_segments=len(self._segments),
+            num_aggregates=len(self._offsets),
+        )
+
+    def _open_active(self) -> None:
+        active = self._segments[-1]
+        self._log_file = open(active.log_path, "ab")
+        self._index_file = open(active.index_path, "ab")
+
+    def _sync(self) -> None:
+        self._log_file.flush()
+        self._index_file.flush()
+        if self.fsync:
+            os.fsync(self._log_file.fileno())
+            os.fsync(self._index_file.fileno())
+
+    def _roll(self) -> None:
+        """
+        Seal the active segment and start a new one.
+        """
+        for f in (self._log_file, self._index_file):
+            f.flush()
+            os.fsync(f.fileno())
+        self._log_file.close()
+        self._index_file.close()
+        self._segments.append(Segment(self.path, self._next_offset))
+        self._open_active()
+        statsd.increment(f"{base_metric}.repository.log.segment.rolled")  # type: ignore
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._lock:
+            if not self._log_file.closed:
+                self._sync()
+                self._log_file.close()
+                self._index_file.close()
+
+    def commit(self, id: str, events: list, **kwargs) -> List[int]:
+        """
+        Append staged events to the active segment.
+
+        Args:
+            id: ID of the aggregate root.
+            events: List of staged events to be committed.
+
+        Returns:
+            list: Offsets of the committed events.
+        """
+        headers = kwargs.get("headers")
+        timestamp = int(time.time() * 1000)
+        key = id.encode()
+        payloads = [
+            self.encoder(
+                [self.value_serializer(event), add_message_class_header(event, headers), timestamp]
+            ).encode()
+            for event in events
+        ]
+
+        with self._lock:
+            active = self._segments[-1]
+            if active.size >= self.segment_bytes:
+                self._roll()
+                active = self._segments[-1]
+
+            offsets, positions, records, index = [], [], [], []
+            position = active.size
+            for offset, payload in enumerate(payloads, start=self._next_offset):
+                record = encode_record(offset, key, payload)
+                records.append(record)
+                index.append(encode_index_entry(offset, key, position))
+                offsets.append(offset)
+                positions.append((active, position))
+                position += len(record)
+
+            self._log_file.write(b"".join(records))
+            self._index_file.write(b"".join(index))
+            self._sync()
+            active.size = position
+            self._next_offset += len(payloads)
+            self._offsets.setdefault(id, []).extend(offsets)
+            self._positions.setdefault(id, []).extend(positions)
+
+        return offsets
+
+    def load(self, id: str, **kwargs) -> Iterator[StoredEvent]:
+        return self.get_events(id, **kwargs)
+
+    def get_events(  # type: ignore
+        self, id: str, max_offset: int = None, min_offset: int = None
+    ) -> Iterator[StoredEvent]:
+        """
+        Get all aggregate events from the repository one at a time.
+
+        Args:
+            id: ID of the aggregate root.
+            max_offset: Stop loading events at this offset.
+            min_offset: Start loading events at this offset.
+
+        Yields:
+            StoredEvent: The next available event.
+        """
+        with self._lock:
+            offsets = self._offsets.get(id, [])
+            start = bisect_left(offsets, min_offset) if min_offset else 0
+            positions = self._positions.get(id, [])[start:]
+
+        for segment, position in positions:
+            offset, _, payload, _ = segment.read(position)
+            if max_offset is not None and offset > max_offset:
+                break
+            value, headers, timestamp = self.decoder(str(payload, "utf-8"))
+            meta = MessageMeta(offset=offset, timestamp=timestamp, headers=headers or {})
+            yield StoredEvent(value, meta)
+
+    def compact(self) -> None:
+        """
+        Rewrite the sealed segments with the records of each aggregate root
+        next to each other, merging segments up to `compaction_bytes`.
+        """
+        with self._compaction_lock:
+            with self._lock:
+                sealed = self._segments[:-1]
+            for group in self._group_segments(sealed):
+                if len(group) > 1 or not self._is_clustered(group[0]):
+                    self._compact_group(group)
+
+    def _group_segments(self, segments: List[Segment]) -> List[List[Segment]]:
+        groups: List[List[Segment]] = []
+        size = 0
+        for segment in segments:
+            if groups and size + segment.size <= self.compaction_bytes:
+                groups[-1].append(segment)
+                size += segment.size
+            else:
+                groups.append([segment])
+                size = segment.size
+        return groups
+
+    def _is_clustered(self, segment: Segment) -> bool:
+        """
+        Check if the records of each aggregate root are next to each other
+        in offset order.
+        """
+        seen = set()
+        previous_key, previous_offset = None, -1
+        for offset, key, _ in sorted(segment.read_index(), key=lambda entry: entry[2]):
+            if key != previous_key:
+                if key in seen:
+                    return False
+                seen.add(key)
+            elif offset < previous_offset:
+                return False
+            previous_key, previous_offset = key, offset
+        return True
+
+    def _compact_group(self, group: List[Segment]) -> None:
+        entries = sorted(
+            (key, offset, segment, position)
+            for segment in group
+            for offset, key, position in segment.read_index()
+        )
+        base_offset = group[0].base_offset
+        tmp_log, tmp_index = f"{group[0].log_path}.compacting", f"{group[0].index_path}.compacting"
+
+        moved: Dict[int, int] = {}
+        records, index = [], []
+        position = 0
+        for key, offset, segment, old_position in entries:
+            _, _, payload, _ = segment.read(old_position)
+            record = encode_record(offset, key.encode(), bytes(payload))
+            records.append(record)
+            index.append(encode_index_entry(offset, key.encode(), position))
+            moved[offset] = position
+            position += len(record)
+
+        for path, data in ((tmp_log, records), (tmp_index, index)):
+            with open(path, "wb") as f:
+                f.write(b"".join(data))
+                f.flush()
+                os.fsync(f.fileno())
+
+        with self._lock:
+            # readers may still use the replaced segments, their maps keep
+            # the replaced files readable.
+            for segment in group:
+                segment.get_map(segment.size)
+            # once the marker is written the compaction is finished on open
+            # if the process crashes before it's done.
+            marker = os.path.join(self.path, f"{base_offset:020d}.compaction")
+            with open(marker, "w") as f:
+                f.write(",".join(str(segment.base_offset) for segment in group))
+                f.flush()
+                os.fsync(f.fileno())
+            self._finish_compaction(marker)
+            compacted = Segment(self.path, base_offset)
+
+            replaced = set(group)
+            for key in {entry[0] for entry in entries}:
+                self._positions[key] = [
+                    (compacted, moved[offset]) if segment in replaced else (segment, position)
+                    for offset, (segment, position) in zip(self._offsets[key], self._positions[key])
+                ]
+            start = self._segments.index(group[0])
+            self._segments[start : start + len(group)] = [compacted]  # noqa: E203
+
+        statsd.increment(f"{base_metric}.repository.log.compacted")  # type: ignore
+        logger.info("Compacted segments", num_segments=len(group), size=position)
+
+    def _finish_compaction(self, marker: str) -> None:
+        """
+        Replace the first segment of a compacted group with the compacted
+        files and remove the others.
+        """
+        with open(marker) as f:
+            first, *others = [Segment(self.path, int(b)) for b in f.read().split(",")]
+        for path in (first.index_path, first.log_path):
+            if os.path.exists(f"{path}.compacting"):
+                os.replace(f"{path}.compacting", path)
+        for segment in others:
+            segment.remove()
+        os.remove(marker)
+
+    def _compact_periodically(self, interval: float) -> None:
+        while not self._closed.wait(interval):
+            try:
+                self.compact()
+            except Exception:
+                logger.exception("Failed to compact event log")
@@ -0,0 +1,85 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from eventsourcing_helpers.message.meta import MessageMeta
+from eventsourcing_helpers.repository.backends import RepositoryBackend, StoredEvent
+from eventsourcing_helpers.serializers import add_message_class_header, to_message_from_dto
+
+
+class InMemoryBackend(RepositoryBackend):
+    """
+    Repository backend keeping the events in memory.
+
+    The events are serialized like they would be for Kafka but never
+    encoded, so benchmarks and tests using it measure the library and the
+    domain code alone. Offsets are counted across all aggregate roots, like
+    the offsets of a single Kafka partition.
+    """
+
+    def __init__(
+        self, config: dict = None, value_serializer: Callable = to_message_from_dto
+    ) -> None:
+        self.value_serializer = value_serializer
+        self._events: Dict[str, List[Tuple[int, StoredEvent]]] = {}
+        self._next_offset = 0
+        self._lock = threading.Lock()
+
+    def commit(self, id: str, events: list, **kwargs) -> List[int]:
+        """
+        Commit staged events.
+
+        Args:
+            id: ID of the aggregate root.
+            events: List of staged events to be committed.
+
+        Returns:
+            list: Offsets of the committed events.
+        """
+        headers = kwargs.get("headers")
+        timestamp = int(time.time() * 1000)
+        values = [(self.value_serializer(e), add_message_class_header(e, headers)) for e in events]
+
+        with self._lock:
+            stored = self._events.setdefault(id, [])
+            offsets = list(range(self._next_offset, self._next_offset + len(values)))
+            for offset, (value, event_headers) in zip(offsets, values):
+                meta = MessageMeta(offset=offset, timestamp=timestamp, headers=event_headers or {})
+                stored.append((offset, StoredEvent(value, meta)))
+            self._next_offset += len(values)
+
+        return offsets
+
+    def load(self, id: str, **kwargs) -> Iterator[StoredEvent]:
+        return self.get_events(id, **kwargs)
+
+    def get_events(  # type: ignore
+        self, id: str, max_offset: int = None, min_offset: int = None
+    ) -> Iterator[StoredEvent]:
+        """
+        Get all aggregate events from the repository one at a time.
+
+        Args:
+            id: ID of the aggregate root.
+            max_offset: Stop loading events at this offset.
+            min_offset: Start loading events at this offset.
+
+        Yields:
+            StoredEvent: The next available event.
+        """
+        with self._lock:
+            stored = self._events.get(id, [])
+            start = bisect_left(stored, (min_offset,)) if min_offset else 0
+            # events are only appended, a copy of the list is enough
+            stored = stored[start:]
+
+        for offset, event in stored:
+            if max_offset is not None and offset > max_offset:
+                break
+            yield event
+
+    def clear(self) -> None:
+        with self._lock:
+            self._events.clear()
+            self._next_offset = 0
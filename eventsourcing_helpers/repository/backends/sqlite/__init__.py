@@ -0,0 +1,165 @@
+import sqlite3
+import threading
+import time
+from typing import Callable, Iterator, List
+
+import jsonpickle
+import structlog
+
+from eventsourcing_helpers.message.meta import MessageMeta
+from eventsourcing_helpers.repository.backends import RepositoryBackend, StoredEvent
+from eventsourcing_helpers.serializers import add_message_class_header, to_message_from_dto
+
+logger = structlog.get_logger(__name__)
+
+DEFAULT_CONFIG = {
+    "timeout": 5.0,
+    "synchronous": "NORMAL",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    offset INTEGER PRIMARY KEY AUTOINCREMENT,
+    aggregate_id TEXT NOT NULL,
+    sequence INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    headers TEXT,
+    timestamp INTEGER NOT NULL,
+    UNIQUE (aggregate_id, sequence)
+)
+"""
+
+
+class SQLiteBackend(RepositoryBackend):
+    """
+    Repository backend storing the events in an embedded SQLite database.
+
+    The events are indexed by (aggregate id, sequence), so loading an
+    aggregate root is an index range scan instead of scanning a partition.
+    The offset of an event is its position in the whole store, it's used to
+    complete snapshots just like a Kafka offset.
+
+    Meant for single node deployments, tests and benchmarks. Every thread
+    gets its own connection, so the database must be a file (not
+    `:memory:`) to be shared between threads.
+
+    Config:
+        path: Path to the database file.
+        timeout: Seconds to wait for a lock held by another connection.
+        synchronous: SQLite `synchronous` pragma, `NORMAL` is safe in WAL
+            mode but the last commits can be lost on a power failure.
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        value_serializer: Callable = to_message_from_dto,
+        encoder: Callable = jsonpickle.encode,
+        decoder: Callable = jsonpickle.decode,
+    ) -> None:
+        assert "path" in config, "You must specify path!"
+        self.config = {**DEFAULT_CONFIG, **config}
+        self.value_serializer = value_serializer
+        self.encoder = encoder
+        self.decoder = decoder
+        self._local = threading.local()
+        with self.connection as connection:
+            connection.execute(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.config["path"], timeout=self.config["timeout"])
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(f"PRAGMA synchronous={self.config['synchronous']}")
+            self._local.connection = connection
+        return connection
+
+    def close(self) -> None:
+        """
+        Close the connection of the current thread.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def commit(self, id: str, events: list, **kwargs) -> List[int]:
+        """
+        Commit staged events in a single transaction.
+
+        Args:
+            id: ID of the aggregate root.
+            events: List of staged events to be committed.
+
+        Raises:
+            sqlite3.IntegrityError: If events were committed for the
+                aggregate root by someone else at the same time.
+
+        Returns:
+            list: Offsets of the committed events.
+        """
+        headers = kwargs.get("headers")
+        timestamp = int(time.time() * 1000)
+        connection = self.connection
+        offsets: List[int] = []
+        with connection:
+            # take the write lock before reading the sequence
+            connection.execute("BEGIN IMMEDIATE")
+            (sequence,) = connection.execute(
+                "SELECT COALESCE(MAX(sequence), 0) FROM events WHERE aggregate_id = ?", (id,)
+            ).fetchone()
+            for sequence, event in enumerate(events, start=sequence + 1):
+                event_headers = add_message_class_header(event, headers)
+                cursor = connection.execute(
+                    "INSERT INTO events (aggregate_id, sequence, value, headers, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        id,
+                        sequence,
+                        self.encoder(self.value_serializer(event)),
+                        self.encoder(event_headers) if event_headers else None,
+                        timestamp,
+                    ),
+                )
+                # always set after an INSERT into a rowid table
+                assert cursor.lastrowid is not None
+                offsets.append(cursor.lastrowid)
+
+        return offsets
+
+    def load(self, id: str, **kwargs) -> Iterator[StoredEvent]:
+        return self.get_events(id, **kwargs)
+
+    def get_events(  # type: ignore
+        self, id: str, max_offset: int = None, min_offset: int = None
+    ) -> Iterator[StoredEvent]:
+        """
+        Get all aggregate events from the repository one at a time.
+
+        Args:
+            id: ID of the aggregate root.
+            max_offset: Stop loading events at this offset.
+            min_offset: Start loading events at this offset.
+
+        Yields:
+            StoredEvent: The next available event.
+        """
+        query = "SELECT offset, value, headers, timestamp FROM events WHERE aggregate_id = ?"
+        params: list = [id]
+        if min_offset is not None:
+            query += " AND offset >= ?"
+            params.append(min_offset)
+        if max_offset is not None:
+            query += " AND offset <= ?"
+            params.append(max_offset)
+        query += " ORDER BY sequence"
+
+        for offset, value, headers, timestamp in self.connection.execute(query, params):
+            meta = MessageMeta(
+                offset=offset,
+                timestamp=timestamp,
+                headers=self.decoder(headers) if headers else {},
+            )
+            yield StoredEvent(self.decoder(value), meta)
@@ -0,0 +1,168 @@
+import threading
+from collections import OrderedDict
+from typing import Iterable, NamedTuple, Tuple, Union
+
+import structlog
+
+from eventsourcing_helpers.metrics import base_metric, statsd
+from eventsourcing_helpers.models import AggregateRoot
+from eventsourcing_helpers.utils import get_object_size
+
+logger = structlog.get_logger(__name__)
+
+
+class CacheEntry(NamedTuple):
+    aggregate_root: AggregateRoot
+    topic: Union[str, None]
+    partition: Union[int, None]
+    offset: int
+    size: int
+
+
+class AggregateCache:
+    """
+    In-process LRU cache of recently committed aggregate roots.
+
+    Commands for an aggregate root are always consumed from the same
+    partition, so as long as this consumer owns the partition nobody else can
+    have changed the aggregate root. An entry is therefore only valid for a
+    command from the same topic partition with a higher offset than the
+    command that was last applied. Anything else (redelivered commands,
+    another partition) is treated as a miss.
+
+    Entries are taken out of the cache when used and only put back after the
+    staged events have been committed, so a failing handler leaves nothing
+    behind. Entries for partitions that are revoked must be dropped with
+    `revoke`.
+
+    Args:
+        max_entries: Max number of cached aggregate roots.
+        max_bytes (optional): Max approximate size of all cached aggregate
+            roots. Measuring the size has a cost, so only set this if the
+            size of the aggregate roots varies a lot.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: Union[int, None] = None) -> None:
+        assert max_entries > 0, "max_entries must be positive"
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._entries
+
+    def pop(
+        self, id: str, topic: Union[str, None], partition: Union[int, None], offset: int
+    ) -> Union[AggregateRoot, None]:
+        """
+        Take an aggregate root out of the cache.
+
+        Args:
+            id: ID of the aggregate root.
+            topic: Topic of the command about to be handled.
+            partition: Partition of the command about to be handled.
+            offset: Offset of the command about to be handled.
+
+        Returns:
+            AggregateRoot: Cached aggregate root or None if missing or stale.
+        """
+        with self._lock:
+            entry = self._entries.pop(id, None)
+            if entry is not None:
+                self.size -= entry.size
+
+        if entry is None:
+            statsd.increment(f"{base_metric}.aggregate_cache.misses")  # type: ignore
+            return None
+
+        if (entry.topic, entry.partition) != (topic, partition) or offset <= entry.offset:
+            logger.info(
+                "Stale aggregate root in cache",
+                id=id,
+                cached_offset=entry.offset,
+                offset=offset,
+            )
+            statsd.increment(f"{base_metric}.aggregate_cache.stale")  # type: ignore
+            return None
+
+        statsd.increment(f"{base_metric}.aggregate_cache.hits")  # type: ignore
+        return entry.aggregate_root
+
+    def put(
+        self,
+        aggregate_root: AggregateRoot,
+        topic: Union[str, None],
+        partition: Union[int, None],
+        offset: int,
+    ) -> None:
+        """
+        Cache a committed aggregate root.
+
+        Args:
+            aggregate_root: Aggregate root without staged events.
+            topic: Topic of the last command applied.
+            partition: Partition of the last command applied.
+            offset: Offset of the last command applied.
+        """
+        id = aggregate_root.id
+        if id is None:
+            return
+
+        size = get_object_size(aggregate_root) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        entry = CacheEntry(aggregate_root, topic, partition, offset, size)
+        with self._lock:
+            previous = self._entries.pop(id, None)
+            if previous is not None:
+                self.size -= previous.size
+            self._entries[id] = entry
+            self.size += size
+            self._evict()
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self.size > self.max_bytes
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self.size -= entry.size
+            statsd.increment(f"{base_metric}.aggregate_cache.evictions")  # type: ignore
+
+    def discard(self, id: str) -> None:
+        """
+        Remove an aggregate root from the cache.
+        """
+        with self._lock:
+            entry = self._entries.pop(id, None)
+            if entry is not None:
+                self.size -= entry.size
+
+    def revoke(self, partitions: Iterable[Tuple[str, int]]) -> None:
+        """
+        Remove all aggregate roots loaded from commands in the given partitions.
+
+        Args:
+            partitions: Revoked (topic, partition) pairs.
+        """
+        partitions = set(partitions)
+        with self._lock:
+            revoked = [
+                id
+                for id, entry in self._entries.items()
+                if (entry.topic, entry.partition) in partitions
+            ]
+            for id in revoked:
+                self.size -= self._entries.pop(id).size
+
+        logger.info("Revoked aggregate roots from cache", num_revoked=len(revoked))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
@@ -0,0 +1,85 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+import structlog
+
+from eventsourcing_helpers.metrics import base_metric, statsd
+from eventsourcing_helpers.models import AggregateRoot
+
+logger = structlog.get_logger(__name__)
+
+
+class AggregatePrefetcher:
+    """
+    Loads aggregate roots ahead of time on a small I/O thread pool.
+
+    While the commands for one aggregate root are being handled, the
+    aggregate roots for the next commands are loaded from the snapshot
+    storage or the event storage, so handling a batch takes close to the time
+    spent in the handlers rather than the handlers plus the storage.
+
+    A prefetched aggregate root is only valid as long as nothing has been
+    committed for it since the load started, anything committed for an
+    aggregate root must be followed by `invalidate`.
+
+    Args:
+        load: Callable loading an aggregate root, called with the id and
+            the first message about to be applied on it.
+        workers: Number of loader threads.
+        lookahead: Number of aggregate roots to load ahead.
+    """
+
+    def __init__(self, load: Callable, workers: int = 4, lookahead: int = 8) -> None:
+        assert workers > 0, "You need at least one worker"
+        self.load = load
+        self.lookahead = lookahead
+        self._futures: Dict[str, Future] = {}
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="eventsourcing-prefetch")
+
+    def __len__(self) -> int:
+        return len(self._futures)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._futures
+
+    def prefetch(self, id: str, message: Any) -> None:
+        """
+        Start loading an aggregate root unless it's already being loaded.
+        """
+        if id not in self._futures:
+            self._futures[id] = self._executor.submit(self.load, id, message)
+
+    def get(self, id: str, message: Any) -> AggregateRoot:
+        """
+        Get a prefetched aggregate root, or load it now if it was not
+        prefetched or the prefetch failed.
+        """
+        future = self._futures.pop(id, None)
+        if future is not None:
+            try:
+                aggregate_root = future.result()
+            except Exception:
+                logger.warning("Failed to prefetch aggregate root", id=id, exc_info=True)
+            else:
+                statsd.increment(f"{base_metric}.aggregate_prefetch.hits")  # type: ignore
+                return aggregate_root
+
+        statsd.increment(f"{base_metric}.aggregate_prefetch.misses")  # type: ignore
+        return self.load(id, message)
+
+    def invalidate(self, id: str) -> None:
+        """
+        Drop a prefetched aggregate root that is out of date.
+        """
+        future = self._futures.pop(id, None)
+        if future is not None:
+            future.cancel()
+            statsd.increment(f"{base_metric}.aggregate_prefetch.invalidated")  # type: ignore
+
+    def clear(self) -> None:
+        for id in list(self._futures):
+            self._futures.pop(id).cancel()
+
+    def close(self) -> None:
+        self.clear()
+        self._executor.shutdown(wait=True)
@@ -1,17 +1,22 @@
 import hashlib
-from typing import Callable
+from typing import Callable, Dict, Iterable, Union
 
 import structlog
 
 from eventsourcing_helpers.models import AggregateRoot
+from eventsourcing_helpers.repository.snapshot.backends.null import NullSnapshotBackend
 from eventsourcing_helpers.repository.snapshot.config import get_snapshot_config
 from eventsourcing_helpers.repository.snapshot.serializers import (
     from_aggregate_root_to_snapshot,
     from_snapshot_to_aggregate_root,
 )
+from eventsourcing_helpers.repository.snapshot.writer import SnapshotWriter
 from eventsourcing_helpers.utils import import_backend
 
-BACKENDS = {"null": "eventsourcing_helpers.repository.snapshot.backends.null.NullSnapshotBackend"}
+BACKENDS = {
+    "null": "eventsourcing_helpers.repository.snapshot.backends.null.NullSnapshotBackend",
+    "memory": "eventsourcing_helpers.repository.snapshot.backends.memory.InMemorySnapshotBackend",
+}
 
 logger = structlog.get_logger(__name__)
 
@@ -30,6 +35,10 @@ class Snapshot:
     Interface to communicate with a snapshot backend.
 
     The interface provides methods for saving and loading a snapshot
+
+    With a `write_behind` config the snapshots are saved by a
+    `SnapshotWriter` on background threads, see it for the options.
+    Example: {"snapshot": {"write_behind": {"workers": 2, "max_pending": 1000}}}
     """
 
     DEFAULT_BACKEND = "null"
@@ -55,6 +64,20 @@ class Snapshot:
         self.deserializer = deserializer
         self.hash_function = hash_function
 
+        self.writer: Union[SnapshotWriter, None] = None
+        write_behind_config = config.get("write_behind")
+        if write_behind_config is not None:
+            self.writer = SnapshotWriter(
+                self._save, on_error=self._mark_stale, **write_behind_config
+            )
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Whether the snapshots are persisted, i.e. not the null backend.
+        """
+        return not isinstance(self.backend, NullSnapshotBackend)
+
     def save(self, aggregate_root: AggregateRoot) -> None:
         """
         Saves an aggregate to the snapshot storage
@@ -64,11 +87,27 @@ class Snapshot:
         Returns:
             None
         """
+        if self.writer is not None:
+            self.writer.submit(aggregate_root)
+        else:
+            self._save(aggregate_root)
+
+    def _save(self, aggregate_root: AggregateRoot) -> None:
         current_hash = self.hash_function(aggregate_root.__class__().get_representation())
 
         snapshot = self.serializer(aggregate_root, current_hash)
         self.backend.save(aggregate_root.id, snapshot)
 
+    def _mark_stale(self, aggregate_root: AggregateRoot, error: Exception) -> None:
+        """
+        Delete the saved snapshot after a failed write-behind save.
+
+        A snapshot with an offset is completed with the events committed
+        after it, but the failed save might have been replacing a snapshot
+        without an offset, which would be out of date.
+        """
+        self.backend.delete(aggregate_root.id)
+
     def load(self, id: str, aggregate_root: AggregateRoot) -> AggregateRoot:
         """
         Loads an aggregate root from the snapshot storage.
@@ -94,6 +133,30 @@ class Snapshot:
 
         return aggregate_root
 
+    def load_many(
+        self, ids: Iterable[str], aggregate_root: AggregateRoot
+    ) -> Dict[str, AggregateRoot]:
+        """
+        Loads multiple aggregate roots from the snapshot storage.
+
+        Args:
+            ids: IDs of the aggregate roots.
+            aggregate_root: The aggregate type of the objects to load
+
+        Returns:
+            dict: Aggregate roots by id, ids without a valid snapshot are
+                left out.
+        """
+        snapshots = self.backend.load_many(ids)
+        current_hash = self.hash_function(aggregate_root.__class__().get_representation())
+        aggregate_roots = {}
+        for id, snapshot in snapshots.items():
+            aggregate_root = self.deserializer(snapshot, current_hash)
+            if aggregate_root is not None:
+                aggregate_roots[id] = aggregate_root
+
+        return aggregate_roots
+
     def delete(self, aggregate_root: AggregateRoot) -> None:
         """
         Deletes the snapshot of the aggregate root.
@@ -104,4 +167,18 @@ class Snapshot:
         Returns:
             None
         """
+        # aggregate roots without an id are never saved by the writer
+        if self.writer is not None and aggregate_root.id is not None:
+            self.writer.discard(aggregate_root.id)
         self.backend.delete(aggregate_root.id)
+
+    def flush(self, timeout: Union[float, None] = None) -> None:
+        """
+        Wait until all write-behind saves are written.
+        """
+        if self.writer is not None:
+            self.writer.flush(timeout)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
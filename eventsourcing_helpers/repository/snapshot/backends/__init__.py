@@ -1,4 +1,4 @@
-from typing import Dict, Union
+from typing import Dict, Iterable, Union
 
 import structlog
 
@@ -12,5 +12,20 @@ class SnapshotBackend:
     def load(self, id: str) -> Union[Dict, None]:
         raise NotImplementedError()
 
+    def load_many(self, ids: Iterable[str]) -> Dict[str, Dict]:
+        """
+        Load the snapshots of multiple aggregate roots, backends should
+        override it with a single round trip.
+
+        Returns:
+            dict: Snapshot data by id, ids without a snapshot are left out.
+        """
+        snapshots = {}
+        for id in ids:
+            data = self.load(id)
+            if data:
+                snapshots[id] = data
+        return snapshots
+
     def delete(self, id: str) -> None:
         raise NotImplementedError()
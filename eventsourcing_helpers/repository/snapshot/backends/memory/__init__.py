@@ -0,0 +1,34 @@
+import threading
+from typing import Dict, Iterable, Union
+
+from eventsourcing_helpers.repository.snapshot.backends import SnapshotBackend
+
+
+class InMemorySnapshotBackend(SnapshotBackend):
+    """
+    Snapshot backend keeping the snapshots in memory.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self._snapshots: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def save(self, id: str, data: dict) -> None:
+        with self._lock:
+            self._snapshots[id] = {**data, "_id": id}
+
+    def load(self, id: str) -> Union[Dict, None]:
+        with self._lock:
+            return self._snapshots.get(id)
+
+    def load_many(self, ids: Iterable[str]) -> Dict[str, Dict]:
+        with self._lock:
+            return {id: self._snapshots[id] for id in ids if id in self._snapshots}
+
+    def delete(self, id: str) -> None:
+        with self._lock:
+            self._snapshots.pop(id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._snapshots.clear()
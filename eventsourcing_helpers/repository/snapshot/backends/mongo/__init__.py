@@ -1,4 +1,4 @@
-from typing import Dict, Union
+from typing import Dict, Iterable, Union
 
 from pymongo import MongoClient
 from pymongo.errors import PyMongoError
@@ -49,6 +49,21 @@ class MongoSnapshotBackend(SnapshotBackend):
         except PyMongoError:
             return None
 
+    def load_many(self, ids: Iterable[str]) -> Dict[str, Dict]:
+        """
+        Get the snapshots of multiple aggregates with a single query
+
+        Args:
+            ids (Iterable[str]): The ids to retrieve the data for
+        Returns:
+            dict: The stored snapshot data by id
+        """
+        query = {"_id": {"$in": list(ids)}}
+        try:
+            return {data["_id"]: data for data in self.db.snapshots.find(query)}
+        except PyMongoError:
+            return {}
+
     def delete(self, id: str) -> None:
         """
         Deletes the data of the snapshot with specified id.
@@ -1,3 +1,5 @@
+from typing import Dict, Iterable
+
 from eventsourcing_helpers.repository.snapshot.backends import SnapshotBackend
 
 
@@ -15,5 +17,8 @@ class NullSnapshotBackend(SnapshotBackend):
     def load(self, id: str) -> None:
         return None
 
+    def load_many(self, ids: Iterable[str]) -> Dict[str, Dict]:
+        return {}
+
     def delete(self, id: str) -> None:
         pass
@@ -0,0 +1,199 @@
+"""
+Snapshot policies decide when `Repository.commit` saves a snapshot.
+
+Since the events committed after a snapshot are replayed on load, a snapshot
+doesn't have to be saved on every commit. Saving less often trades a longer
+replay on load for fewer snapshot writes. This needs the offset of the last
+event in the snapshot, so aggregate roots without a known offset (e.g. loaded
+from a snapshot saved by an older version) are always saved.
+
+The repository keeps a few stats about the aggregate root since its last
+snapshot in `aggregate_root._snapshot_stats`:
+ * events - number of events committed or replayed since the snapshot;
+ * replay_seconds - time spent replaying events when it was last loaded;
+ * saved_at - time the snapshot was saved;
+ * committed_at - time of the previous commit.
+
+Policies are configured in the repository config, either for all aggregate
+roots or per aggregate root class. Multiple policies are combined, a snapshot
+is saved if any of them says so:
+
+    {
+        "snapshot_policy": {"every_n_events": 100, "interval": 3600},
+        "snapshot_policies": {"Order": {"every_n_events": 10}},
+    }
+
+Without a config a snapshot is saved on every commit.
+"""
+
+import time
+from typing import Any, Callable, Dict, List
+
+from eventsourcing_helpers.models import AggregateRoot
+from eventsourcing_helpers.utils import get_object_size
+
+
+def get_snapshot_stats(aggregate_root: AggregateRoot) -> dict:
+    """
+    Get the snapshot stats of an aggregate root, created if missing.
+    """
+    stats = getattr(aggregate_root, "_snapshot_stats", None)
+    if not isinstance(stats, dict):
+        stats = aggregate_root._snapshot_stats = {"events": 0}
+    return stats
+
+
+def reset_snapshot_stats(aggregate_root: AggregateRoot) -> dict:
+    """
+    Reset the snapshot stats before a snapshot is saved.
+
+    Returns:
+        dict: The previous stats.
+    """
+    stats = get_snapshot_stats(aggregate_root)
+    aggregate_root._snapshot_stats = {
+        "events": 0,
+        "saved_at": time.time(),
+        "committed_at": stats.get("committed_at"),
+    }
+    return stats
+
+
+class SnapshotPolicy:
+    """
+    Abstract base class for the snapshot policies.
+    """
+
+    def on_commit(self, aggregate_root: AggregateRoot, events: List[Any]) -> None:
+        """Called with the committed events before `should_snapshot`"""
+        pass
+
+    def should_snapshot(self, aggregate_root: AggregateRoot) -> bool:
+        """Checks if a snapshot should be saved after a commit"""
+        raise NotImplementedError
+
+
+class Always(SnapshotPolicy):
+    def should_snapshot(self, aggregate_root: AggregateRoot) -> bool:
+        return True
+
+
+class EveryNEvents(SnapshotPolicy):
+    """
+    Save a snapshot when `n` events have been committed or replayed since
+    the last snapshot.
+    """
+
+    def __init__(self, n: int) -> None:
+        assert n > 0, "n must be positive"
+        self.n = n
+
+    def should_snapshot(self, aggregate_root: AggregateRoot) -> bool:
+        return get_snapshot_stats(aggregate_root)["events"] >= self.n
+
+
+class ReplayTime(SnapshotPolicy):
+    """
+    Save a snapshot when replaying the events took at least `seconds` the
+    last time the aggregate root was loaded.
+    """
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
+
+    def should_snapshot(self, aggregate_root: AggregateRoot) -> bool:
+        return get_snapshot_stats(aggregate_root).get("replay_seconds", 0) >= self.seconds
+
+
+class Interval(SnapshotPolicy):
+    """
+    Save a snapshot at most once every `seconds` per aggregate root.
+    """
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
+
+    def should_snapshot(self, aggregate_root: AggregateRoot) -> bool:
+        saved_at = get_snapshot_stats(aggregate_root).get("saved_at")
+        return saved_at is None or time.time() - saved_at >= self.seconds
+
+
+class EventSize(SnapshotPolicy):
+    """
+    Save a snapshot when the approximate size of the events committed since
+    the last snapshot is at least `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+
+    def on_commit(self, aggregate_root: AggregateRoot, events: List[Any]) -> None:
+        stats = get_snapshot_stats(aggregate_root)
+        stats["bytes"] = stats.get("bytes", 0) + get_object_size(events)
+
+    def should_snapshot(self, aggregate_root: AggregateRoot) -> bool:
+        return get_snapshot_stats(aggregate_root).get("bytes", 0) >= self.max_bytes
+
+
+class Idle(SnapshotPolicy):
+    """
+    Save a snapshot on the first commit after the aggregate root has not been
+    committed for `seconds`.
+
+    Rarely written aggregate roots get a snapshot on every commit while
+    aggregate roots in a burst of commits don't.
+    """
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
+
+    def should_snapshot(self, aggregate_root: AggregateRoot) -> bool:
+        committed_at = get_snapshot_stats(aggregate_root).get("committed_at")
+        return committed_at is None or time.time() - committed_at >= self.seconds
+
+
+class AnyOf(SnapshotPolicy):
+    """
+    Save a snapshot if any of the policies says so.
+    """
+
+    def __init__(self, policies: List[SnapshotPolicy]) -> None:
+        self.policies = policies
+
+    def on_commit(self, aggregate_root: AggregateRoot, events: List[Any]) -> None:
+        for policy in self.policies:
+            policy.on_commit(aggregate_root, events)
+
+    def should_snapshot(self, aggregate_root: AggregateRoot) -> bool:
+        return any(policy.should_snapshot(aggregate_root) for policy in self.policies)
+
+
+POLICIES: Dict[str, Callable[[Any], SnapshotPolicy]] = {
+    "every_n_events": EveryNEvents,
+    "replay_time": ReplayTime,
+    "interval": Interval,
+    "event_size": EventSize,
+    "idle": Idle,
+}
+
+
+def get_snapshot_policy(config: dict, aggregate_class: str = None) -> SnapshotPolicy:
+    """
+    Build the snapshot policy for an aggregate root class from the
+    repository config.
+
+    Args:
+        config: Repository config.
+        aggregate_class (optional): Name of the aggregate root class.
+
+    Returns:
+        SnapshotPolicy: Configured policy.
+    """
+    policy_config = config.get("snapshot_policies", {}).get(aggregate_class)
+    if policy_config is None:
+        policy_config = config.get("snapshot_policy")
+    if not policy_config:
+        return Always()
+
+    policies = [POLICIES[name](value) for name, value in policy_config.items()]
+    return policies[0] if len(policies) == 1 else AnyOf(policies)
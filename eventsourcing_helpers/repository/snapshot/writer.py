@@ -0,0 +1,181 @@
+import atexit
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, Set, Union
+
+import structlog
+
+from eventsourcing_helpers.metrics import base_metric, statsd
+from eventsourcing_helpers.models import AggregateRoot
+
+logger = structlog.get_logger(__name__)
+
+
+class SnapshotWriter:
+    """
+    Saves snapshots on background threads (write-behind).
+
+    Saving a snapshot means serializing the whole aggregate root and writing
+    it to the snapshot storage, which is a large part of the time spent
+    committing a command. The writer takes that off the consumer thread.
+
+    Pending saves are kept per aggregate root id, so if an aggregate root is
+    committed again before its snapshot was written only the latest version
+    is saved. Saves for the same id are never written concurrently.
+
+    A failed save is logged and handed to `on_error`, it never fails the
+    command. Since the events committed after a snapshot are replayed on
+    load, a missing snapshot only makes loading slower.
+
+    The aggregate root is serialized by the writer, so it must not be changed
+    after it was handed over.
+
+    Args:
+        save: Callable saving a snapshot of an aggregate root.
+        on_error (optional): Callable receiving the aggregate root and the
+            error when a save failed.
+        workers: Number of writer threads.
+        max_pending: Max number of pending saves, `submit` blocks until
+            there is room for a new id.
+    """
+
+    def __init__(
+        self,
+        save: Callable[[AggregateRoot], None],
+        on_error: Union[Callable[[AggregateRoot, Exception], None], None] = None,
+        workers: int = 1,
+        max_pending: int = 1000,
+    ) -> None:
+        assert workers > 0, "You need at least one worker"
+        assert max_pending > 0, "max_pending must be positive"
+        self.save = save
+        self.on_error = on_error
+        self.max_pending = max_pending
+        self._pending: Dict[str, AggregateRoot] = {}
+        self._queue: Deque[str] = deque()
+        self._in_flight: Set[str] = set()
+        self._closed = False
+        self._condition = threading.Condition()
+        self._threads = [
+            threading.Thread(
+                target=self._work, name=f"eventsourcing-snapshot-writer-{i}", daemon=True
+            )
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        atexit.register(self.close)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._pending
+
+    def submit(self, aggregate_root: AggregateRoot) -> None:
+        """
+        Schedule a snapshot save, replacing any pending save for the same id.
+        """
+        id = aggregate_root.id
+        assert id is not None, "The id must be set on the aggregate root"
+        with self._condition:
+            assert not self._closed, "The snapshot writer is closed"
+            if id in self._pending:
+                self._pending[id] = aggregate_root
+                statsd.increment(f"{base_metric}.snapshot.writer.coalesced")  # type: ignore
+                return
+
+            while len(self._pending) >= self.max_pending:
+                self._condition.wait()
+
+            self._pending[id] = aggregate_root
+            # an id being written is queued again when the write is done
+            if id not in self._in_flight:
+                self._queue.append(id)
+                self._condition.notify_all()
+            self._report_pending()
+
+    def discard(self, id: str) -> None:
+        """
+        Drop a pending save and wait until any save in flight for the id is
+        written, so the snapshot can safely be deleted afterwards.
+        """
+        with self._condition:
+            if self._pending.pop(id, None) is not None:
+                self._condition.notify_all()
+            while id in self._in_flight:
+                self._condition.wait()
+            self._report_pending()
+
+    def flush(self, timeout: Union[float, None] = None) -> bool:
+        """
+        Wait until all pending saves are written.
+
+        Returns:
+            bool: False if the timeout expired first.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._in_flight, timeout=timeout
+            )
+
+    def close(self, timeout: Union[float, None] = None) -> None:
+        """
+        Write all pending saves and stop the writer threads.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        atexit.unregister(self.close)
+
+    def _next(self) -> Union[str, None]:
+        with self._condition:
+            while True:
+                while self._queue:
+                    id = self._queue.popleft()
+                    # discarded ids stay in the queue
+                    if id in self._pending:
+                        self._in_flight.add(id)
+                        return id
+                if self._closed:
+                    return None
+                self._condition.wait()
+
+    def _work(self) -> None:
+        while True:
+            id = self._next()
+            if id is None:
+                return
+
+            with self._condition:
+                aggregate_root = self._pending.pop(id)
+                self._condition.notify_all()
+            try:
+                self.save(aggregate_root)
+            except Exception as e:
+                logger.warning("Failed to write snapshot", id=id, exc_info=True)
+                statsd.increment(f"{base_metric}.snapshot.writer.error")  # type: ignore
+                if self.on_error is not None:
+                    self._handle_error(aggregate_root, e)
+
+            with self._condition:
+                self._in_flight.discard(id)
+                if id in self._pending:
+                    self._queue.append(id)
+                self._condition.notify_all()
+                self._report_pending()
+
+    def _handle_error(self, aggregate_root: AggregateRoot, error: Exception) -> None:
+        try:
+            self.on_error(aggregate_root, error)  # type: ignore
+        except Exception:
+            logger.warning("Failed to handle snapshot write error", exc_info=True)
+
+    def _report_pending(self) -> None:
+        statsd.gauge(  # type: ignore
+            f"{base_metric}.snapshot.writer.pending", len(self._pending) + len(self._in_flight)
+        )
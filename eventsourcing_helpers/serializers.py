@@ -1,6 +1,12 @@
 from typing import Any
 
-from eventsourcing_helpers.message import Message, message_factory
+from eventsourcing_helpers.message import Message, MessageMeta, message_factory
+from eventsourcing_helpers.message.meta import EMPTY_META
+from eventsourcing_helpers.message.schema import (
+    MessageClassRegistry,
+    SchemaMessage,
+    message_classes,
+)
 
 from confluent_kafka_helpers.message import Message as ConfluentKafkaMessage
 
@@ -9,16 +15,24 @@ try:
 except ImportError:
     from collections import namedtuple
 
+# header used to route messages on their class without decoding the value
+MESSAGE_CLASS_HEADER = "message_class"
+
 
 def from_message_to_dto(
-    message: ConfluentKafkaMessage, is_new: bool = True, deserialize_class: type | None = None
+    message: ConfluentKafkaMessage,
+    is_new: bool = True,
+    deserialize_class: type[Any] | None = None,
+    registry: MessageClassRegistry = message_classes,
+    include_meta: bool = True,
 ) -> Message | Any:
     """
     Deserialize a `confluent_kafka_helpers.message.Message` to a data transfer
     object (DTO).
 
-    If no `deserialize_class` is provided a default wrapped `namedtuple` class
-    will be used.
+    If no `deserialize_class` is provided the class registered for the message
+    in the `registry` (see `eventsourcing_helpers.message.schema`) is used,
+    otherwise a default wrapped `namedtuple` class.
 
     Args:
         message: Message to deserialize.
@@ -26,6 +40,10 @@ def from_message_to_dto(
             from the repository.
         deserialize_class (optional): Class to use for deserializing the
         message into a DTO.
+        registry (optional): Registry with generated message classes.
+        include_meta (optional): Flag that indicates if the message metadata
+            should be attached to the DTO. If not, a shared empty `Meta` is
+            attached instead.
 
     Returns:
         object: DTO instance hydrated with message data.
@@ -35,16 +53,18 @@ def from_message_to_dto(
         >>> from_message_to_dto(message)
         OrderCompleted(order_id="UA123")
     """
-    data, class_name, meta = (
-        message.value["data"],
-        message.value["class"],
-        message._meta,
-    )
-    if deserialize_class:
-        dto = deserialize_class(Meta=meta, **data)
-    else:
+    data, class_name = message.value["data"], message.value["class"]
+    meta = MessageMeta.from_message(message) if include_meta else EMPTY_META
+    if deserialize_class is None:
+        deserialize_class = registry.get(class_name)
+    dto: Any
+    if deserialize_class is None:
         message_cls = namedtuple(class_name, data.keys() | {"Meta"})
         dto = message_factory(message_cls, is_new=is_new)(Meta=meta, **data)
+    elif issubclass(deserialize_class, SchemaMessage):
+        dto = deserialize_class.from_record(data, meta, is_new=is_new)
+    else:
+        dto = deserialize_class(Meta=meta, **data)
 
     return dto
 
@@ -56,8 +76,11 @@ def to_message_from_dto(dto: Message) -> dict:
     The message includes two keys `class` and `data`. The `class` will be the
     type of the DTO and the `data` will be a dict with all attributes.
 
+    Already serialized messages (e.g. consumed messages routed to a dead
+    letter topic) are returned as is.
+
     Args:
-        dto: DTO instance.
+        dto: DTO instance or serialized message.
 
     Returns:
         dict: Serialized message.
@@ -74,6 +97,41 @@ def to_message_from_dto(dto: Message) -> dict:
             }
         }
     """
+    if isinstance(dto, dict):
+        return dto
     message = {"class": dto._class, "data": dto.to_dict()}
 
     return message
+
+
+def get_message_class(value: Any) -> str | None:
+    """
+    Get the class name of a message value, either a DTO or a serialized
+    message.
+
+    Args:
+        value: DTO instance or serialized message.
+
+    Returns:
+        str: Class name or None if it can't be determined.
+    """
+    if isinstance(value, dict):
+        return value.get("class")
+    return getattr(value, "_class", None)
+
+
+def add_message_class_header(value: Any, headers: dict | None = None) -> dict | None:
+    """
+    Add the message class header to the given headers.
+
+    Args:
+        value: DTO instance or serialized message.
+        headers (optional): Headers to produce the message with.
+
+    Returns:
+        dict: Headers including the message class (if it could be determined).
+    """
+    message_class = get_message_class(value)
+    if not message_class:
+        return headers
+    return {**(headers or {}), MESSAGE_CLASS_HEADER: message_class}
@@ -0,0 +1,58 @@
+from random import random
+from typing import Dict, Union
+
+
+class TraceSampler:
+    """
+    Head sampler deciding if a message should be traced before it is handled.
+
+    Messages that are not sampled are handled without creating any spans. If
+    handling an unsampled message fails or is slow a span is still recorded
+    afterwards, starting at the time the message was received.
+
+    Args:
+        ratio: Ratio of messages to trace, between 0.0 and 1.0.
+        overrides: Ratios for specific message classes.
+        always_sample_errors: Record a span for unsampled messages that fail.
+        slow_threshold: Record a span for unsampled messages taking longer
+            than this many seconds to handle.
+    """
+
+    def __init__(
+        self,
+        ratio: float = 1.0,
+        overrides: Union[Dict[str, float], None] = None,
+        always_sample_errors: bool = True,
+        slow_threshold: Union[float, None] = None,
+    ) -> None:
+        self.ratio = ratio
+        self.overrides = overrides or {}
+        self.always_sample_errors = always_sample_errors
+        self.slow_threshold = slow_threshold
+        self._slow_threshold_ns = None if slow_threshold is None else int(slow_threshold * 1e9)
+
+    def sample(self, message_class: str) -> bool:
+        """
+        Decide if a message should be traced.
+
+        Args:
+            message_class: Class name of the message.
+
+        Returns:
+            bool: Flag to indicate if the message should be traced.
+        """
+        ratio = self.overrides.get(message_class, self.ratio)
+        if ratio >= 1.0:
+            return True
+        if ratio <= 0.0:
+            return False
+        return random() < ratio
+
+    def is_slow(self, duration_ns: int) -> bool:
+        """
+        Check if handling an unsampled message was slow enough to be traced.
+
+        Args:
+            duration_ns: Time it took to handle the message in nanoseconds.
+        """
+        return self._slow_threshold_ns is not None and duration_ns > self._slow_threshold_ns
@@ -1,3 +1,4 @@
+import sys
 from copy import deepcopy
 from importlib import import_module
 from typing import Any, Callable, List
@@ -108,3 +109,37 @@ def get_callable_representation(target: Callable) -> str:
         ('Test.method', 'Test.klass', 'Test.static')
     """
     return getattr(target, "__qualname__", getattr(target, "__name__", ""))
+
+
+def get_object_size(obj: Any) -> int:
+    """
+    Get the approximate deep size in bytes of an object.
+
+    Follows instance attributes and the items of dicts, lists, tuples and
+    sets. Objects referenced more than once are only counted once.
+
+    Args:
+        obj: Object to measure.
+
+    Returns:
+        int: Approximate size in bytes.
+    """
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        if hasattr(obj, "__dict__") and not isinstance(obj, type):
+            stack.append(obj.__dict__)
+
+    return size
@@ -38,6 +38,13 @@ class MockBackendTests:
         self.backend.consume(handler=handler)
         assert handler.call_count == 2
 
+    def test_consume_batch_should_call_handler_with_batches(self):
+        for key in "abc":
+            self.backend.consumer.add_message(key=key, value={"class": key, "data": {}})
+        batches = []
+        self.backend.consume_batch(handler=batches.append, batch_size=2)
+        assert [[m.value["class"] for m in batch] for batch in batches] == [["a", "b"], ["c"]]
+
     def test_consume_with_stop_on_eof_disabled_should_continue_when_no_messages(self):
         backend = MockBackend(config={"consumer": {"stop_on_eof": False}})
         handler = Mock()
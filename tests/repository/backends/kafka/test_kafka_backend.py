@@ -1,5 +1,8 @@
 from functools import partial
-from unittest.mock import MagicMock, Mock, patch
+from unittest.mock import ANY, MagicMock, Mock, patch
+
+import pytest
+from confluent_kafka import KafkaException, TopicPartition
 
 from eventsourcing_helpers.repository.backends.kafka import KafkaAvroBackend
 
@@ -44,11 +47,42 @@ class KafkaBackendTests:
         Test that the produce method are invoked correctly.
         """
         backend = self.backend()
-        backend.commit(self.id, self.events)
+        assert backend.commit(self.id, self.events) is None
 
         expected = [({"key": self.id, "value": e},) for e in self.events]
         assert self.producer.return_value.produce.call_args_list == expected
         assert self.producer.return_value.produce.call_count == len(self.events)
+        self.producer.return_value.flush.assert_not_called()
+        self.producer.return_value.poll.assert_not_called()
+
+    def test_commit_returns_offsets(self):
+        producer = self.producer.return_value
+        deliveries = []
+        producer.produce.side_effect = lambda on_delivery, value, **kwargs: deliveries.append(
+            partial(on_delivery, None, Mock(offset=Mock(return_value=value + 10)))
+        )
+        producer.poll.side_effect = lambda timeout: deliveries.pop(0)()
+        backend = self.backend()
+
+        assert backend.commit(self.id, self.events, wait_for_offsets=True) == [11, 12, 13]
+        assert producer.poll.call_count == 3
+        producer.flush.assert_not_called()
+
+    def test_commit_raises_delivery_error(self):
+        producer = self.producer.return_value
+        producer.produce.side_effect = lambda on_delivery, **kwargs: on_delivery("error", None)
+        backend = self.backend()
+
+        with pytest.raises(KafkaException):
+            backend.commit(self.id, self.events, wait_for_offsets=True)
+
+    def test_commit_raises_delivery_timeout(self):
+        self.config["delivery_timeout"] = 0
+        backend = self.backend()
+
+        with pytest.raises(KafkaException):
+            backend.commit(self.id, self.events, wait_for_offsets=True)
+        self.producer.return_value.poll.assert_not_called()
 
     def test_load(self):
         """
@@ -70,3 +104,22 @@ class KafkaBackendTests:
             _events = backend.get_events(id)
             assert events == list(_events)
             load_mock.assert_called_once_with(id)
+
+    def test_get_events_from_offset(self):
+        backend = self.backend()
+        loader = self.loader.return_value.load.return_value
+        loader.consumer.assignment.return_value = [TopicPartition("events", 3, 0)]
+
+        assert backend.get_events(id, min_offset=5) == events
+
+        (partition,) = loader.consumer.assign.call_args.args[0]
+        assert (partition.topic, partition.partition, partition.offset) == ("events", 3, 5)
+
+    def test_get_events_stops_at_max_offset(self):
+        messages = [Mock(_meta=Mock(offset=offset)) for offset in range(3)]
+        loader = self.loader.return_value.load.return_value
+        loader.__enter__.return_value = messages
+        backend = self.backend()
+
+        assert backend.get_events(id, max_offset=1) == messages[:2]
+        assert not backend._load_lock.locked()
@@ -0,0 +1,148 @@
+import os
+
+import pytest
+
+from eventsourcing_helpers.repository.backends.log import LogBackend, Segment
+from eventsourcing_helpers.serializers import from_message_to_dto
+
+
+def event(amount):
+    return {"class": "Incremented", "data": {"amount": amount}}
+
+
+def amounts(events):
+    return [e.value["data"]["amount"] for e in events]
+
+
+class LogBackendTests:
+    @pytest.fixture(autouse=True)
+    def setup_method(self, tmp_path):
+        self.path = str(tmp_path / "log")
+        self.backends = []
+
+    def teardown_method(self):
+        for backend in self.backends:
+            backend.close()
+
+    def create_backend(self, **config):
+        backend = LogBackend({"path": self.path, **config})
+        self.backends.append(backend)
+        return backend
+
+    def commit_many(self, backend, num_events):
+        for amount in range(num_events):
+            backend.commit("ab"[amount % 2], [event(amount)])
+
+    def test_commit_returns_offsets(self):
+        backend = self.create_backend()
+
+        assert backend.commit("a", [event(1), event(2)]) == [0, 1]
+        assert backend.commit("b", [event(3)]) == [2]
+
+    def test_get_events_returns_events_of_aggregate_in_order(self):
+        backend = self.create_backend()
+        self.commit_many(backend, 6)
+
+        events = list(backend.get_events("a"))
+
+        assert amounts(events) == [0, 2, 4]
+        assert [e._meta.offset for e in events] == [0, 2, 4]
+        assert events[0]._meta.headers == {"message_class": "Incremented"}
+        assert list(backend.get_events("c")) == []
+
+    def test_get_events_between_offsets(self):
+        backend = self.create_backend()
+        self.commit_many(backend, 10)
+
+        events = backend.get_events("a", min_offset=3, max_offset=6)
+
+        assert [e._meta.offset for e in events] == [4, 6]
+
+    def test_events_can_be_deserialized(self):
+        backend = self.create_backend()
+        backend.commit("a", [event(1)])
+        (stored,) = backend.get_events("a")
+
+        dto = from_message_to_dto(stored, is_new=False)
+
+        assert dto.amount == 1
+        assert dto.Meta.offset == 0
+
+    def test_rolls_segments(self):
+        backend = self.create_backend(segment_bytes=200)
+        self.commit_many(backend, 10)
+
+        assert len(backend._segments) > 1
+        assert amounts(backend.get_events("b")) == [1, 3, 5, 7, 9]
+
+    def test_reopen_loads_index(self):
+        backend = self.create_backend(segment_bytes=200)
+        self.commit_many(backend, 10)
+        backend.close()
+
+        backend = self.create_backend(segment_bytes=200)
+
+        assert amounts(backend.get_events("a")) == [0, 2, 4, 6, 8]
+        assert backend.commit("a", [event(10)]) == [10]
+
+    def test_recovers_index_tail(self):
+        backend = self.create_backend()
+        self.commit_many(backend, 4)
+        backend.close()
+        index_path = Segment(self.path, 0).index_path
+        with open(index_path, "r+b") as f:
+            f.truncate(os.path.getsize(index_path) - 3)
+
+        backend = self.create_backend()
+
+        assert amounts(backend.get_events("b")) == [1, 3]
+        assert len(Segment(self.path, 0).read_index()) == 4
+
+    def test_truncates_torn_record(self):
+        backend = self.create_backend()
+        self.commit_many(backend, 2)
+        backend.close()
+        segment = Segment(self.path, 0)
+        with open(segment.log_path, "ab") as f:
+            f.write(b"\x10\x00\x00\x00torn")
+
+        backend = self.create_backend()
+
+        assert backend.commit("a", [event(2)]) == [2]
+        assert amounts(backend.get_events("a")) == [0, 2]
+
+    def test_compaction_clusters_and_merges_sealed_segments(self):
+        backend = self.create_backend(segment_bytes=400, compaction_bytes=1000)
+        self.commit_many(backend, 20)
+        num_segments = len(backend._segments)
+        events = backend.get_events("a")
+        next(events)
+
+        backend.compact()
+
+        assert len(backend._segments) < num_segments
+        assert backend._is_clustered(backend._segments[0])
+        assert amounts(events) == list(range(2, 20, 2))
+        assert amounts(backend.get_events("b")) == list(range(1, 20, 2))
+        assert [e._meta.offset for e in backend.get_events("a", min_offset=10)] == [
+            10,
+            12,
+            14,
+            16,
+            18,
+        ]
+
+    def test_finishes_interrupted_compaction_on_open(self):
+        backend = self.create_backend(segment_bytes=400, compaction_bytes=1000)
+        self.commit_many(backend, 20)
+        backend._finish_compaction = lambda marker: None
+        backend.compact()
+        backend.close()
+        assert any(name.endswith(".compaction") for name in os.listdir(self.path))
+
+        backend = self.create_backend(segment_bytes=400, compaction_bytes=1000)
+
+        assert len(backend._segments) == 3
+        assert not any(name.endswith(".compacting") for name in os.listdir(self.path))
+        assert amounts(backend.get_events("a")) == list(range(0, 20, 2))
+        assert backend.commit("a", [event(20)]) == [20]
@@ -0,0 +1,106 @@
+import threading
+from typing import NamedTuple
+
+from eventsourcing_helpers.message import message_factory
+from eventsourcing_helpers.models import AggregateRoot
+from eventsourcing_helpers.repository import BACKENDS, Repository
+from eventsourcing_helpers.repository.backends.memory import InMemoryBackend
+from eventsourcing_helpers.repository.snapshot import BACKENDS as SNAPSHOT_BACKENDS
+from eventsourcing_helpers.serializers import from_message_to_dto
+
+Incremented = message_factory(NamedTuple("Incremented", [("id", str), ("amount", int)]))
+
+
+class Counter(AggregateRoot):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def increment(self, amount):
+        self.apply_event(Incremented(id=self.id or "c1", amount=amount))
+
+    def apply_incremented(self, event):
+        self.id = event.id
+        self.value += event.amount
+
+
+def event(amount):
+    return {"class": "Incremented", "data": {"id": "a", "amount": amount}}
+
+
+class InMemoryBackendTests:
+    def setup_method(self):
+        self.backend = InMemoryBackend({})
+
+    def test_commit_returns_offsets(self):
+        assert self.backend.commit("a", [event(1), event(2)]) == [0, 1]
+        assert self.backend.commit("b", [event(3)]) == [2]
+
+    def test_get_events_between_offsets(self):
+        self.backend.commit("a", [event(1), event(2)])
+        self.backend.commit("b", [event(3)])
+        self.backend.commit("a", [event(4), event(5)])
+
+        assert [e._meta.offset for e in self.backend.get_events("a")] == [0, 1, 3, 4]
+        events = self.backend.get_events("a", min_offset=1, max_offset=3)
+        assert [e._meta.offset for e in events] == [1, 3]
+        assert list(self.backend.get_events("c")) == []
+
+    def test_events_can_be_deserialized(self):
+        self.backend.commit("a", [Incremented(id="a", amount=1)])
+        (stored,) = self.backend.get_events("a")
+
+        dto = from_message_to_dto(stored, is_new=False)
+
+        assert dto.amount == 1
+        assert dto.Meta.offset == 0
+        assert dto.Meta.headers == {"message_class": "Incremented"}
+
+    def test_concurrent_commits(self):
+        def commit():
+            for amount in range(100):
+                self.backend.commit("a", [event(amount)])
+
+        threads = [threading.Thread(target=commit) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        offsets = [e._meta.offset for e in self.backend.get_events("a")]
+        assert offsets == list(range(400))
+
+
+class InMemoryRepositoryTests:
+    def setup_method(self):
+        self.config = {
+            "backend": BACKENDS["memory"],
+            "backend_config": {},
+            "snapshot": {"backend": SNAPSHOT_BACKENDS["memory"]},
+            "snapshot_policy": {"every_n_events": 2},
+        }
+        self.repository = Repository(self.config, Counter)
+
+    def test_load_completes_snapshot_with_later_events(self):
+        counter = Counter()
+        for amount in (1, 2, 3):
+            counter.increment(amount)
+            self.repository.commit(counter)
+
+        loaded = self.repository.load("c1")
+
+        assert loaded.value == 6
+        assert loaded._offset == 2
+        assert self.repository.snapshot.backend.load("c1") is not None
+
+    def test_load_many(self):
+        for id in ("a", "b"):
+            counter = Counter()
+            counter.id = id
+            counter.increment(1)
+            counter.increment(1)
+            self.repository.commit(counter)
+
+        loaded = self.repository.load_many(["a", "b", "c"])
+
+        assert {id: counter.value for id, counter in loaded.items()} == {"a": 2, "b": 2, "c": 0}
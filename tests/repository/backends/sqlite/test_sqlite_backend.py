@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+from typing import NamedTuple
+
+import pytest
+
+from eventsourcing_helpers.message import message_factory
+from eventsourcing_helpers.models import AggregateRoot
+from eventsourcing_helpers.repository import BACKENDS, Repository
+from eventsourcing_helpers.repository.backends.sqlite import SQLiteBackend
+from eventsourcing_helpers.serializers import from_message_to_dto
+
+Incremented = message_factory(NamedTuple("Incremented", [("id", str), ("amount", int)]))
+
+
+class Counter(AggregateRoot):
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+
+    def increment(self, amount):
+        self.apply_event(Incremented(id=self.id or "c1", amount=amount))
+
+    def apply_incremented(self, event):
+        self.id = event.id
+        self.value += event.amount
+
+
+def event(amount):
+    return {"class": "Incremented", "data": {"id": "a", "amount": amount}}
+
+
+class SQLiteBackendTests:
+    @pytest.fixture(autouse=True)
+    def setup_method(self, tmp_path):
+        self.path = str(tmp_path / "events.db")
+        self.backend = SQLiteBackend({"path": self.path})
+
+    def test_uses_wal_mode(self):
+        (mode,) = self.backend.connection.execute("PRAGMA journal_mode").fetchone()
+
+        assert mode == "wal"
+
+    def test_commit_returns_offsets(self):
+        assert self.backend.commit("a", [event(1), event(2)]) == [1, 2]
+        assert self.backend.commit("b", [event(3)]) == [3]
+
+    def test_get_events_returns_events_of_aggregate_in_order(self):
+        self.backend.commit("a", [event(1), event(2)])
+        self.backend.commit("b", [event(3)])
+        self.backend.commit("a", [event(4)])
+
+        events = list(self.backend.get_events("a"))
+
+        assert [e.value["data"]["amount"] for e in events] == [1, 2, 4]
+        assert [e._meta.offset for e in events] == [1, 2, 4]
+        assert events[0]._meta.headers == {"message_class": "Incremented"}
+
+    def test_get_events_between_offsets(self):
+        self.backend.commit("a", [event(1), event(2), event(3), event(4)])
+
+        events = self.backend.get_events("a", min_offset=2, max_offset=3)
+
+        assert [e._meta.offset for e in events] == [2, 3]
+
+    def test_events_can_be_deserialized(self):
+        self.backend.commit("a", [event(1)])
+        (stored,) = self.backend.get_events("a")
+
+        dto = from_message_to_dto(stored, is_new=False)
+
+        assert dto.amount == 1
+        assert dto.Meta.offset == 1
+
+    def test_sequence_is_unique_per_aggregate(self):
+        self.backend.commit("a", [event(1)])
+
+        with pytest.raises(sqlite3.IntegrityError):
+            self.backend.connection.execute(
+                "INSERT INTO events (aggregate_id, sequence, value, timestamp) "
+                "VALUES ('a', 1, '', 0)"
+            )
+
+    def test_threads_use_their_own_connection(self):
+        self.backend.commit("a", [event(1)])
+        result = []
+
+        thread = threading.Thread(target=lambda: result.extend(self.backend.get_events("a")))
+        thread.start()
+        thread.join()
+
+        assert len(result) == 1
+
+    def test_repository_roundtrip(self):
+        config = {"backend": BACKENDS["sqlite"], "backend_config": {"path": self.path}}
+        repository = Repository(config, Counter)
+        counter = Counter()
+        counter.increment(2)
+        repository.commit(counter)
+        counter.increment(3)
+        repository.commit(counter)
+
+        loaded = repository.load("c1")
+
+        assert loaded.value == 5
+        assert loaded._offset == 2
+        assert repository.load("c1", max_offset=1).value == 2
@@ -0,0 +1,25 @@
+from eventsourcing_helpers.repository.snapshot.backends.memory import InMemorySnapshotBackend
+
+
+class InMemorySnapshotBackendTests:
+    def setup_method(self):
+        self.backend = InMemorySnapshotBackend({})
+
+    def test_save_and_load(self):
+        self.backend.save("a", {"data": "b"})
+
+        assert self.backend.load("a") == {"_id": "a", "data": "b"}
+        assert self.backend.load("c") is None
+
+    def test_load_many(self):
+        self.backend.save("a", {"data": "a"})
+        self.backend.save("b", {"data": "b"})
+
+        assert set(self.backend.load_many(["a", "b", "c"])) == {"a", "b"}
+
+    def test_delete(self):
+        self.backend.save("a", {"data": "b"})
+        self.backend.delete("a")
+        self.backend.delete("a")
+
+        assert self.backend.load("a") is None
@@ -86,3 +86,12 @@ class MongoSnapshotBackendTests:
         assert db.count_documents(query) == 0
         self.backend.delete(id)
         assert db.count_documents(query) == 0
+
+    def test_mongo_load_many_loads_existing_snapshots(self):
+        db = self.backend.client.snapshots.snapshots
+        for id in ("a", "b"):
+            db.find_one_and_replace({"_id": id}, {"b": id}, upsert=True)
+
+        stored_data = self.backend.load_many(["a", "b", "c"])
+
+        assert stored_data == {"a": {"_id": "a", "b": "a"}, "b": {"_id": "b", "b": "b"}}
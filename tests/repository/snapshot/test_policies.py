@@ -0,0 +1,99 @@
+import time
+from unittest.mock import Mock
+
+from eventsourcing_helpers.repository.snapshot.policies import (
+    Always,
+    AnyOf,
+    EventSize,
+    EveryNEvents,
+    Idle,
+    Interval,
+    ReplayTime,
+    get_snapshot_policy,
+    get_snapshot_stats,
+    reset_snapshot_stats,
+)
+
+
+class SnapshotPolicyTests:
+    def setup_method(self):
+        self.aggregate_root = Mock(_snapshot_stats=None)
+
+    def test_stats_are_created_and_reset(self):
+        stats = get_snapshot_stats(self.aggregate_root)
+        stats["events"] = 3
+
+        previous = reset_snapshot_stats(self.aggregate_root)
+
+        assert previous["events"] == 3
+        assert self.aggregate_root._snapshot_stats["events"] == 0
+        assert self.aggregate_root._snapshot_stats["saved_at"] is not None
+
+    def test_every_n_events(self):
+        policy = EveryNEvents(3)
+        get_snapshot_stats(self.aggregate_root)["events"] = 2
+        assert policy.should_snapshot(self.aggregate_root) is False
+
+        get_snapshot_stats(self.aggregate_root)["events"] = 3
+        assert policy.should_snapshot(self.aggregate_root) is True
+
+    def test_replay_time(self):
+        policy = ReplayTime(0.5)
+        assert policy.should_snapshot(self.aggregate_root) is False
+
+        get_snapshot_stats(self.aggregate_root)["replay_seconds"] = 0.6
+        assert policy.should_snapshot(self.aggregate_root) is True
+
+    def test_interval(self):
+        policy = Interval(60)
+        assert policy.should_snapshot(self.aggregate_root) is True
+
+        reset_snapshot_stats(self.aggregate_root)
+        assert policy.should_snapshot(self.aggregate_root) is False
+
+        get_snapshot_stats(self.aggregate_root)["saved_at"] = time.time() - 61
+        assert policy.should_snapshot(self.aggregate_root) is True
+
+    def test_event_size(self):
+        policy = EventSize(100)
+        policy.on_commit(self.aggregate_root, [])
+        assert policy.should_snapshot(self.aggregate_root) is False
+
+        policy.on_commit(self.aggregate_root, ["x" * 100])
+        assert policy.should_snapshot(self.aggregate_root) is True
+
+    def test_idle(self):
+        policy = Idle(60)
+        assert policy.should_snapshot(self.aggregate_root) is True
+
+        get_snapshot_stats(self.aggregate_root)["committed_at"] = time.time()
+        assert policy.should_snapshot(self.aggregate_root) is False
+
+    def test_any_of(self):
+        policy = AnyOf([EveryNEvents(10), ReplayTime(1)])
+        get_snapshot_stats(self.aggregate_root)["replay_seconds"] = 2
+
+        assert policy.should_snapshot(self.aggregate_root) is True
+
+
+class GetSnapshotPolicyTests:
+    def test_defaults_to_always(self):
+        assert isinstance(get_snapshot_policy({}, "Order"), Always)
+
+    def test_default_policy(self):
+        policy = get_snapshot_policy({"snapshot_policy": {"every_n_events": 10}}, "Order")
+
+        assert isinstance(policy, EveryNEvents)
+        assert policy.n == 10
+
+    def test_per_aggregate_class_policy(self):
+        config = {
+            "snapshot_policy": {"every_n_events": 10},
+            "snapshot_policies": {"Order": {"every_n_events": 2, "interval": 60}},
+        }
+
+        policy = get_snapshot_policy(config, "Order")
+
+        assert isinstance(policy, AnyOf)
+        assert [type(p) for p in policy.policies] == [EveryNEvents, Interval]
+        assert get_snapshot_policy(config, "Customer").n == 10
@@ -4,6 +4,7 @@ from unittest.mock import Mock
 import pytest
 
 from eventsourcing_helpers.repository.snapshot import Snapshot
+from eventsourcing_helpers.repository.snapshot.backends.null import NullSnapshotBackend
 
 
 class SnapshotTests:
@@ -55,3 +56,40 @@ class SnapshotTests:
         snapshot.delete(aggregate_root)
 
         self.backend().delete.assert_called_once_with(aggregate_root.id)
+
+    def test_enabled(self):
+        assert self.snapshot().enabled is True
+        assert self.snapshot(importer=lambda path: NullSnapshotBackend).enabled is False
+
+    def test_save_write_behind(self):
+        snapshot = self.snapshot(config={"snapshot": {"write_behind": {"workers": 1}}})
+        aggregate_root = self.aggregate_root_cls()
+        aggregate_root.id = 1
+
+        snapshot.save(aggregate_root)
+        snapshot.flush(timeout=5)
+
+        self.backend().save.assert_called_once_with(1, self.serializer.return_value)
+        snapshot.close()
+
+    def test_failed_write_behind_save_deletes_snapshot(self):
+        snapshot = self.snapshot(config={"snapshot": {"write_behind": {"workers": 1}}})
+        self.backend().save.side_effect = ValueError
+        aggregate_root = self.aggregate_root_cls()
+        aggregate_root.id = 1
+        aggregate_root._offset = 5
+
+        snapshot.save(aggregate_root)
+        snapshot.close()
+
+        self.backend().delete.assert_called_once_with(1)
+
+    def test_load_many(self):
+        snapshot = self.snapshot()
+        self.backend().load_many.return_value = {1: "a", 2: "b"}
+        self.deserializer.side_effect = lambda data, hash: None if data == "b" else data
+
+        aggregate_roots = snapshot.load_many([1, 2, 3], self.aggregate_root_cls())
+
+        self.backend().load_many.assert_called_once_with([1, 2, 3])
+        assert aggregate_roots == {1: "a"}
@@ -0,0 +1,95 @@
+import threading
+from unittest.mock import Mock
+
+from eventsourcing_helpers.repository.snapshot.writer import SnapshotWriter
+
+
+class BlockingSave:
+    """
+    Saves aggregate roots, blocking until released.
+    """
+
+    def __init__(self):
+        self.saved = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, aggregate_root):
+        self.started.set()
+        self.release.wait(5)
+        self.saved.append(aggregate_root)
+
+
+class SnapshotWriterTests:
+    def setup_method(self):
+        self.save = BlockingSave()
+        self.on_error = Mock()
+        self.writer = SnapshotWriter(self.save, on_error=self.on_error)
+
+    def teardown_method(self):
+        self.save.release.set()
+        self.writer.close(timeout=5)
+
+    def test_saves_in_background(self):
+        aggregate_root = Mock(id=1)
+        self.writer.submit(aggregate_root)
+        assert self.save.started.wait(5)
+        assert self.save.saved == []
+
+        self.save.release.set()
+
+        assert self.writer.flush(timeout=5) is True
+        assert self.save.saved == [aggregate_root]
+
+    def test_coalesces_pending_saves_per_id(self):
+        self.writer.submit(Mock(id=0))
+        assert self.save.started.wait(5)
+        versions = [Mock(id=1) for _ in range(3)]
+        for aggregate_root in versions:
+            self.writer.submit(aggregate_root)
+        assert len(self.writer) == 1
+
+        self.save.release.set()
+        self.writer.flush(timeout=5)
+
+        assert self.save.saved[1:] == [versions[-1]]
+
+    def test_resaves_id_submitted_while_in_flight(self):
+        first, second = Mock(id=1), Mock(id=1)
+        self.writer.submit(first)
+        assert self.save.started.wait(5)
+        self.writer.submit(second)
+
+        self.save.release.set()
+        self.writer.flush(timeout=5)
+
+        assert self.save.saved == [first, second]
+
+    def test_discard_drops_pending_save(self):
+        self.writer.submit(Mock(id=0))
+        assert self.save.started.wait(5)
+        self.writer.submit(Mock(id=1))
+
+        self.writer.discard(1)
+        self.save.release.set()
+        self.writer.flush(timeout=5)
+
+        assert [a.id for a in self.save.saved] == [0]
+
+    def test_failed_save_is_handed_to_on_error(self):
+        error = ValueError()
+        writer = SnapshotWriter(Mock(side_effect=error), on_error=self.on_error)
+        aggregate_root = Mock(id=1)
+
+        writer.submit(aggregate_root)
+        writer.close(timeout=5)
+
+        self.on_error.assert_called_once_with(aggregate_root, error)
+
+    def test_close_writes_pending_saves(self):
+        self.writer.submit(Mock(id=1))
+        self.save.release.set()
+
+        self.writer.close(timeout=5)
+
+        assert len(self.save.saved) == 1
@@ -0,0 +1,82 @@
+from unittest.mock import Mock
+
+from eventsourcing_helpers.models import AggregateRoot
+from eventsourcing_helpers.repository.cache import AggregateCache
+
+
+def create_aggregate_root(id, data=None):
+    aggregate_root = AggregateRoot()
+    aggregate_root.id = id
+    aggregate_root.data = data
+    return aggregate_root
+
+
+class AggregateCacheTests:
+    def setup_method(self):
+        self.cache = AggregateCache(max_entries=2)
+        self.aggregate_root = create_aggregate_root("1")
+
+    def test_pop_returns_cached_aggregate_root(self):
+        self.cache.put(self.aggregate_root, "commands", 0, 10)
+
+        assert self.cache.pop("1", "commands", 0, 11) is self.aggregate_root
+        assert "1" not in self.cache
+
+    def test_aggregate_root_without_id_is_not_cached(self):
+        self.cache.put(create_aggregate_root(None), "commands", 0, 10)
+
+        assert len(self.cache) == 0
+
+    def test_pop_missing(self):
+        assert self.cache.pop("1", "commands", 0, 11) is None
+
+    def test_pop_stale_offset(self):
+        self.cache.put(self.aggregate_root, "commands", 0, 10)
+
+        assert self.cache.pop("1", "commands", 0, 10) is None
+        assert "1" not in self.cache
+
+    def test_pop_other_partition(self):
+        self.cache.put(self.aggregate_root, "commands", 0, 10)
+        assert self.cache.pop("1", "commands", 1, 11) is None
+
+    def test_max_entries_evicts_least_recently_used(self):
+        for id in "123":
+            self.cache.put(create_aggregate_root(id), "commands", 0, 10)
+
+        assert len(self.cache) == 2
+        assert "1" not in self.cache
+
+    def test_max_bytes(self):
+        cache = AggregateCache(max_bytes=2000)
+        cache.put(create_aggregate_root("1", data="a" * 1000), "commands", 0, 1)
+        cache.put(create_aggregate_root("2", data="b" * 1000), "commands", 0, 2)
+
+        assert "1" not in cache
+        assert "2" in cache
+        assert 1000 < cache.size <= 2000
+
+    def test_too_large_aggregate_root_is_not_cached(self):
+        cache = AggregateCache(max_bytes=100)
+        cache.put(create_aggregate_root("1", data="a" * 1000), "commands", 0, 1)
+        assert len(cache) == 0
+
+    def test_revoke(self):
+        self.cache.put(create_aggregate_root("1"), "commands", 0, 1)
+        self.cache.put(create_aggregate_root("2"), "commands", 1, 1)
+
+        self.cache.revoke([("commands", 0)])
+
+        assert "1" not in self.cache
+        assert "2" in self.cache
+
+    def test_discard(self):
+        self.cache.put(self.aggregate_root, "commands", 0, 1)
+        self.cache.discard("1")
+        self.cache.discard("2")
+        assert len(self.cache) == 0
+
+    def test_clear(self):
+        self.cache.put(Mock(id="1"), "commands", 0, 1)
+        self.cache.clear()
+        assert len(self.cache) == 0
@@ -0,0 +1,55 @@
+import threading
+from unittest.mock import Mock
+
+from eventsourcing_helpers.repository.prefetch import AggregatePrefetcher
+
+
+class AggregatePrefetcherTests:
+    def setup_method(self):
+        self.load = Mock(side_effect=lambda id, message: Mock(id=id))
+        self.prefetcher = AggregatePrefetcher(self.load, workers=2)
+
+    def teardown_method(self):
+        self.prefetcher.close()
+
+    def test_get_prefetched(self):
+        self.prefetcher.prefetch("1", "message")
+        self.prefetcher.prefetch("1", "message")
+
+        assert self.prefetcher.get("1", "message").id == "1"
+        self.load.assert_called_once_with("1", "message")
+        assert len(self.prefetcher) == 0
+
+    def test_get_loads_when_not_prefetched(self):
+        assert self.prefetcher.get("1", "message").id == "1"
+        self.load.assert_called_once_with("1", "message")
+
+    def test_get_loads_again_when_prefetch_failed(self):
+        self.load.side_effect = [ValueError, Mock(id="1")]
+        self.prefetcher.prefetch("1", "message")
+
+        assert self.prefetcher.get("1", "message").id == "1"
+        assert self.load.call_count == 2
+
+    def test_invalidate(self):
+        self.prefetcher.prefetch("1", "message")
+        self.prefetcher.invalidate("1")
+
+        assert "1" not in self.prefetcher
+        self.prefetcher.get("1", "message")
+        assert self.load.call_count in (1, 2)
+
+    def test_loads_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def load(id, message):
+            barrier.wait()
+            return Mock(id=id)
+
+        prefetcher = AggregatePrefetcher(load, workers=2)
+        prefetcher.prefetch("1", "message")
+        prefetcher.prefetch("2", "message")
+
+        assert prefetcher.get("1", "message").id == "1"
+        assert prefetcher.get("2", "message").id == "2"
+        prefetcher.close()
@@ -40,7 +40,7 @@ class RepositoryTests:
         assert aggregate_root is not None
 
     def test_should_load_aggr_root_from_snapshot_storage(self, snapshot_mock):
-        snapshot = snapshot_mock(return_value=Mock())
+        snapshot = snapshot_mock(return_value=Mock(_offset=None))
         repository = self.repository(snapshot=snapshot)
         aggregate_root = repository.load(id=1)
 
@@ -83,3 +83,163 @@ class RepositoryTests:
 
             assert repository.snapshot.save.called is True
             assert repository.snapshot.delete.called is True
+
+    def test_load_should_drop_meta_when_replay_meta_is_disabled(self):
+        message_deserializer = Mock(side_effect=lambda e, **kwargs: e)
+        repository = self.repository(
+            config={**self.config, "replay_meta": False}, message_deserializer=message_deserializer
+        )
+        repository.load(id=1)
+
+        message_deserializer.assert_called_with(3, is_new=False, include_meta=False)
+
+    def test_load_should_replay_events_after_snapshot(self, snapshot_mock):
+        aggregate_root = Mock(id=1, _offset=10)
+        snapshot = snapshot_mock(return_value=aggregate_root)
+        events = [Mock(_meta=Mock(offset=offset)) for offset in (11, 12)]
+        repository = self.repository(snapshot=snapshot)
+        repository.backend.get_events.return_value = events
+
+        assert repository.load(id=1) is aggregate_root
+
+        repository.backend.get_events.assert_called_once_with(1, max_offset=None, min_offset=11)
+        applied, *_ = aggregate_root._apply_events.call_args.args
+        assert list(applied) == events
+        assert aggregate_root._offset == 12
+
+    def test_commit_should_save_snapshot_with_last_offset(self, aggregate_root_cls_mock):
+        aggregate_root = aggregate_root_cls_mock(exhaust_events=False)
+        aggregate_root.id = 1
+        repository = self.repository(aggregate_root_cls=aggregate_root)
+        repository.backend.commit.return_value = [4, 5]
+
+        def save(aggregate_root):
+            assert aggregate_root._offset == 5
+
+        repository.snapshot.save.side_effect = save
+        repository.commit(aggregate_root)
+
+        repository.snapshot.save.assert_called_once_with(aggregate_root)
+
+    def test_commit_should_not_fail_when_snapshot_save_fails(self, aggregate_root_cls_mock):
+        aggregate_root = aggregate_root_cls_mock(exhaust_events=False)
+        aggregate_root.id = 1
+        repository = self.repository(aggregate_root_cls=aggregate_root)
+        repository.snapshot.save.side_effect = ValueError
+
+        repository.commit(aggregate_root)
+
+        assert repository.backend.commit.called is True
+
+    def test_commit_should_skip_snapshot_until_policy_is_met(self, aggregate_root_cls_mock):
+        aggregate_root = aggregate_root_cls_mock(exhaust_events=False)
+        aggregate_root.id = 1
+        aggregate_root._events = [1, 2, 3]
+        aggregate_root._snapshot_stats = None
+        config = {**self.config, "snapshot_policy": {"every_n_events": 5}}
+        repository = self.repository(config=config, aggregate_root_cls=aggregate_root)
+
+        repository.commit(aggregate_root)
+        assert repository.snapshot.save.called is False
+        assert aggregate_root._snapshot_stats["events"] == 3
+        assert repository.backend.commit.call_args.kwargs["wait_for_offsets"] is False
+
+        repository.commit(aggregate_root)
+        repository.snapshot.save.assert_called_once_with(aggregate_root)
+        assert aggregate_root._snapshot_stats["events"] == 0
+        assert repository.backend.commit.call_args.kwargs["wait_for_offsets"] is True
+
+    def test_commit_should_not_wait_for_offsets_without_snapshots(self, aggregate_root_cls_mock):
+        aggregate_root = aggregate_root_cls_mock(exhaust_events=False)
+        aggregate_root.id = 1
+        repository = self.repository(aggregate_root_cls=aggregate_root)
+        repository.snapshot.enabled = False
+
+        repository.commit(aggregate_root)
+
+        assert repository.backend.commit.call_args.kwargs["wait_for_offsets"] is False
+        repository.snapshot.save.assert_called_once_with(aggregate_root)
+
+    def test_commit_should_replace_snapshot_without_offset(self, aggregate_root_cls_mock):
+        aggregate_root = aggregate_root_cls_mock(exhaust_events=False)
+        aggregate_root.id = 1
+        aggregate_root._events = [1, 2, 3]
+        aggregate_root._snapshot_stats = None
+        aggregate_root._offset = None
+        config = {**self.config, "snapshot_policy": {"every_n_events": 5}}
+        repository = self.repository(config=config, aggregate_root_cls=aggregate_root)
+        repository.backend.commit.return_value = [4, 5, 6]
+
+        repository.commit(aggregate_root)
+
+        repository.snapshot.save.assert_called_once_with(aggregate_root)
+        assert repository.backend.commit.call_args.kwargs["wait_for_offsets"] is True
+        assert aggregate_root._offset == 6
+
+        repository.commit(aggregate_root)
+        repository.snapshot.save.assert_called_once_with(aggregate_root)
+
+    def test_commit_without_offsets_should_always_save_snapshot(self, aggregate_root_cls_mock):
+        aggregate_root = aggregate_root_cls_mock(exhaust_events=False)
+        aggregate_root.id = 1
+        aggregate_root._events = [1, 2, 3]
+        aggregate_root._snapshot_stats = None
+        aggregate_root._offset = 3
+        config = {**self.config, "snapshot_policy": {"every_n_events": 3}}
+        repository = self.repository(config=config, aggregate_root_cls=aggregate_root)
+        repository.backend.commit.return_value = None
+
+        repository.commit(aggregate_root)
+        assert aggregate_root._offset is None
+
+        repository.commit(aggregate_root)
+        repository.commit(aggregate_root)
+        assert repository.snapshot.save.call_count == 3
+
+    def test_failed_snapshot_save_should_delete_snapshot(self, aggregate_root_cls_mock):
+        aggregate_root = aggregate_root_cls_mock(exhaust_events=False)
+        aggregate_root.id = 1
+        repository = self.repository(aggregate_root_cls=aggregate_root)
+        repository.snapshot.save.side_effect = ValueError
+
+        repository.commit(aggregate_root)
+
+        repository.snapshot.delete.assert_called_once_with(aggregate_root)
+
+    def test_load_should_count_replayed_events(self):
+        repository = self.repository()
+        aggregate_root = repository.load(id=1)
+
+        assert aggregate_root._snapshot_stats["events"] == 3
+        assert aggregate_root._snapshot_stats["replay_seconds"] >= 0
+
+    def test_failed_snapshot_save_should_keep_stats(self, aggregate_root_cls_mock):
+        aggregate_root = aggregate_root_cls_mock(exhaust_events=False)
+        aggregate_root.id = 1
+        aggregate_root._events = [1, 2, 3]
+        aggregate_root._snapshot_stats = {"events": 7}
+        repository = self.repository(aggregate_root_cls=aggregate_root)
+        repository.snapshot.save.side_effect = ValueError
+
+        repository.commit(aggregate_root)
+
+        assert aggregate_root._snapshot_stats["events"] == 10
+
+    def test_load_many_should_replay_snapshot_misses_and_tails(self, snapshot_mock):
+        snapshot = snapshot_mock(return_value=None)
+        with_tail, without_tail = Mock(id=1, _offset=10), Mock(id=2, _offset=None)
+        snapshot.return_value.load_many.return_value = {1: with_tail, 2: without_tail}
+        repository = self.repository(snapshot=snapshot)
+
+        aggregate_roots = repository.load_many([3, 1, 2, 3])
+
+        assert list(aggregate_roots) == [3, 1, 2]
+        assert aggregate_roots[1] is with_tail
+        assert aggregate_roots[2] is without_tail
+        repository.snapshot.load_many.assert_called_once()
+        repository.backend.get_events.assert_any_call(3, max_offset=None)
+        repository.backend.get_events.assert_any_call(1, max_offset=None, min_offset=11)
+        assert repository.backend.get_events.call_count == 2
+
+    def test_load_many_without_ids(self):
+        assert self.repository().load_many([]) == {}
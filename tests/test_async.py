@@ -0,0 +1,165 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+
+import pytest
+
+from eventsourcing_helpers import metrics
+from eventsourcing_helpers.command_handler import AsyncCommandHandler
+from eventsourcing_helpers.event_handler import AsyncEventHandler, batch_handler
+from eventsourcing_helpers.handler import HandlerRoute
+from eventsourcing_helpers.messagebus.backends.kafka import KafkaAvroBackend
+from eventsourcing_helpers.messagebus.backends.kafka.parallel import AsyncDispatcher
+from eventsourcing_helpers.messagebus.backends.mock.backend import MockBackend
+from eventsourcing_helpers.middleware import compose, count_errors, timed
+from eventsourcing_helpers.tracing import TraceSampler
+
+
+def create_message(offset, key=None, partition=0, topic="events"):
+    return Mock(_meta=Mock(topic=topic, partition=partition, offset=offset, key=key))
+
+
+class AsyncHandlerTests:
+    def setup_method(self):
+        self.handled = []
+
+        async def foo_handler(message):
+            await asyncio.sleep(0)
+            self.handled.append(message)
+
+        self.foo_handler = foo_handler
+        self.message = Mock(value={"class": "FooEvent", "data": {}})
+        self.dto = Mock(_class="FooEvent")
+
+    @patch("eventsourcing_helpers.event_handler.tracer.start_span")
+    def test_event_handler(self, mock_start_span):
+        class FooEventHandler(AsyncEventHandler):
+            handlers = {"FooEvent": self.foo_handler}
+
+        handler = FooEventHandler(Mock(return_value=self.dto))
+        asyncio.run(handler.handle(self.message))
+
+        assert self.handled == [self.dto]
+        assert (
+            mock_start_span.call_args_list[0].kwargs["name"] == "eventsourcing_helpers.handle_event"
+        )
+
+    def test_event_handler_unsampled(self):
+        class FooEventHandler(AsyncEventHandler):
+            handlers = {"FooEvent": self.foo_handler}
+            trace_sampler = TraceSampler(ratio=0.0)
+
+        handler = FooEventHandler(Mock(return_value=self.dto))
+        asyncio.run(handler.handle_batch([self.message, self.message]))
+
+        assert self.handled == [self.dto, self.dto]
+
+    def test_event_handler_batch_handler(self):
+        handled = []
+
+        @batch_handler
+        async def foo(events):
+            handled.append(events)
+
+        class FooEventHandler(AsyncEventHandler):
+            handlers = {"FooEvent": foo}
+            trace_sampler = TraceSampler(ratio=0.0)
+
+        handler = FooEventHandler(Mock(return_value=self.dto))
+        asyncio.run(handler.handle(self.message))
+
+        assert handled == [[self.dto]]
+
+    def test_command_handler(self):
+        class FooCommandHandler(AsyncCommandHandler):
+            handlers = {"FooEvent": self.foo_handler}
+
+        handler = FooCommandHandler(message_deserializer=Mock(return_value=self.dto))
+        asyncio.run(handler.handle(self.message))
+
+        assert self.handled == [self.dto]
+
+    @patch("eventsourcing_helpers.middleware.metrics_enabled", return_value=True)
+    @patch.object(metrics, "statsd")
+    def test_middleware_awaits_coroutines(self, mock_statsd, *mocks):
+        handler = AsyncMock(side_effect=ValueError)
+        route = HandlerRoute("FooEvent", handler, None, "handler", ["tag"], handler)
+        call = compose(handler, route, [timed("time"), count_errors("error")])
+
+        with pytest.raises(ValueError):
+            asyncio.run(call("event"))
+
+        mock_statsd.timed.assert_called_once_with("time", tags=["tag"])
+        mock_statsd.increment.assert_called_once_with("error", tags=["tag"])
+
+
+class AsyncDispatcherTests:
+    def test_same_key_is_handled_in_order(self):
+        handled = []
+
+        async def handler(message):
+            await asyncio.sleep(0.001 * (10 - message._meta.offset))
+            handled.append((message._meta.key, message._meta.offset))
+
+        async def dispatch():
+            dispatcher = AsyncDispatcher(handler, max_in_flight=5)
+            for offset in range(10):
+                await dispatcher.submit(create_message(offset, key=f"id-{offset % 3}"))
+            await dispatcher.join()
+            return dispatcher
+
+        dispatcher = asyncio.run(dispatch())
+
+        for key in ("id-0", "id-1", "id-2"):
+            offsets = [offset for k, offset in handled if k == key]
+            assert offsets == sorted(offsets)
+        assert len(handled) == 10
+        assert dispatcher.pop_committable()[0]._meta.offset == 9
+
+    def test_error_stops_handling(self):
+        handler = AsyncMock(side_effect=ValueError)
+
+        async def dispatch():
+            dispatcher = AsyncDispatcher(handler)
+            await dispatcher.submit(create_message(0, key="a"))
+            await dispatcher.submit(create_message(1, key="a"))
+            await dispatcher.join()
+            return dispatcher
+
+        dispatcher = asyncio.run(dispatch())
+
+        assert handler.await_count == 1
+        with pytest.raises(ValueError):
+            dispatcher.raise_for_error()
+
+
+class ConsumeAsyncTests:
+    def test_kafka_backend(self):
+        consumer = MagicMock()
+        kafka_consumer = consumer.return_value.__enter__.return_value
+        messages = [create_message(offset, key=str(offset % 2)) for offset in range(4)]
+        kafka_consumer.__iter__.return_value = iter(messages[:2] + [None] + messages[2:])
+        kafka_consumer.is_auto_commit = False
+        config = {"consumer": {"group.id": "group", "max_in_flight": 2}}
+        backend = KafkaAvroBackend(
+            config,
+            consumer=consumer,
+            get_consumer_config=Mock(return_value=dict(config["consumer"])),
+            get_offset_watchdog_config=Mock(return_value=None),
+        )
+        handler = AsyncMock()
+
+        asyncio.run(backend.consume_async(handler=handler))
+
+        assert handler.await_count == 4
+        assert consumer.call_args.kwargs["config"]["poll_timeout"] == 0
+        (offset,) = kafka_consumer.commit.call_args.kwargs["offsets"]
+        assert offset.offset == 4
+
+    def test_mock_backend(self):
+        backend = MockBackend(config={"consumer": {}})
+        backend.consumer.add_message(key="a", value={"class": "a", "data": {}})
+        handler = AsyncMock()
+
+        asyncio.run(backend.consume_async(handler=handler))
+
+        assert handler.await_count == 1
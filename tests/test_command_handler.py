@@ -3,12 +3,18 @@ from unittest.mock import MagicMock, Mock, call, patch
 
 import pytest
 
-from eventsourcing_helpers.command_handler import CommandHandler, ESCommandHandler
+from eventsourcing_helpers.command_handler import (
+    CommandHandler,
+    ESCommandHandler,
+    get_message_position,
+)
+from eventsourcing_helpers.handler import BatchError
 
 module = "eventsourcing_helpers.command_handler"
 
 command_class, id = "FooCommand", "1"
-message = Mock(value={"class": command_class, "data": {"id": id}})
+command_message_value = {"class": command_class, "data": {"id": id}}
+message = Mock(value=command_message_value)
 events = [1, 2, 3]
 
 command = Mock()
@@ -53,7 +59,7 @@ class ESCommandHandlerTests:
 
         self.handler.handle(message)
 
-        self.message_deserializer.assert_called_once_with(message)
+        self.message_deserializer.assert_called_once_with(message, deserialize_class=None)
         mock_can_handle.assert_called_once_with(message)
         mock_get.assert_called_once_with(command.id)
         mock_handle.assert_called_once_with(command, handler_inst=self.aggregate_root)
@@ -100,6 +106,186 @@ class ESCommandHandlerTests:
         self.handler._handle_command(command, handler_inst=self.aggregate_root)
         self.aggregate_root.foo_method.assert_called_once_with(self.aggregate_root, command)
 
+    def create_messages(self, *ids):
+        messages = [Mock(value={"class": command_class, "data": {"id": id}}) for id in ids]
+        commands = {m: Mock(_class=command_class, id=id) for m, id in zip(messages, ids)}
+        self.message_deserializer.side_effect = lambda m, **kwargs: commands[m]
+        return messages
+
+    @patch(f"{module}.ESCommandHandler._commit_staged_events")
+    @patch(f"{module}.ESCommandHandler._handle_command")
+    @patch(f"{module}.ESCommandHandler._get_aggregate_root")
+    def test_handle_batch_groups_by_id(self, mock_get, mock_handle, mock_commit):
+        aggregate_roots = {"1": Mock(id="1"), "2": Mock(id="2")}
+        mock_get.side_effect = lambda id: aggregate_roots[id]
+        messages = self.create_messages("1", "2", "1", "1")
+
+        self.handler.handle_batch(messages)
+
+        assert mock_get.call_args_list == [call("1"), call("2")]
+        assert [(c.args[0].id, c.kwargs["handler_inst"]) for c in mock_handle.call_args_list] == [
+            ("1", aggregate_roots["1"]),
+            ("1", aggregate_roots["1"]),
+            ("1", aggregate_roots["1"]),
+            ("2", aggregate_roots["2"]),
+        ]
+        assert mock_commit.call_args_list == [
+            call(aggregate_roots["1"]),
+            call(aggregate_roots["2"]),
+        ]
+
+    @patch(f"{module}.ESCommandHandler.handle")
+    @patch(f"{module}.ESCommandHandler._commit_staged_events")
+    @patch(f"{module}.ESCommandHandler._handle_command")
+    @patch(f"{module}.ESCommandHandler._get_aggregate_root")
+    def test_handle_batch_falls_back_on_error(
+        self, mock_get, mock_handle, mock_commit, mock_single_handle
+    ):
+        mock_get.return_value = self.aggregate_root
+        mock_handle.side_effect = [None, TypeError]
+        messages = self.create_messages("1", "1", "1")
+
+        self.handler.handle_batch(messages)
+
+        mock_commit.assert_not_called()
+        self.aggregate_root._clear_staged_events.assert_called_once_with()
+        self.handler.repository.snapshot.delete.assert_called_once_with(self.aggregate_root)
+        assert mock_single_handle.call_args_list == [call(m) for m in messages]
+
+    @patch(f"{module}.ESCommandHandler.handle")
+    @patch(f"{module}.ESCommandHandler._commit_staged_events")
+    @patch(f"{module}.ESCommandHandler._handle_command")
+    @patch(f"{module}.ESCommandHandler._get_aggregate_root")
+    def test_handle_batch_reports_unhandled_messages(
+        self, mock_get, mock_handle, mock_commit, mock_single_handle
+    ):
+        aggregate_roots = {"1": Mock(id="1"), "2": Mock(id="2"), "3": Mock(id="3")}
+        mock_get.side_effect = lambda id: aggregate_roots[id]
+        mock_handle.side_effect = [None, None, TypeError]
+        mock_single_handle.side_effect = [None, ValueError]
+        messages = self.create_messages("1", "2", "1", "3", "2")
+
+        with pytest.raises(BatchError) as e:
+            self.handler.handle_batch(messages)
+
+        assert isinstance(e.value.__cause__, ValueError)
+        assert e.value.unhandled == [messages[4], messages[3]]
+        mock_commit.assert_called_once_with(aggregate_roots["1"])
+        assert mock_single_handle.call_args_list == [call(messages[1]), call(messages[4])]
+
+    def test_handle_uses_aggregate_cache(self):
+        class CachedCommandHandler(ESCommandHandler):
+            aggregate_cache_config = {"max_entries": 10}
+
+        handler = CachedCommandHandler(
+            message_deserializer=self.message_deserializer, repository=self.repository
+        )
+        aggregate_root = Mock(id=id)
+        handler.repository.load.return_value = aggregate_root
+
+        for offset in (1, 2):
+            message = Mock(value=command_message_value, _meta=Mock(topic="t", partition=0))
+            message._meta.offset = offset
+            handler.handle(message)
+
+        handler.repository.load.assert_called_once_with(id)
+        assert handler.repository.commit.call_count == 2
+        assert id in handler.aggregate_cache
+
+        handler.on_revoke([("t", 0)])
+        assert id not in handler.aggregate_cache
+        handler.repository.snapshot.flush.assert_called_once_with()
+
+    def test_handle_evicts_aggregate_cache_on_error(self):
+        class CachedCommandHandler(ESCommandHandler):
+            aggregate_cache_config = {"max_entries": 10}
+
+        handler = CachedCommandHandler(
+            message_deserializer=self.message_deserializer, repository=self.repository
+        )
+        handler.aggregate_cache.put(Mock(id=id), "t", 0, 1)
+        self.aggregate_root.foo_method.side_effect = TypeError
+        message = Mock(value=command_message_value, _meta=Mock(topic="t", partition=0, offset=2))
+
+        with pytest.raises(TypeError):
+            handler.handle(message)
+
+        assert id not in handler.aggregate_cache
+
+    def create_idempotent_handler(self):
+        class IdempotentCommandHandler(ESCommandHandler):
+            idempotency_config = {"key_header": "command_id"}
+
+        return IdempotentCommandHandler(
+            message_deserializer=self.message_deserializer, repository=self.repository
+        )
+
+    def test_handle_skips_duplicate_command(self):
+        handler = self.create_idempotent_handler()
+        message = Mock(value=command_message_value, _meta=Mock(headers={"command_id": "c1"}))
+
+        handler.handle(message)
+        handler.handle(message)
+
+        handler.repository.load.assert_called_once_with(id)
+        handler.repository.commit.assert_called_once()
+
+    def test_handle_does_not_mark_failed_command(self):
+        handler = self.create_idempotent_handler()
+        message = Mock(value=command_message_value, _meta=Mock(headers={"command_id": "c1"}))
+        self.aggregate_root.foo_method.side_effect = [TypeError, None]
+
+        with pytest.raises(TypeError):
+            handler.handle(message)
+        handler.handle(message)
+
+        handler.repository.commit.assert_called_once()
+
+    @patch(f"{module}.ESCommandHandler._commit_staged_events")
+    @patch(f"{module}.ESCommandHandler._handle_command")
+    @patch(f"{module}.ESCommandHandler._get_aggregate_root")
+    def test_handle_batch_skips_duplicate_commands(self, mock_get, mock_handle, mock_commit):
+        handler = self.create_idempotent_handler()
+        messages = self.create_messages("1", "1", "1")
+        for message, command_id in zip(messages, ("c1", "c2", "c1")):
+            message._meta = Mock(headers={"command_id": command_id})
+
+        handler.handle_batch(messages)
+        handler.handle_batch(messages)
+
+        assert mock_handle.call_count == 2
+        mock_get.assert_called_once_with("1")
+
+    @patch(f"{module}.ESCommandHandler._commit_staged_events")
+    @patch(f"{module}.ESCommandHandler._handle_command")
+    def test_handle_batch_prefetches_aggregate_roots(self, mock_handle, mock_commit):
+        class PrefetchingCommandHandler(ESCommandHandler):
+            prefetch_config = {"workers": 2, "lookahead": 2}
+
+        handler = PrefetchingCommandHandler(
+            message_deserializer=self.message_deserializer, repository=self.repository
+        )
+        aggregate_roots = {id: Mock(id=id) for id in "123"}
+        handler.repository.load.side_effect = aggregate_roots.get
+        messages = self.create_messages("1", "2", "1", "3")
+
+        handler.handle_batch(messages)
+        handler.prefetcher.close()
+
+        assert sorted(c.args[0] for c in handler.repository.load.call_args_list) == ["1", "2", "3"]
+        assert [c.args[0] for c in mock_commit.call_args_list] == [
+            aggregate_roots["1"],
+            aggregate_roots["2"],
+            aggregate_roots["3"],
+        ]
+        assert len(handler.prefetcher) == 0
+
+
+def test_get_message_position():
+    assert get_message_position(Mock(_meta=Mock(topic="t", partition=0, offset=2))) == ("t", 0, 2)
+    assert get_message_position(Mock(_meta=Mock(topic=None, partition=0, offset=2))) is None
+    assert get_message_position(Mock(_meta=Mock(topic="t", partition=0, offset=None))) is None
+
 
 class CommandHandlerTests:
     def setup_method(self):
@@ -126,7 +312,7 @@ class CommandHandlerTests:
         mock_can_handle.return_value = True
         self.handler.handle(message)
 
-        self.message_deserializer.assert_called_once_with(message)
+        self.message_deserializer.assert_called_once_with(message, deserialize_class=None)
         mock_can_handle.assert_called_once_with(message)
         mock_handle.assert_called_once_with(command)
 
@@ -1,6 +1,16 @@
+import asyncio
+import threading
 from unittest.mock import MagicMock, Mock, call, patch
 
-from eventsourcing_helpers.event_handler import EventHandler
+import pytest
+
+from eventsourcing_helpers.event_handler import (
+    AsyncFanOutEventHandler,
+    EventHandler,
+    FanOutEventHandler,
+    HandlerErrors,
+    batch_handler,
+)
 
 module = "eventsourcing_helpers.event_handler"
 
@@ -81,6 +91,32 @@ class EventHandlerTests:
         can_handle = handler._can_handle_command(message)
         assert can_handle is True
 
+    def test_routes_are_built_once(self):
+        """
+        Test that string and class keys are normalized into one routing table.
+        """
+
+        class BarEvent:
+            pass
+
+        handler_cls = EventHandler
+        handler_cls.handlers = {FooEvent: Mock(), "FooEvent": self.event_handler, BarEvent: Mock()}
+        handler = handler_cls(self.message_deserializer)
+
+        assert set(handler._routes) == {"FooEvent", "BarEvent"}
+        assert handler._find_handler("FooEvent") == (self.event_handler, None)
+        assert handler._find_handler("BarEvent")[1] is BarEvent
+        assert handler._find_handler("BazEvent") == (None, None)
+        assert handler._routes["FooEvent"].tags == [
+            "message_type:event",
+            "message_class:FooEvent",
+            "handler:event_handler",
+        ]
+
+    def test_can_handle_class(self):
+        assert self.handler.can_handle_class("FooEvent") is True
+        assert self.handler.can_handle_class("BarEvent") is False
+
     @patch(f"{module}.tracer.start_span")
     @patch(f"{module}.EventHandler._can_handle_command")
     def test_handle_adds_tracing(self, mock_can_handle, mock_start_span):
@@ -108,3 +144,218 @@ class EventHandlerTests:
                 call().__exit__(None, None, None),
             ]
         )
+
+
+class CoalescingEventHandlerTests:
+    def setup_method(self):
+        self.handled = []
+        handled = self.handled
+
+        def foo(event):
+            handled.append(("FooEvent", event.key, event.offset))
+
+        def bar(event):
+            handled.append(("BarEvent", event.key, event.offset))
+
+        class CoalescingEventHandler(EventHandler):
+            handlers = {"FooEvent": foo, "BarEvent": bar}
+            coalesce_events = True
+
+        self.handler_cls = CoalescingEventHandler
+
+    def create_handler(self):
+        def deserialize(message, **kwargs):
+            return Mock(key=message._meta.key, offset=message._meta.offset)
+
+        return self.handler_cls(message_deserializer=deserialize)
+
+    def create_messages(self, *items):
+        return [
+            Mock(value={"class": event_class}, _meta=Mock(key=key, offset=offset))
+            for offset, (event_class, key) in enumerate(items)
+        ]
+
+    def test_handles_last_event_per_key_and_class(self):
+        messages = self.create_messages(
+            ("FooEvent", "a"),
+            ("FooEvent", "b"),
+            ("BarEvent", "a"),
+            ("FooEvent", "a"),
+            ("FooEvent", None),
+            ("FooEvent", None),
+        )
+
+        self.create_handler().handle_batch(messages)
+
+        assert self.handled == [
+            ("FooEvent", "b", 1),
+            ("BarEvent", "a", 2),
+            ("FooEvent", "a", 3),
+            ("FooEvent", None, 4),
+            ("FooEvent", None, 5),
+        ]
+
+    def test_reduces_events(self):
+        self.handler_cls.coalesce_reducer = lambda events: Mock(
+            key=events[0].key, offset=sum(e.offset for e in events)
+        )
+        messages = self.create_messages(("FooEvent", "a"), ("FooEvent", "b"), ("FooEvent", "a"))
+
+        self.create_handler().handle_batch(messages)
+
+        assert self.handled == [("FooEvent", "b", 1), ("FooEvent", "a", 2)]
+
+    def test_handles_all_events_when_disabled(self):
+        self.handler_cls.coalesce_events = False
+        messages = self.create_messages(("FooEvent", "a"), ("FooEvent", "a"))
+
+        self.create_handler().handle_batch(messages)
+
+        assert len(self.handled) == 2
+
+
+class FanOutEventHandlerTests:
+    def setup_method(self):
+        self.message = Mock(value={"class": "FooEvent", "data": {}})
+        self.event = Mock(_class="FooEvent")
+        self.message_deserializer = Mock(return_value=self.event)
+
+    def create_handler(self, handler_cls, *callables):
+        class FooEventHandler(handler_cls):
+            handlers = {"FooEvent": list(callables)}
+
+        return FooEventHandler(self.message_deserializer)
+
+    def test_calls_all_handlers_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+        handlers = [Mock(side_effect=lambda event: barrier.wait()) for _ in range(3)]
+        handler = self.create_handler(FanOutEventHandler, *handlers)
+
+        handler.handle(self.message)
+        handler.close()
+
+        self.message_deserializer.assert_called_once()
+        for h in handlers:
+            h.assert_called_once_with(self.event)
+
+    def test_aggregates_errors(self):
+        ok = Mock()
+        handler = self.create_handler(
+            FanOutEventHandler, Mock(side_effect=ValueError), ok, Mock(side_effect=KeyError)
+        )
+
+        with pytest.raises(HandlerErrors) as e:
+            handler.handle(self.message)
+        handler.close()
+
+        ok.assert_called_once_with(self.event)
+        assert [type(error) for _, error in e.value.errors] == [ValueError, KeyError]
+
+    def test_single_handler(self):
+        foo = MagicMock(__name__="foo")
+
+        class FooEventHandler(FanOutEventHandler):
+            handlers = {"FooEvent": foo}
+
+        handler = FooEventHandler(self.message_deserializer)
+        handler.handle(self.message)
+
+        foo.assert_called_once_with(self.event)
+        assert handler._routes["FooEvent"].handler is foo
+
+    def test_async_handlers(self):
+        handled = []
+
+        async def foo(event):
+            await asyncio.sleep(0)
+            handled.append("foo")
+
+        async def bar(event):
+            raise ValueError
+
+        handler = self.create_handler(AsyncFanOutEventHandler, foo, bar)
+
+        with pytest.raises(HandlerErrors) as e:
+            asyncio.run(handler.handle(self.message))
+
+        assert handled == ["foo"]
+        assert e.value.errors[0][1].__class__ is ValueError
+
+    def test_async_runs_sync_handlers_on_pool(self):
+        threads = {}
+
+        async def foo(event):
+            threads["foo"] = threading.current_thread()
+
+        def bar(event):
+            threads["bar"] = threading.current_thread()
+
+        handler = self.create_handler(AsyncFanOutEventHandler, foo, bar)
+        asyncio.run(handler.handle(self.message))
+        handler.close()
+
+        assert threads["foo"] is threading.main_thread()
+        assert threads["bar"] is not threading.main_thread()
+
+    def test_sync_rejects_coroutine_handlers(self):
+        async def foo(event):
+            pass
+
+        with pytest.raises(AssertionError):
+            self.create_handler(FanOutEventHandler, Mock(__name__="bar"), foo)
+
+    def test_rejects_batch_handlers(self):
+        @batch_handler
+        def foo(events):
+            pass
+
+        with pytest.raises(AssertionError):
+            self.create_handler(FanOutEventHandler, Mock(__name__="bar"), foo)
+
+
+class BatchEventHandlerTests:
+    def setup_method(self):
+        self.calls = []
+        calls = self.calls
+
+        @batch_handler
+        def foo(events):
+            calls.append(("foo", [e.offset for e in events]))
+
+        def bar(event):
+            calls.append(("bar", event.offset))
+
+        class BatchEventHandler(EventHandler):
+            handlers = {"FooEvent": foo, "BarEvent": bar}
+
+        def deserialize(message, **kwargs):
+            return Mock(offset=message._meta.offset)
+
+        self.handler = BatchEventHandler(message_deserializer=deserialize)
+
+    def create_messages(self, *event_classes, key=None):
+        return [
+            Mock(value={"class": event_class}, _meta=Mock(key=key, offset=offset))
+            for offset, event_class in enumerate(event_classes)
+        ]
+
+    def test_handle_batch_passes_events_of_same_class(self):
+        messages = self.create_messages("FooEvent", "BarEvent", "FooEvent", "BazEvent")
+
+        self.handler.handle_batch(messages)
+
+        assert self.calls == [("bar", 1), ("foo", [0, 2])]
+
+    def test_handle_batch_keeps_order_per_key(self):
+        messages = self.create_messages("FooEvent", "FooEvent", "BarEvent", "FooEvent", key="a")
+
+        self.handler.handle_batch(messages)
+
+        assert self.calls == [("foo", [0, 1]), ("bar", 2), ("foo", [3])]
+
+    def test_handle_calls_batch_handler_with_one_event(self):
+        (message,) = self.create_messages("FooEvent")
+
+        self.handler.handle(message)
+
+        assert self.calls == [("foo", [0])]
@@ -0,0 +1,103 @@
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+import fakeredis
+
+from eventsourcing_helpers.idempotency import IdempotencyStore
+from eventsourcing_helpers.idempotency.backends.memory import (
+    BloomFilter,
+    InMemoryIdempotencyBackend,
+)
+from eventsourcing_helpers.idempotency.backends.null import NullIdempotencyBackend
+from eventsourcing_helpers.idempotency.backends.redis import RedisIdempotencyBackend
+
+
+class BloomFilterTests:
+    def test_added_keys_are_contained(self):
+        bloom = BloomFilter(capacity=1000)
+        keys = [f"key-{i}" for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+
+        assert all(key in bloom for key in keys)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"key-{i}")
+
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        assert false_positives < 300
+
+
+class IdempotencyBackendTests:
+    def test_null_backend(self):
+        backend = NullIdempotencyBackend(config={})
+        backend.set_seen("a")
+        assert not backend.seen("a")
+
+    def test_memory_backend(self):
+        backend = InMemoryIdempotencyBackend(config={"max_entries": 2})
+        backend.set_seen("a")
+        backend.set_seen("b")
+        assert backend.seen("a")
+
+        backend.set_seen("c")
+        assert backend.seen("a")
+        assert not backend.seen("b")
+        assert backend.seen("c")
+        assert len(backend) == 2
+
+    def test_memory_backend_rebuilds_bloom_filter(self):
+        backend = InMemoryIdempotencyBackend(config={"max_entries": 10})
+        for i in range(25):
+            backend.set_seen(str(i))
+
+        assert backend._bloom.count < 20
+        assert all(backend.seen(str(i)) for i in range(15, 25))
+
+    @patch("eventsourcing_helpers.idempotency.backends.redis.StrictRedis")
+    def test_redis_backend(self, mock_redis):
+        redis = fakeredis.FakeStrictRedis()
+        mock_redis.from_url.return_value = redis
+        backend = RedisIdempotencyBackend(config={"url": "redis://localhost", "ttl": 60})
+
+        assert not backend.seen("a")
+        backend.set_seen("a")
+        assert backend.seen("a")
+        assert 0 < redis.ttl("idempotency:a") <= 60
+
+
+class IdempotencyStoreTests:
+    def setup_method(self):
+        self.command = Mock(_class="FooCommand", command_id="c1")
+
+    def test_default_backend_configured(self):
+        store = IdempotencyStore(config={})
+        assert isinstance(store.backend, InMemoryIdempotencyBackend)
+
+    def test_get_key_from_header(self):
+        store = IdempotencyStore(config={})
+        message = SimpleNamespace(_meta=SimpleNamespace(headers={"idempotency_key": "h1"}))
+
+        assert store.get_key(message, self.command) == "FooCommand:h1"
+
+    def test_get_key_from_attribute(self):
+        store = IdempotencyStore(config={"key_attribute": "command_id"})
+        message = SimpleNamespace(_meta=SimpleNamespace(headers={}))
+
+        assert store.get_key(message, self.command) == "FooCommand:c1"
+
+    def test_get_key_without_key(self):
+        store = IdempotencyStore(config={})
+        message = SimpleNamespace(_meta=SimpleNamespace(headers={}))
+
+        assert store.get_key(message, self.command) is None
+
+    @patch("eventsourcing_helpers.idempotency.statsd")
+    def test_seen_counts_duplicates(self, mock_statsd):
+        store = IdempotencyStore(config={})
+        store.set_seen("FooCommand:c1")
+
+        assert store.seen("FooCommand:c1")
+        mock_statsd.increment.assert_called_once()
@@ -1,7 +1,14 @@
 from functools import partial
-from unittest.mock import MagicMock, Mock
+from unittest.mock import MagicMock, Mock, patch
 
+import pytest
+from confluent_kafka import TopicPartition
+
+from eventsourcing_helpers.handler import BatchError
 from eventsourcing_helpers.messagebus.backends.kafka import KafkaAvroBackend
+from eventsourcing_helpers.messagebus.backends.kafka.routing import get_routed_message
+
+routing_module = "eventsourcing_helpers.messagebus.backends.kafka.routing"
 
 
 class AvroConsumerMock:
@@ -63,3 +70,179 @@ class KafkaBackendTests:
         handler = Mock()
         backend.consume(handler=handler)
         assert handler.call_count == 1
+
+    def test_consume_batch(self):
+        consumer = MagicMock()
+        message_1, message_2, message_3 = (Mock(_meta=Mock(offset=i)) for i in range(3))
+        messages = [message_1, None, message_2, message_3]
+        consumer.return_value.__enter__.return_value.__iter__.return_value = iter(messages)
+        consumer.return_value.__enter__.return_value.is_auto_commit = True
+        config = {"consumer": {"group.id": "consumer.group.1", "batch_size": 2}}
+        backend = KafkaAvroBackend(
+            config,
+            consumer=consumer,
+            get_consumer_config=Mock(return_value=dict(config["consumer"])),
+        )
+        batches = []
+
+        backend.consume_batch(handler=batches.append)
+
+        assert batches == [[message_1, message_2], [message_3]]
+        assert consumer.call_args.kwargs["config"]["non_blocking"] is True
+        assert "batch_size" not in consumer.call_args.kwargs["config"]
+
+    def test_consume_batch_handles_pending_batch_on_revoke(self):
+        consumer = MagicMock()
+        kafka_consumer = consumer.return_value.__enter__.return_value
+        kafka_consumer.is_auto_commit = True
+        message_1, message_2 = (Mock(_meta=Mock(offset=i)) for i in range(2))
+        config = {"consumer": {"group.id": "consumer.group.1", "batch_size": 10}}
+        backend = KafkaAvroBackend(
+            config,
+            consumer=consumer,
+            get_consumer_config=Mock(return_value=dict(config["consumer"])),
+        )
+        batches, on_revoke = [], Mock()
+
+        def messages():
+            yield message_1
+            # partitions are revoked while polling for the next message
+            _, kwargs = kafka_consumer.subscribe.call_args
+            kwargs["on_revoke"](kafka_consumer, [Mock(topic="t", partition=1)])
+            on_revoke.assert_called_once_with([("t", 1)])
+            assert batches == [[message_1]]
+            yield message_2
+
+        kafka_consumer.__iter__.return_value = messages()
+
+        backend.consume_batch(handler=batches.append, on_revoke=on_revoke)
+
+        assert batches == [[message_1], [message_2]]
+
+    def test_consume_batch_commits_handled_messages_on_error(self):
+        consumer = MagicMock()
+        kafka_consumer = consumer.return_value.__enter__.return_value
+        kafka_consumer.is_auto_commit = False
+        messages = [
+            Mock(_meta=Mock(topic="t", partition=partition, offset=offset))
+            for partition, offset in [(0, 1), (1, 1), (0, 2), (1, 2), (0, 3)]
+        ]
+        kafka_consumer.__iter__.return_value = iter(messages)
+        config = {"consumer": {"group.id": "consumer.group.1", "batch_size": 5}}
+        backend = KafkaAvroBackend(
+            config,
+            consumer=consumer,
+            get_consumer_config=Mock(return_value=dict(config["consumer"])),
+        )
+
+        def handler(batch):
+            raise BatchError([batch[2], batch[4]])
+
+        with pytest.raises(BatchError):
+            backend.consume_batch(handler=handler)
+
+        kafka_consumer.commit.assert_called_once_with(
+            asynchronous=False, offsets=[TopicPartition("t", 0, 2), TopicPartition("t", 1, 3)]
+        )
+
+    def test_consume_subscribes_with_on_revoke(self):
+        consumer = MagicMock()
+        kafka_consumer = consumer.return_value.__enter__.return_value
+        kafka_consumer.__iter__.return_value = iter([])
+        config = {"consumer": {"group.id": "consumer.group.1"}}
+        backend = KafkaAvroBackend(
+            config,
+            consumer=consumer,
+            get_consumer_config=Mock(return_value=dict(config["consumer"])),
+        )
+        on_revoke = Mock()
+
+        backend.consume(handler=Mock(), on_revoke=on_revoke)
+        _, kwargs = kafka_consumer.subscribe.call_args
+        kwargs["on_revoke"](kafka_consumer, [Mock(topic="t", partition=1)])
+
+        on_revoke.assert_called_once_with([("t", 1)])
+
+    def test_produce_adds_message_class_header(self):
+        backend = self.backend()
+        backend.flush = False
+        backend.produce(value={"class": "FooEvent", "data": {}}, key="a", headers={"b": "c"})
+
+        backend.producer.produce.assert_called_once_with(
+            key="a",
+            value={"class": "FooEvent", "data": {}},
+            topic=None,
+            headers={"b": "c", "message_class": "FooEvent"},
+        )
+
+    def test_consume_with_skip_unhandled_uses_routed_get_message(self):
+        consumer = MagicMock()
+        consumer.return_value.__enter__.return_value = []
+        config = {"consumer": {"group.id": "consumer.group.1", "skip_unhandled": True}}
+        backend = KafkaAvroBackend(
+            config,
+            consumer=consumer,
+            get_consumer_config=Mock(return_value=dict(config["consumer"])),
+        )
+        message_filter = Mock()
+
+        backend.consume(handler=Mock(), message_filter=message_filter)
+
+        _, kwargs = consumer.call_args
+        assert kwargs["get_message"].func is get_routed_message
+        assert kwargs["get_message"].keywords == {"message_filter": message_filter}
+
+
+class GetRoutedMessageTests:
+    def setup_method(self):
+        self.consumer = Mock()
+        self.message = Mock()
+        self.message.error.return_value = None
+        self.message.headers.return_value = [("message_class", b"FooEvent")]
+
+    @patch(f"{routing_module}.statsd")
+    @patch(f"{routing_module}.get_message_serializer")
+    @patch(f"{routing_module}.poll_raw")
+    def test_skips_unhandled_message_without_decoding(
+        self, mock_poll_raw, mock_get_serializer, mock_statsd
+    ):
+        mock_poll_raw.return_value = self.message
+
+        message = get_routed_message(
+            self.consumer, error_handler=Mock(), message_filter=lambda c: False
+        )
+
+        assert message is None
+        mock_poll_raw.assert_called_once_with(self.consumer, 0.1)
+        mock_get_serializer.return_value.decode_message.assert_not_called()
+        mock_statsd.increment.assert_called_once_with(
+            "eventsourcing_helpers.messagebus.kafka.handle.skipped",
+            tags=["message_class:FooEvent"],
+        )
+
+    @patch(f"{routing_module}.get_message_serializer")
+    @patch(f"{routing_module}.poll_raw")
+    def test_decodes_handled_message(self, mock_poll_raw, mock_get_serializer):
+        mock_poll_raw.return_value = self.message
+
+        message = get_routed_message(
+            self.consumer, error_handler=Mock(), message_filter=lambda c: c == "FooEvent"
+        )
+
+        assert message is self.message
+        mock_get_serializer.assert_called_once_with(self.consumer)
+        self.message.set_value.assert_called_once_with(
+            mock_get_serializer.return_value.decode_message.return_value
+        )
+
+    @patch(f"{routing_module}.get_message_serializer")
+    @patch(f"{routing_module}.poll_raw")
+    def test_decodes_message_without_class_header(self, mock_poll_raw, mock_get_serializer):
+        self.message.headers.return_value = None
+        mock_poll_raw.return_value = self.message
+
+        message = get_routed_message(
+            self.consumer, error_handler=Mock(), message_filter=lambda c: False
+        )
+
+        assert message is self.message
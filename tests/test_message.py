@@ -1,9 +1,11 @@
+import copy
 from typing import NamedTuple
+from unittest.mock import Mock
 
 import pytest
 from pydantic import ValidationError
 
-from eventsourcing_helpers.message import Message, message_factory
+from eventsourcing_helpers.message import Message, MessageMeta, message_factory
 from eventsourcing_helpers.message.pydantic import PydanticMixin
 
 
@@ -102,3 +104,25 @@ class PydanticMixinTests:
         data_with_extra = {**self.data, "extra": "ignored"}
         message = FooEvent(**data_with_extra)
         assert "extra" not in message.to_dict()
+
+
+class MessageMetaTests:
+    def test_from_message(self):
+        kafka_meta = Mock(offset=1, partition=2, topic="foo", timestamp=1000, headers={"a": "b"})
+        meta = MessageMeta.from_message(Mock(_meta=kafka_meta))
+
+        assert (meta.offset, meta.partition, meta.topic, meta.timestamp) == (1, 2, "foo", 1000)
+        assert meta.headers == {"a": "b"}
+        assert not hasattr(meta, "__dict__")
+
+    def test_from_message_reuses_meta(self):
+        meta = MessageMeta(offset=1)
+        assert MessageMeta.from_message(Mock(_meta=meta)) is meta
+
+    def test_raw_headers_are_decoded(self):
+        assert MessageMeta(headers=[("a", b"b")]).headers == {"a": "b"}
+        assert MessageMeta().headers == {}
+
+    def test_deepcopy(self):
+        meta = MessageMeta(offset=1, headers={"a": "b"})
+        assert copy.deepcopy(meta) == meta
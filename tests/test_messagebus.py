@@ -0,0 +1,34 @@
+from unittest.mock import Mock
+
+from eventsourcing_helpers.messagebus import MessageBus
+
+
+class LegacyBackend:
+    def __init__(self, config):
+        self.handled = []
+
+    def consume(self, handler):
+        self.handled.append(handler)
+
+
+class MessageBusTests:
+    def create_messagebus(self, backend):
+        return MessageBus(
+            config={"backend": "backend", "backend_config": {}}, importer=lambda path: backend
+        )
+
+    def test_consume_drops_options_not_accepted_by_backend(self):
+        messagebus = self.create_messagebus(LegacyBackend)
+        handler = Mock()
+
+        messagebus.consume(handler, message_filter=Mock(), on_revoke=Mock())
+
+        assert messagebus.backend.handled == [handler]
+
+    def test_consume_passes_set_options(self):
+        messagebus = self.create_messagebus(Mock())
+        handler, message_filter = Mock(), Mock()
+
+        messagebus.consume(handler, message_filter=message_filter, on_revoke=None)
+
+        messagebus.backend.consume.assert_called_once_with(handler, message_filter=message_filter)
@@ -0,0 +1,95 @@
+from unittest.mock import MagicMock, Mock, call, patch
+
+import pytest
+
+from eventsourcing_helpers import metrics
+from eventsourcing_helpers.event_handler import EventHandler
+from eventsourcing_helpers.handler import HandlerRoute
+from eventsourcing_helpers.middleware import compose, count_errors, timed
+
+module = "eventsourcing_helpers.middleware"
+
+
+class MiddlewareTests:
+    def setup_method(self):
+        self.handler = Mock(return_value="result")
+        self.route = HandlerRoute(
+            "FooEvent", self.handler, None, "handler", ["message_class:FooEvent"], self.handler
+        )
+
+    def test_compose_order(self):
+        calls = []
+
+        def record(name):
+            def middleware(call_next, route):
+                def call(*args):
+                    calls.append(name)
+                    return call_next(*args)
+
+                return call
+
+            return middleware
+
+        call_chain = compose(self.handler, self.route, [record("outer"), record("inner")])
+
+        assert call_chain("event") == "result"
+        assert calls == ["outer", "inner"]
+        self.handler.assert_called_once_with("event")
+
+    def test_metrics_disabled_returns_handler(self):
+        call_chain = compose(self.handler, self.route, [timed("metric"), count_errors("error")])
+        assert call_chain is self.handler
+
+    @patch(f"{module}.metrics_enabled", return_value=True)
+    @patch.object(metrics, "statsd")
+    def test_timed(self, mock_statsd, *mocks):
+        call_chain = compose(self.handler, self.route, [timed("metric")])
+
+        mock_statsd.timed.assert_called_once_with("metric", tags=self.route.tags)
+        assert call_chain is mock_statsd.timed.return_value.return_value
+
+    @patch(f"{module}.metrics_enabled", return_value=True)
+    @patch.object(metrics, "statsd")
+    def test_count_errors(self, mock_statsd, *mocks):
+        self.handler.side_effect = ValueError
+        call_chain = compose(self.handler, self.route, [count_errors("error")])
+
+        with pytest.raises(ValueError):
+            call_chain("event")
+        mock_statsd.increment.assert_called_once_with("error", tags=self.route.tags)
+
+
+class HandlerMiddlewareTests:
+    def setup_method(self):
+        self.calls = []
+
+        def middleware(call_next, route):
+            self.calls.append(("compose", route.message_class))
+
+            def call(event):
+                self.calls.append(("call", event))
+                return call_next(event)
+
+            return call
+
+        self.event_handler = MagicMock()
+        self.event_handler.__name__ = "event_handler"
+
+        class FooEventHandler(EventHandler):
+            handlers = {"FooEvent": self.event_handler}
+
+        FooEventHandler.middleware = [middleware]
+        self.event = Mock(_class="FooEvent")
+        self.handler = FooEventHandler(Mock(return_value=self.event))
+
+    def test_middleware_composed_once(self):
+        message = Mock(value={"class": "FooEvent", "data": {}})
+        self.handler.handle(message)
+        self.handler.handle(message)
+
+        assert self.calls == [
+            ("compose", "FooEvent"),
+            ("call", self.event),
+            ("call", self.event),
+        ]
+        self.event_handler.assert_has_calls([call(self.event), call(self.event)])
@@ -1,3 +1,4 @@
+import threading
 from unittest.mock import Mock, patch
 
 import pytest
@@ -109,6 +110,20 @@ class EntityTests:
         assert len(self.aggregate_root._events) == 0
         assert len(self.entity._events) == 0
 
+    def test_staged_events_are_thread_local(self):
+        """
+        Test that events staged in another thread are not visible.
+        """
+        self.aggregate_root._events.append(self.event)
+        thread_events = []
+        thread = threading.Thread(target=lambda: thread_events.extend(Entity._events))
+        thread.start()
+        thread.join()
+
+        assert thread_events == []
+        assert Entity._events == [self.event]
+        self.aggregate_root._clear_staged_events()
+
     def test_create_id(self):
         """
         Test that the returned id is a string and with correct length.
@@ -0,0 +1,307 @@
+import threading
+import time
+from unittest.mock import MagicMock, Mock
+
+import pytest
+
+from eventsourcing_helpers.messagebus.backends.kafka import KafkaAvroBackend
+from eventsourcing_helpers.messagebus.backends.kafka.parallel import (
+    OffsetTracker,
+    ParallelDispatcher,
+    get_commit_offsets,
+)
+
+
+def create_message(offset, key=None, partition=0, topic="commands", message_class="Foo"):
+    return Mock(
+        value={"class": message_class},
+        _meta=Mock(topic=topic, partition=partition, offset=offset, key=key),
+    )
+
+
+class OffsetTrackerTests:
+    def setup_method(self):
+        self.tracker = OffsetTracker()
+
+    def test_pop_committable_only_contiguous(self):
+        tracked = [self.tracker.add(create_message(offset)) for offset in range(3)]
+        tracked[0].done = tracked[2].done = True
+
+        assert self.tracker.pop_committable() == [tracked[0].message]
+        assert self.tracker.pop_committable() == []
+
+        tracked[1].done = True
+        assert self.tracker.pop_committable() == [tracked[2].message]
+        assert len(self.tracker) == 0
+
+    def test_partitions_are_independent(self):
+        p0 = self.tracker.add(create_message(0, partition=0))
+        p1 = self.tracker.add(create_message(0, partition=1), done=True)
+
+        assert self.tracker.pop_committable() == [p1.message]
+        assert len(self.tracker) == 1
+        assert not p0.done
+
+    def test_revoke(self):
+        self.tracker.add(create_message(0, partition=0))
+        self.tracker.revoke([("commands", 0)])
+        assert len(self.tracker) == 0
+
+    def test_get_commit_offsets(self):
+        (offset,) = get_commit_offsets([create_message(9, partition=2)])
+        assert (offset.topic, offset.partition, offset.offset) == ("commands", 2, 10)
+
+
+class ParallelDispatcherTests:
+    def test_same_key_is_handled_in_order(self):
+        handled = []
+
+        def handler(message):
+            time.sleep(0.001 * (10 - message._meta.offset))
+            handled.append((message._meta.key, message._meta.offset))
+
+        dispatcher = ParallelDispatcher(handler, workers=4)
+        for offset in range(10):
+            dispatcher.submit(create_message(offset, key=f"id-{offset % 3}"))
+        dispatcher.join()
+        dispatcher.shutdown()
+
+        for key in ("id-0", "id-1", "id-2"):
+            offsets = [offset for k, offset in handled if k == key]
+            assert offsets == sorted(offsets)
+        assert len(handled) == 10
+        assert dispatcher.pop_committable()[0]._meta.offset == 9
+
+    def test_handles_keys_in_parallel(self):
+        barrier = threading.Barrier(2, timeout=1)
+        dispatcher = ParallelDispatcher(lambda message: barrier.wait(), workers=2)
+        # keys chosen to hash to different workers
+        keys = ["a", "d"]
+        assert len({dispatcher._pool.get_worker(k) for k in keys}) == 2
+
+        for offset, key in enumerate(keys):
+            dispatcher.submit(create_message(offset, key=key))
+        dispatcher.join()
+        dispatcher.shutdown()
+
+        dispatcher.raise_for_error()
+
+    def test_max_in_flight(self):
+        release = threading.Event()
+        dispatcher = ParallelDispatcher(lambda message: release.wait(), max_in_flight=1)
+        dispatcher.submit(create_message(0))
+
+        thread = threading.Thread(target=dispatcher.submit, args=(create_message(1),))
+        thread.start()
+        thread.join(timeout=0.1)
+        assert thread.is_alive()
+
+        release.set()
+        thread.join()
+        dispatcher.join()
+        dispatcher.shutdown()
+
+    def test_error_stops_handling(self):
+        handler = Mock(side_effect=[ValueError, None])
+        dispatcher = ParallelDispatcher(handler, workers=1)
+        dispatcher.submit(create_message(0))
+        dispatcher.submit(create_message(1))
+        dispatcher.join()
+        dispatcher.shutdown()
+
+        assert handler.call_count == 1
+        assert dispatcher.pop_committable() == []
+        with pytest.raises(ValueError):
+            dispatcher.raise_for_error()
+
+
+class LaneTests:
+    def test_slow_lane_does_not_block_other_classes(self):
+        release = threading.Event()
+        handled = []
+
+        def handler(message):
+            if message.value["class"] == "Slow":
+                release.wait(5)
+            handled.append(message._meta.offset)
+
+        lanes = {"slow": {"classes": ["Slow"], "workers": 1, "queue_depth": 2}}
+        dispatcher = ParallelDispatcher(handler, workers=1, lanes=lanes)
+        dispatcher.submit(create_message(0, key="a", message_class="Slow"))
+        dispatcher.submit(create_message(1, key="b", message_class="Slow"))
+        for offset in range(2, 5):
+            dispatcher.submit(create_message(offset, key="c"))
+
+        dispatcher._pool.join()
+        assert handled == [2, 3, 4]
+        (lane,) = dispatcher.lanes
+        assert lane.in_flight == 2
+
+        release.set()
+        dispatcher.join()
+        dispatcher.shutdown()
+
+        assert handled[3:] == [0, 1]
+        assert lane.in_flight == 0
+        assert dispatcher.pop_committable()[0]._meta.offset == 4
+
+    def test_same_key_is_handled_in_order_within_lane(self):
+        handled = []
+
+        def handler(message):
+            time.sleep(0.001 * (5 - message._meta.offset))
+            handled.append(message._meta.offset)
+
+        lanes = {"slow": {"classes": ["Slow"], "workers": 3}}
+        dispatcher = ParallelDispatcher(handler, workers=1, lanes=lanes)
+        for offset in range(5):
+            dispatcher.submit(create_message(offset, key="a", message_class="Slow"))
+        dispatcher.join()
+        dispatcher.shutdown()
+
+        assert handled == list(range(5))
+
+    def test_timed_out_handler_keeps_the_key(self):
+        release = threading.Event()
+        calls = []
+
+        def handler(message):
+            calls.append(("start", message._meta.offset))
+            if message._meta.offset == 0:
+                release.wait(5)
+            calls.append(("end", message._meta.offset))
+
+        lanes = {"slow": {"classes": ["Slow"], "timeout": 0.01, "backoff": 0}}
+        dispatcher = ParallelDispatcher(handler, workers=1, lanes=lanes)
+        for offset in range(2):
+            dispatcher.submit(create_message(offset, key="a", message_class="Slow"))
+        time.sleep(0.05)
+
+        assert calls == [("start", 0)]
+        release.set()
+        dispatcher.join()
+        dispatcher.shutdown()
+
+        dispatcher.raise_for_error()
+        assert calls == [("start", 0), ("end", 0), ("start", 1), ("end", 1)]
+        assert dispatcher.pop_committable()[0]._meta.offset == 1
+
+    def test_same_key_is_handled_in_order_across_lanes(self):
+        release = threading.Event()
+        handled = []
+
+        def handler(message):
+            if message._meta.offset == 0:
+                release.wait(5)
+            handled.append(message._meta.offset)
+
+        lanes = {"slow": {"classes": ["Slow"]}}
+        dispatcher = ParallelDispatcher(handler, workers=1, lanes=lanes)
+        dispatcher.submit(create_message(0, key="a", message_class="Slow"))
+        dispatcher.submit(create_message(1, key="a"))
+        dispatcher.submit(create_message(2, key="b"))
+        dispatcher._pool.join()
+
+        assert handled == [2]
+        release.set()
+        dispatcher.join()
+        dispatcher.shutdown()
+
+        assert handled == [2, 0, 1]
+        assert dispatcher._keys == {}
+
+    def test_error_is_retried_until_handled(self):
+        handler = Mock(side_effect=[ValueError, ValueError, None])
+        lanes = {"slow": {"classes": ["Slow"], "backoff": 0}}
+        dispatcher = ParallelDispatcher(handler, workers=1, lanes=lanes)
+
+        message = create_message(0, key="a", message_class="Slow")
+        dispatcher.submit(message)
+        dispatcher._pool.join()
+        (lane,) = dispatcher.lanes
+        lane._pool.join()
+        dispatcher.shutdown()
+
+        dispatcher.raise_for_error()
+        assert handler.call_count == 3
+        assert dispatcher.pop_committable() == [message]
+
+    def test_join_gives_up_retries(self):
+        handler = Mock(side_effect=ValueError)
+        lanes = {"slow": {"classes": ["Slow"], "backoff": 60}}
+        dispatcher = ParallelDispatcher(handler, workers=1, lanes=lanes)
+
+        dispatcher.submit(create_message(0, key="a", message_class="Slow"))
+        dispatcher.join()
+        dispatcher.shutdown()
+
+        dispatcher.raise_for_error()
+        assert dispatcher.pop_committable() == []
+
+    def test_max_attempts_requires_dead_letter(self):
+        lanes = {"slow": {"classes": ["Slow"], "max_attempts": 3}}
+
+        with pytest.raises(AssertionError):
+            ParallelDispatcher(Mock(), workers=1, lanes=lanes)
+
+    def test_full_lane_pauses_partition(self):
+        release = threading.Event()
+        lanes = {"slow": {"classes": ["Slow"], "queue_depth": 1}}
+        dispatcher = ParallelDispatcher(lambda m: release.wait(5), workers=1, lanes=lanes)
+
+        for offset in range(3):
+            dispatcher.submit(create_message(offset, key="a", message_class="Slow"))
+        dispatcher.submit(create_message(0, key="b", partition=1, message_class="Slow"))
+
+        assert dispatcher.update_paused() == ([("commands", 0), ("commands", 1)], [])
+        assert dispatcher.update_paused() == ([], [])
+
+        release.set()
+        (lane,) = dispatcher.lanes
+        while dispatcher._held_back:
+            lane._pool.join()
+            dispatcher.update_paused()
+        dispatcher.join()
+        dispatcher.shutdown()
+
+        assert dispatcher.update_paused() == ([], [])
+        assert [m._meta.offset for m in dispatcher.pop_committable()] == [2, 0]
+
+
+class ParallelConsumeTests:
+    def create_backend(self, messages):
+        consumer = MagicMock()
+        self.kafka_consumer = consumer.return_value.__enter__.return_value
+        self.kafka_consumer.__iter__.return_value = iter(messages)
+        self.kafka_consumer.is_auto_commit = False
+        config = {"consumer": {"group.id": "group", "parallel": {"workers": 2}}}
+        return KafkaAvroBackend(
+            config,
+            consumer=consumer,
+            get_consumer_config=Mock(return_value=dict(config["consumer"])),
+            get_offset_watchdog_config=Mock(return_value=None),
+        )
+
+    def test_consume_commits_handled_offsets(self):
+        messages = [create_message(offset, key=str(offset)) for offset in range(4)]
+        backend = self.create_backend(messages + [None])
+        handler = Mock()
+
+        backend.consume(handler=handler)
+
+        assert handler.call_count == 4
+        committed = [
+            (tp.partition, tp.offset)
+            for c in self.kafka_consumer.commit.call_args_list
+            for tp in c.kwargs["offsets"]
+        ]
+        assert committed[-1] == (0, 4)
+
+    def test_consume_raises_handler_error(self):
+        messages = [create_message(0, key="a"), create_message(1, key="a")]
+        backend = self.create_backend(messages)
+
+        with pytest.raises(ValueError):
+            backend.consume(handler=Mock(side_effect=ValueError))
+
+        self.kafka_consumer.commit.assert_not_called()
@@ -0,0 +1,116 @@
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from eventsourcing_helpers.event_handler import (
+    ProcessPoolEventHandler,
+    WorkerMessage,
+    batch_handler,
+)
+from eventsourcing_helpers.message import MessageMeta
+
+
+def square(event):
+    if event.value < 0:
+        raise ValueError("negative")
+    # the workers are spawned with the environment of the test process.
+    results = Path(os.environ["PROCESS_POOL_TEST_RESULTS"])
+    results.joinpath(str(event.value)).write_text(f"{event.value**2} {os.getpid()}")
+
+
+def append(event):
+    results = Path(os.environ["PROCESS_POOL_TEST_RESULTS"])
+    with results.joinpath(f"order-{event.Meta.key}").open("a") as f:
+        f.write(f"{event.value}\n")
+
+
+class SquareEventHandler(ProcessPoolEventHandler):
+    handlers = {"Squared": square, "Appended": append}
+    max_workers = 2
+
+
+def create_message(value, offset=0, message_class="Squared", key=None):
+    meta = SimpleNamespace(
+        key=key, offset=offset, partition=0, topic="events", timestamp=None, headers=[]
+    )
+    return SimpleNamespace(value={"class": message_class, "data": {"value": value}}, _meta=meta)
+
+
+class ProcessPoolEventHandlerTests:
+    @classmethod
+    def setup_class(cls):
+        cls.results = tempfile.TemporaryDirectory()
+        os.environ["PROCESS_POOL_TEST_RESULTS"] = cls.results.name
+        cls.handler = SquareEventHandler()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.handler.close()
+        cls.results.cleanup()
+        del os.environ["PROCESS_POOL_TEST_RESULTS"]
+
+    def get_results(self):
+        results = {}
+        for path in Path(self.results.name).iterdir():
+            value, pid = path.read_text().split()
+            results[int(path.name)] = (int(value), int(pid))
+            path.unlink()
+        return results
+
+    def test_handle_batch(self):
+        messages = [create_message(v, offset=v) for v in range(10)]
+        messages.insert(3, create_message(11, message_class="Unhandled"))
+
+        assert self.handler.handle_batch(messages) is None
+
+        results = self.get_results()
+        assert {v: r[0] for v, r in results.items()} == {v: v**2 for v in range(10)}
+        assert os.getpid() not in {r[1] for r in results.values()}
+
+    def test_handle_batch_keeps_order_per_key(self):
+        messages = [
+            create_message(v, offset=v, message_class="Appended", key="ab"[v % 2])
+            for v in range(20)
+        ]
+
+        self.handler.handle_batch(messages)
+
+        for key in "ab":
+            path = Path(self.results.name, f"order-{key}")
+            assert path.read_text().split() == [str(v) for v in range(20) if "ab"[v % 2] == key]
+            path.unlink()
+
+    def test_batch_handlers_are_rejected(self):
+        class BatchEventHandler(ProcessPoolEventHandler):
+            handlers = {"Squared": batch_handler(lambda events: None)}
+
+        with pytest.raises(AssertionError):
+            BatchEventHandler(start_pool=False)
+
+    def test_handle(self):
+        self.handler.handle(create_message(3))
+        self.handler.handle(create_message(4, message_class="Unhandled"))
+
+        assert {v: r[0] for v, r in self.get_results().items()} == {3: 9}
+
+    def test_handler_error_is_raised(self):
+        with pytest.raises(ValueError):
+            self.handler.handle_batch([create_message(1), create_message(-1)])
+
+    def test_not_started(self):
+        handler = SquareEventHandler(start_pool=False)
+        with pytest.raises(AssertionError):
+            handler.handle_batch([create_message(1)])
+
+
+def test_worker_message_is_compact():
+    message = WorkerMessage({"class": "Squared", "data": {}}, MessageMeta(offset=1, topic="t"))
+    loaded = pickle.loads(pickle.dumps(message))
+
+    assert loaded.value == message.value
+    assert loaded._meta == message._meta
+    assert not hasattr(message, "__dict__")
@@ -0,0 +1,179 @@
+from unittest.mock import MagicMock, Mock
+
+import pytest
+
+from eventsourcing_helpers.messagebus.backends.kafka import KafkaAvroBackend
+from eventsourcing_helpers.messagebus.backends.kafka.retry import RetryScheduler
+
+
+def create_message(offset, key=None, partition=0, topic="commands"):
+    return Mock(
+        value={"class": "Foo", "data": {}},
+        _meta=Mock(topic=topic, partition=partition, offset=offset, key=key, headers={}),
+    )
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FailingHandler:
+    """
+    Fails the given number of times for each message offset.
+    """
+
+    def __init__(self, failures):
+        self.failures = dict(failures)
+        self.handled = []
+
+    def __call__(self, message):
+        offset = message._meta.offset
+        if self.failures.get(offset, 0) > 0:
+            self.failures[offset] -= 1
+            raise ValueError(offset)
+        self.handled.append(offset)
+
+
+class RetrySchedulerTests:
+    def setup_method(self):
+        self.clock = Clock()
+        self.dead_letter = Mock()
+
+    def create_scheduler(self, handler, **kwargs):
+        kwargs = {"dead_letter": self.dead_letter, "max_attempts": 3, "backoff": 1.0, **kwargs}
+        return RetryScheduler(handler, clock=self.clock, **kwargs)
+
+    def test_failed_key_is_parked_while_other_keys_flow(self):
+        handler = FailingHandler({0: 1})
+        scheduler = self.create_scheduler(handler)
+
+        scheduler.submit(create_message(0, key="a"))
+        scheduler.submit(create_message(1, key="a"))
+        scheduler.submit(create_message(2, key="b"))
+
+        assert handler.handled == [2]
+        assert scheduler.num_parked == 2
+
+        scheduler.process_due()
+        assert handler.handled == [2]
+
+        self.clock.now = 1.0
+        scheduler.process_due()
+        assert handler.handled == [2, 0, 1]
+        assert scheduler.num_parked == 0
+
+    def test_commit_position_never_passes_parked_message(self):
+        handler = FailingHandler({0: 1})
+        scheduler = self.create_scheduler(handler)
+        messages = [create_message(0, key="a"), create_message(1, key="b")]
+
+        for message in messages:
+            scheduler.submit(message)
+        assert scheduler.pop_committable() == []
+
+        self.clock.now = 1.0
+        scheduler.process_due()
+        assert scheduler.pop_committable() == [messages[1]]
+
+    def test_exponential_backoff(self):
+        scheduler = self.create_scheduler(Mock(), multiplier=2.0, max_backoff=3.0)
+
+        assert [scheduler.get_delay(attempts) for attempts in range(1, 5)] == [1, 2, 3, 3]
+
+    def test_dead_letter_after_max_attempts(self):
+        handler = FailingHandler({0: 10})
+        scheduler = self.create_scheduler(handler)
+        messages = [create_message(0, key="a"), create_message(1, key="a")]
+
+        for message in messages:
+            scheduler.submit(message)
+        for now in (1.0, 3.0):
+            self.clock.now = now
+            scheduler.process_due()
+
+        message, error, attempts = self.dead_letter.call_args.args
+        assert message is messages[0]
+        assert isinstance(error, ValueError)
+        assert attempts == 3
+        assert handler.handled == [1]
+        assert scheduler.pop_committable() == [messages[1]]
+
+    def test_raises_after_max_attempts_without_dead_letter(self):
+        scheduler = self.create_scheduler(Mock(side_effect=ValueError), dead_letter=None)
+        scheduler.submit(create_message(0, key="a"))
+
+        with pytest.raises(ValueError):
+            for now in (1.0, 3.0):
+                self.clock.now = now
+                scheduler.process_due()
+
+    def test_wait_for_capacity(self):
+        handler = FailingHandler({0: 1})
+        scheduler = self.create_scheduler(handler, max_parked=1)
+        scheduler.submit(create_message(0, key="a"))
+
+        def sleep(seconds):
+            self.clock.now += seconds
+
+        scheduler.wait_for_capacity(sleep=sleep)
+
+        assert self.clock.now == 1.0
+        assert scheduler.num_parked == 0
+
+    def test_revoke_forgets_parked_messages(self):
+        scheduler = self.create_scheduler(Mock(side_effect=ValueError))
+        scheduler.submit(create_message(0, key="a", partition=1))
+
+        scheduler.revoke([("commands", 1)])
+
+        assert scheduler.num_parked == 0
+        self.clock.now = 10.0
+        scheduler.process_due()
+        assert scheduler.pop_committable() == []
+
+
+class RetryConsumeTests:
+    def create_backend(self, messages, retry):
+        consumer = MagicMock()
+        self.kafka_consumer = consumer.return_value.__enter__.return_value
+        self.kafka_consumer.__iter__.return_value = iter(messages)
+        self.kafka_consumer.is_auto_commit = False
+        self.producer = Mock()
+        config = {"consumer": {"group.id": "group", "retry": retry}}
+        return KafkaAvroBackend(
+            config,
+            consumer=consumer,
+            producer=Mock(return_value=self.producer),
+            get_producer_config=Mock(return_value={"bootstrap.servers": "localhost"}),
+            get_consumer_config=Mock(return_value=dict(config["consumer"])),
+            get_offset_watchdog_config=Mock(return_value=None),
+        )
+
+    def test_consume_routes_to_dead_letter_topic(self):
+        messages = [create_message(0, key="a"), create_message(1, key="b")]
+        retry = {"max_attempts": 1, "dead_letter_topic": "commands.dlq"}
+        backend = self.create_backend(messages, retry)
+        handler = FailingHandler({0: 1})
+
+        backend.consume(handler=handler)
+
+        assert handler.handled == [1]
+        kwargs = self.producer.produce.call_args.kwargs
+        assert kwargs["topic"] == "commands.dlq"
+        assert kwargs["key"] == "a"
+        assert kwargs["headers"]["dead_letter_offset"] == "0"
+        assert kwargs["headers"]["dead_letter_attempts"] == "1"
+        (offset,) = self.kafka_consumer.commit.call_args.kwargs["offsets"]
+        assert offset.offset == 2
+
+    def test_consume_does_not_commit_parked_messages(self):
+        messages = [create_message(0, key="a"), create_message(1, key="b")]
+        backend = self.create_backend(messages, {"backoff": 60})
+
+        backend.consume(handler=FailingHandler({0: 1}))
+
+        self.kafka_consumer.commit.assert_not_called()
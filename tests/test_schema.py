@@ -0,0 +1,151 @@
+import json
+from typing import Optional
+from unittest.mock import Mock, patch
+
+import pytest
+
+from eventsourcing_helpers.command_handler import CommandHandler
+from eventsourcing_helpers.message.schema import (
+    MessageClassRegistry,
+    SchemaMessage,
+    create_message_class,
+    get_message_schemas,
+)
+from eventsourcing_helpers.serializers import from_message_to_dto, to_message_from_dto
+
+order_created = {
+    "type": "record",
+    "name": "OrderCreated",
+    "namespace": "com.example.orders",
+    "fields": [
+        {"name": "id", "type": "string"},
+        {"name": "state", "type": "string", "default": "open"},
+        {"name": "note", "type": ["null", "string"]},
+        {"name": "items", "type": {"type": "array", "items": "string"}, "default": []},
+    ],
+}
+order_completed = {
+    "type": "record",
+    "name": "OrderCompleted",
+    "fields": [{"name": "id", "type": "string"}],
+}
+envelope = {
+    "type": "record",
+    "name": "OrderEvents",
+    "fields": [
+        {"name": "class", "type": "string"},
+        {"name": "data", "type": [order_created, order_completed]},
+    ],
+}
+
+
+class SchemaMessageTests:
+    def setup_method(self):
+        self.message_cls = create_message_class(order_created)
+
+    def test_class(self):
+        assert self.message_cls.__name__ == "OrderCreated"
+        assert issubclass(self.message_cls, SchemaMessage)
+        assert self.message_cls.__annotations__["id"] is str
+        assert self.message_cls.__annotations__["note"] == Optional[str]
+
+    def test_defaults_for_optional_fields(self):
+        message = self.message_cls(id="1")
+        assert message.to_dict() == {"id": "1", "state": "open", "note": None, "items": []}
+        assert message._class == "OrderCreated"
+        assert message.Meta is None
+
+    def test_mutable_defaults_are_not_shared(self):
+        assert self.message_cls(id="1").items is not self.message_cls(id="2").items
+
+    def test_missing_required_field_should_raise(self):
+        with pytest.raises(TypeError):
+            self.message_cls(state="open")
+
+    def test_old_message_tolerates_missing_required_field(self):
+        message = self.message_cls.from_record({"state": "open"}, is_new=False)
+        assert message.id is None
+        assert message.unknown_field is None
+
+    def test_new_message_unknown_attribute_should_raise(self):
+        with pytest.raises(AttributeError):
+            self.message_cls(id="1").unknown_field
+
+    def test_unknown_fields_are_ignored(self):
+        message = self.message_cls(id="1", removed_field="foo")
+        assert not hasattr(message, "removed_field")
+
+    def test_read_only(self):
+        message = self.message_cls(id="1")
+        with pytest.raises(AttributeError):
+            message.id = "2"
+
+    def test_slotted(self):
+        assert not hasattr(self.message_cls(id="1"), "__dict__")
+
+    def test_from_record_and_serialize(self):
+        meta = Mock()
+        message = self.message_cls.from_record({"id": "1", "state": "done"}, meta=meta)
+        assert message.Meta is meta
+        assert to_message_from_dto(message) == {
+            "class": "OrderCreated",
+            "data": {"id": "1", "state": "done", "note": None, "items": []},
+        }
+
+
+class MessageClassRegistryTests:
+    def setup_method(self):
+        self.registry = MessageClassRegistry()
+
+    def test_get_message_schemas_from_envelope(self):
+        schemas = get_message_schemas(envelope)
+        assert [s["name"] for s in schemas] == ["OrderCreated", "OrderCompleted"]
+
+    def test_register_from_directory(self, tmp_path):
+        (tmp_path / "orders-value.avsc").write_text(json.dumps(envelope))
+        classes = self.registry.register_from_directory(tmp_path)
+
+        assert set(classes) == {"OrderCreated", "OrderCompleted"}
+        assert self.registry["OrderCompleted"] is classes["OrderCompleted"]
+
+    def test_register_from_registry(self):
+        schema_registry = Mock()
+        schema_registry.get_latest_schema.return_value = json.dumps(order_completed)
+        self.registry.register_from_registry(schema_registry, ["orders-value"])
+
+        schema_registry.get_latest_schema.assert_called_once_with("orders-value")
+        assert "OrderCompleted" in self.registry
+
+    def test_from_message_to_dto_uses_registered_class(self):
+        self.registry.register_schemas([envelope])
+        message = Mock(value={"class": "OrderCreated", "data": {"id": "1"}})
+
+        dto = from_message_to_dto(message, is_new=False, registry=self.registry)
+
+        assert isinstance(dto, self.registry["OrderCreated"])
+        assert dto.state == "open"
+
+    def test_from_message_to_dto_replays_old_event(self):
+        self.registry.register_schemas([envelope])
+        message = Mock(value={"class": "OrderCompleted", "data": {}})
+
+        dto = from_message_to_dto(message, is_new=False, registry=self.registry)
+
+        assert dto.id is None
+
+    def test_command_handler_routes_use_registered_class(self):
+        self.registry.register_schemas([envelope])
+        message_deserializer = Mock(return_value=Mock(_class="OrderCompleted"))
+        handler = Mock()
+
+        class OrderCommandHandler(CommandHandler):
+            handlers = {"OrderCompleted": handler}
+
+        with patch("eventsourcing_helpers.handler.message_classes", self.registry):
+            command_handler = OrderCommandHandler(message_deserializer=message_deserializer)
+        message = Mock(value={"class": "OrderCompleted", "data": {"id": "1"}})
+        command_handler._process(message, command_handler._routes["OrderCompleted"])
+
+        message_deserializer.assert_called_once_with(
+            message, deserialize_class=self.registry["OrderCompleted"]
+        )
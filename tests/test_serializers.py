@@ -1,14 +1,18 @@
+from types import SimpleNamespace
 from typing import NamedTuple
 from unittest.mock import patch
 
-from eventsourcing_helpers.message import message_factory
+from eventsourcing_helpers.message import MessageMeta, message_factory
+from eventsourcing_helpers.message.meta import EMPTY_META
 from eventsourcing_helpers.serializers import from_message_to_dto, to_message_from_dto
 
 
 class Message:
     def __init__(self, data):
         self.value = data
-        self._meta = object()
+        self._meta = SimpleNamespace(
+            key="a", offset=1, partition=2, topic="foo", timestamp=3, headers={"b": "c"}
+        )
 
 
 class SerializerTests:
@@ -39,7 +43,18 @@ class SerializerTests:
 
         assert isinstance(result, TestClass)
         assert result.foo == "bar"
-        assert result.Meta == message._meta
+        assert result.Meta == MessageMeta(
+            offset=1, partition=2, topic="foo", timestamp=3, headers={"b": "c"}, key="a"
+        )
+
+    def test_from_message_to_dto_without_meta(self):
+        """
+        Test that a shared empty meta is attached when meta is not requested.
+        """
+        message = Message({"class": "FooClass", "data": {"foo": "bar"}})
+        result = from_message_to_dto(message, is_new=False, include_meta=False)
+
+        assert result._wrapped.Meta is EMPTY_META
 
     def test_to_message_from_dto(self):
         """
@@ -52,3 +67,11 @@ class SerializerTests:
 
         assert message["class"] == "FooEvent"
         assert message["data"]["id"] == 1
+
+    def test_to_message_from_dto_passes_serialized_message(self):
+        """
+        Test that an already serialized message is returned as is.
+        """
+        value = {"class": "FooEvent", "data": {"id": 1}}
+
+        assert to_message_from_dto(value) is value
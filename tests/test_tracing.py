@@ -0,0 +1,82 @@
+from unittest.mock import MagicMock, Mock, patch
+
+import pytest
+
+from eventsourcing_helpers.event_handler import EventHandler
+from eventsourcing_helpers.tracing import TraceSampler
+
+module = "eventsourcing_helpers.handler"
+
+
+class TraceSamplerTests:
+    def test_ratio(self):
+        assert TraceSampler(ratio=1.0).sample("FooEvent") is True
+        assert TraceSampler(ratio=0.0).sample("FooEvent") is False
+
+    @patch("eventsourcing_helpers.tracing.sampling.random", return_value=0.3)
+    def test_partial_ratio(self, mock_random):
+        assert TraceSampler(ratio=0.5).sample("FooEvent") is True
+        assert TraceSampler(ratio=0.2).sample("FooEvent") is False
+
+    def test_overrides(self):
+        sampler = TraceSampler(ratio=0.0, overrides={"FooEvent": 1.0})
+        assert sampler.sample("FooEvent") is True
+        assert sampler.sample("BarEvent") is False
+
+    def test_is_slow(self):
+        assert TraceSampler().is_slow(10**9) is False
+        sampler = TraceSampler(slow_threshold=0.5)
+        assert sampler.is_slow(int(0.4e9)) is False
+        assert sampler.is_slow(int(0.6e9)) is True
+
+
+class UnsampledHandlerTests:
+    def setup_method(self):
+        self.event_handler = MagicMock()
+        self.event_handler.__name__ = "event_handler"
+        self.event = Mock(_class="FooEvent")
+        self.message = Mock(value={"class": "FooEvent", "data": {}})
+
+    def create_handler(self, **sampler_kwargs):
+        class FooEventHandler(EventHandler):
+            handlers = {"FooEvent": self.event_handler}
+            trace_sampler = TraceSampler(ratio=0.0, **sampler_kwargs)
+
+        return FooEventHandler(Mock(return_value=self.event))
+
+    @patch(f"{module}.tracer.start_span")
+    @patch("eventsourcing_helpers.event_handler.tracer.start_span")
+    def test_unsampled_creates_no_spans(self, mock_start_span, mock_record_span):
+        self.create_handler().handle(self.message)
+
+        self.event_handler.assert_called_once_with(self.event)
+        mock_start_span.assert_not_called()
+        mock_record_span.assert_not_called()
+
+    @patch(f"{module}.tracer.start_span")
+    def test_unsampled_error_is_recorded(self, mock_start_span):
+        self.event_handler.side_effect = ValueError
+        handler = self.create_handler()
+
+        with pytest.raises(ValueError):
+            handler.handle(self.message)
+
+        mock_start_span.assert_called_once()
+        kwargs = mock_start_span.call_args.kwargs
+        assert kwargs["name"] == "eventsourcing_helpers.handle_event"
+        assert kwargs["resource_name"] == "event_handler"
+        assert isinstance(kwargs["start_time"], int)
+
+    @patch(f"{module}.tracer.start_span")
+    def test_unsampled_error_not_recorded(self, mock_start_span):
+        self.event_handler.side_effect = ValueError
+        handler = self.create_handler(always_sample_errors=False)
+
+        with pytest.raises(ValueError):
+            handler.handle(self.message)
+        mock_start_span.assert_not_called()
+
+    @patch(f"{module}.tracer.start_span")
+    def test_unsampled_slow_is_recorded(self, mock_start_span):
+        self.create_handler(slow_threshold=0.0).handle(self.message)
+        mock_start_span.assert_called_once()
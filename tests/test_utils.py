@@ -1,6 +1,10 @@
 import pytest
 
-from eventsourcing_helpers.utils import get_all_nested_keys, get_callable_representation
+from eventsourcing_helpers.utils import (
+    get_all_nested_keys,
+    get_callable_representation,
+    get_object_size,
+)
 
 
 class Test:
@@ -88,3 +92,12 @@ def test_get_all_nested_keys(data, expected_result):
     result = get_all_nested_keys(data, [])
     for expected_key in expected_result:
         assert expected_key in result
+
+
+def test_get_object_size():
+    shared = "a" * 1000
+    small, large = Test(), Test()
+    large.items = [shared, shared, {"b": "c" * 1000}]
+
+    assert get_object_size(large) > get_object_size(small) + 2000
+    assert get_object_size(large) < get_object_size(small) + 3000